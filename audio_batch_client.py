@@ -0,0 +1,119 @@
+"""Envia uma pasta de áudios ao gateway (POST /process-audio/batch).
+
+Os arquivos vão em lotes de até --batch-size arquivos e --max-batch-bytes
+por requisição (abaixo do limite de 512 MB por lote do gateway, que recusaria
+o lote com 413); o gateway os processa com concorrência limitada e devolve uma linha NDJSON por arquivo
+assim que cada um termina. As linhas são gravadas em --output conforme
+chegam e o progresso aparece no terminal.
+
+Uso:
+    python -m audio_batch_client ./gravacoes --output respostas.ndjson
+    python -m audio_batch_client ./gravacoes --gateway http://servidor:8000 --concurrency 8
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from contextlib import ExitStack
+from typing import Iterable, List, Optional, Tuple
+
+import httpx
+
+AUDIO_EXTENSIONS = {'.mp3', '.wav', '.m4a', '.ogg', '.flac', '.webm', '.mp4'}
+# Abaixo de GATEWAY_BATCH_MAX_BYTES (padrão 512 MB), com folga para o multipart
+DEFAULT_MAX_BATCH_BYTES = 400 * 1024 * 1024
+
+
+def list_audio_files(paths: List[str]) -> List[str]:
+    """Arquivos de áudio das pastas (recursivamente) e arquivos indicados, em ordem"""
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                found.extend(os.path.join(root, name) for name in names
+                             if os.path.splitext(name)[1].lower() in AUDIO_EXTENSIONS)
+        else:
+            found.append(path)
+    return sorted(found)
+
+
+def plan_batches(paths: List[str], max_files: int, max_bytes: int) -> Iterable[Tuple[int, List[str]]]:
+    """Divide os arquivos em lotes consecutivos por quantidade e tamanho; gera (offset, lote)"""
+    offset, batch, batch_bytes = 0, [], 0
+    for path in paths:
+        size = os.path.getsize(path)
+        if batch and (len(batch) >= max_files or batch_bytes + size > max_bytes):
+            yield offset, batch
+            offset += len(batch)
+            batch, batch_bytes = [], 0
+        batch.append(path)
+        batch_bytes += size
+    if batch:
+        yield offset, batch
+
+
+def send_batch(client: httpx.Client, url: str, paths: List[str], offset: int,
+               concurrency: Optional[int], output) -> dict:
+    """Envia um lote e repassa as linhas do NDJSON; retorna a linha de resumo"""
+    params = {"concurrency": concurrency} if concurrency else None
+    with ExitStack() as stack:
+        files = [("files", (os.path.basename(path), stack.enter_context(open(path, "rb"))))
+                 for path in paths]
+        with client.stream("POST", f"{url}/process-audio/batch", files=files, params=params) as response:
+            if response.status_code != 200:
+                response.read()
+                raise RuntimeError(f"Gateway respondeu {response.status_code}: {response.text}")
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                data = json.loads(line)
+                if data.get("type") == "summary":
+                    return data
+                # Índice e caminho relativos à pasta inteira, não ao lote
+                data["index"] += offset
+                data["path"] = paths[data["index"] - offset]
+                output.write(json.dumps(data, ensure_ascii=False) + "\n")
+                output.flush()
+                status = "ok" if data["status"] == "ok" else f"erro {data['status_code']}"
+                print(f"[{data['index'] + 1}] {data['path']}: {status} "
+                      f"({data['timings_ms']['total'] / 1000:.1f}s)", file=sys.stderr)
+    raise RuntimeError("Resposta do gateway terminou antes do resumo")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Processa uma pasta de áudios pelo gateway em lote")
+    parser.add_argument("paths", nargs="+", help="Pastas ou arquivos de áudio")
+    parser.add_argument("--gateway", default=os.getenv("GATEWAY_URL", "http://localhost:8000"))
+    parser.add_argument("--batch-size", type=int, default=200, help="Arquivos por requisição")
+    parser.add_argument("--max-batch-bytes", type=int, default=DEFAULT_MAX_BATCH_BYTES,
+                        help="Bytes de áudio por requisição (deve ficar abaixo de GATEWAY_BATCH_MAX_BYTES)")
+    parser.add_argument("--concurrency", type=int, help="Itens em paralelo por lote (limitado pelo gateway)")
+    parser.add_argument("--timeout", type=float, default=3600)
+    parser.add_argument("--output", help="Arquivo NDJSON com os resultados (padrão: saída padrão)")
+    args = parser.parse_args()
+
+    paths = list_audio_files(args.paths)
+    if not paths:
+        parser.error("nenhum arquivo de áudio encontrado")
+
+    started = time.perf_counter()
+    ok = 0
+    output = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    try:
+        with httpx.Client(timeout=httpx.Timeout(args.timeout, connect=10)) as client:
+            for offset, batch in plan_batches(paths, max(1, args.batch_size), args.max_batch_bytes):
+                summary = send_batch(client, args.gateway.rstrip("/"), batch, offset, args.concurrency, output)
+                ok += summary["ok"]
+    finally:
+        if args.output:
+            output.close()
+
+    elapsed = time.perf_counter() - started
+    print(f"{ok}/{len(paths)} arquivos processados em {elapsed:.1f}s", file=sys.stderr)
+    if ok < len(paths):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""
+Normalização do áudio no gateway antes de enviá-lo ao Whisper: downmix para
+mono, reamostragem para 16 kHz, corte do silêncio no início e no fim e
+recodificação opcional em Opus. Usa apenas o ffmpeg e a biblioteca padrão.
+"""
+import io
+import math
+import os
+import subprocess
+import tempfile
+import time
+import wave
+from array import array
+from typing import Tuple
+
+SAMPLE_RATE = 16000
+BYTES_PER_SAMPLE = 2
+
+# Contêineres que o ffmpeg só lê de arquivo com seek (moov no fim do mp4)
+SEEKABLE_ONLY_FORMATS = {".mp4", ".m4a"}
+
+CODECS = {
+    "wav": (".wav", "audio/wav"),
+    "opus": (".ogg", "audio/ogg"),
+}
+
+
+class AudioNormalizationError(Exception):
+    pass
+
+
+def run_ffmpeg(args: list, stdin: bytes = None) -> bytes:
+    try:
+        result = subprocess.run(
+            ["ffmpeg", "-nostdin", "-loglevel", "error", *args],
+            input=stdin,
+            capture_output=True,
+            check=True
+        )
+    except FileNotFoundError:
+        raise AudioNormalizationError("ffmpeg não encontrado")
+    except subprocess.CalledProcessError as e:
+        raise AudioNormalizationError(e.stderr.decode(errors="replace").strip())
+    return result.stdout
+
+
+def decode_to_pcm16(content: bytes, suffix: str) -> bytes:
+    """Decodifica para PCM 16 bits, mono, 16 kHz"""
+    output_args = ["-f", "s16le", "-ac", "1", "-ar", str(SAMPLE_RATE), "pipe:1"]
+    if suffix not in SEEKABLE_ONLY_FORMATS:
+        return run_ffmpeg(["-i", "pipe:0", *output_args], stdin=content)
+
+    with tempfile.NamedTemporaryFile(suffix=suffix) as tmp:
+        tmp.write(content)
+        tmp.flush()
+        return run_ffmpeg(["-i", tmp.name, *output_args])
+
+
+def trim_silence(pcm: bytes, threshold_db: float = -40.0, frame_ms: int = 20, padding_ms: int = 200) -> bytes:
+    """
+    Remove o silêncio do início e do fim: procura, a partir de cada ponta, o
+    primeiro quadro cujo pico passa do limiar (em dBFS) e mantém uma margem
+    antes dele. Áudio inteiramente silencioso é devolvido sem cortes.
+    """
+    samples = array("h")
+    samples.frombytes(pcm[:len(pcm) - len(pcm) % BYTES_PER_SAMPLE])
+    frame = SAMPLE_RATE * frame_ms // 1000
+    padding = SAMPLE_RATE * padding_ms // 1000
+    threshold = 32768 * math.pow(10, threshold_db / 20)
+
+    def is_loud(start: int) -> bool:
+        window = samples[start:start + frame]
+        return max(max(window), -min(window)) > threshold
+
+    starts = range(0, len(samples), frame)
+    first = next((s for s in starts if is_loud(s)), None)
+    if first is None:
+        return pcm
+    last = next(s for s in reversed(starts) if is_loud(s))
+
+    begin = max(0, first - padding)
+    end = min(len(samples), last + frame + padding)
+    return samples[begin:end].tobytes()
+
+
+def encode_wav(pcm: bytes) -> bytes:
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(BYTES_PER_SAMPLE)
+        wav.setframerate(SAMPLE_RATE)
+        wav.writeframes(pcm)
+    return buffer.getvalue()
+
+
+def encode_opus(pcm: bytes, bitrate: str) -> bytes:
+    return run_ffmpeg([
+        "-f", "s16le", "-ac", "1", "-ar", str(SAMPLE_RATE), "-i", "pipe:0",
+        "-c:a", "libopus", "-b:a", bitrate, "-application", "voip",
+        "-f", "ogg", "pipe:1"
+    ], stdin=pcm)
+
+
+def normalize_audio(
+    content: bytes,
+    suffix: str,
+    codec: str = "opus",
+    threshold_db: float = -40.0,
+    opus_bitrate: str = "24k"
+) -> Tuple[bytes, str, str, dict]:
+    """
+    Normaliza o áudio; retorna (conteúdo, extensão, content type, estatísticas)
+    com bytes e duração antes e depois
+    """
+    if codec not in CODECS:
+        raise AudioNormalizationError(f"Codec desconhecido: {codec}")
+
+    started = time.perf_counter()
+    pcm = decode_to_pcm16(content, suffix)
+    trimmed = trim_silence(pcm, threshold_db)
+    output = encode_wav(trimmed) if codec == "wav" else encode_opus(trimmed, opus_bitrate)
+
+    original_duration = len(pcm) / (SAMPLE_RATE * BYTES_PER_SAMPLE)
+    duration = len(trimmed) / (SAMPLE_RATE * BYTES_PER_SAMPLE)
+    output_suffix, content_type = CODECS[codec]
+    stats = {
+        "codec": codec,
+        "original_bytes": len(content),
+        "normalized_bytes": len(output),
+        "bytes_saved": len(content) - len(output),
+        "original_duration_s": round(original_duration, 2),
+        "normalized_duration_s": round(duration, 2),
+        "duration_saved_s": round(original_duration - duration, 2),
+        "normalize_ms": round((time.perf_counter() - started) * 1000, 1)
+    }
+    return output, output_suffix, content_type, stats
+
+
+def normalized_filename(filename: str, suffix: str) -> str:
+    return f"{os.path.splitext(filename or 'audio')[0]}{suffix}"
@@ -0,0 +1,177 @@
+"""Decodificação de áudio em memória para o serviço Whisper.
+
+Converte os bytes enviados em um array float32 mono a 16 kHz (o formato que
+`model.transcribe` aceita diretamente), sem gravar arquivos temporários:
+WAV PCM a 16 kHz é lido direto; os demais formatos passam pelo ffmpeg via
+stdin/stdout.
+"""
+import io
+import os
+import subprocess
+import tempfile
+import wave
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+SAMPLE_RATE = 16000
+
+# Contêineres que o ffmpeg pode não conseguir ler de um pipe (índice "moov" no
+# fim do arquivo exige seek); nesses casos recorre-se ao arquivo temporário.
+SEEKABLE_ONLY_FORMATS = {'.mp4', '.m4a'}
+
+
+class AudioDecodeError(Exception):
+    pass
+
+
+def decode_audio(content: bytes, suffix: str = "") -> np.ndarray:
+    """Decodifica o áudio em memória, com fallback para arquivo temporário quando necessário"""
+    waveform = decode_wav_pcm(content)
+    if waveform is not None:
+        return waveform
+
+    try:
+        return decode_with_ffmpeg_pipe(content)
+    except AudioDecodeError:
+        if suffix.lower() in SEEKABLE_ONLY_FORMATS:
+            return decode_with_tempfile(content, suffix)
+        raise
+
+
+def decode_wav_pcm(content: bytes, sample_rate: int = SAMPLE_RATE) -> Optional[np.ndarray]:
+    """Lê WAV PCM inteiro já na taxa alvo; retorna None para qualquer outro caso"""
+    if content[:4] != b"RIFF" or content[8:12] != b"WAVE":
+        return None
+
+    try:
+        with wave.open(io.BytesIO(content)) as wav:
+            if wav.getframerate() != sample_rate or wav.getsampwidth() not in (1, 2, 4):
+                return None
+            channels = wav.getnchannels()
+            sample_width = wav.getsampwidth()
+            frames = wav.readframes(wav.getnframes())
+    except (wave.Error, EOFError):
+        return None
+
+    if sample_width == 1:
+        samples = (np.frombuffer(frames, dtype=np.uint8).astype(np.float32) - 128.0) / 128.0
+    elif sample_width == 2:
+        samples = np.frombuffer(frames, dtype="<i2").astype(np.float32) / 32768.0
+    else:
+        samples = np.frombuffer(frames, dtype="<i4").astype(np.float32) / 2147483648.0
+
+    if channels > 1:
+        samples = samples[: len(samples) - len(samples) % channels].reshape(-1, channels).mean(axis=1)
+    return np.ascontiguousarray(samples, dtype=np.float32)
+
+
+def decode_with_ffmpeg_pipe(content: bytes, sample_rate: int = SAMPLE_RATE) -> np.ndarray:
+    """Decodifica qualquer formato suportado pelo ffmpeg via pipes, sem tocar o disco"""
+    cmd = [
+        "ffmpeg", "-nostdin", "-loglevel", "error", "-threads", "0",
+        "-i", "pipe:0",
+        "-f", "s16le", "-ac", "1", "-acodec", "pcm_s16le", "-ar", str(sample_rate),
+        "pipe:1"
+    ]
+    try:
+        out = subprocess.run(cmd, input=content, capture_output=True, check=True).stdout
+    except FileNotFoundError as e:
+        raise AudioDecodeError("ffmpeg não encontrado") from e
+    except subprocess.CalledProcessError as e:
+        raise AudioDecodeError(f"Falha ao decodificar áudio: {e.stderr.decode(errors='replace')[-300:]}") from e
+
+    return np.frombuffer(out, dtype=np.int16).astype(np.float32) / 32768.0
+
+
+def decode_with_tempfile(content: bytes, suffix: str, sample_rate: int = SAMPLE_RATE) -> np.ndarray:
+    """Caminho anterior: grava o upload em disco e deixa o ffmpeg ler o arquivo"""
+    tmp_file_path = None
+    try:
+        with tempfile.NamedTemporaryFile(delete=False, suffix=suffix or ".wav") as tmp_file:
+            tmp_file.write(content)
+            tmp_file_path = tmp_file.name
+
+        cmd = [
+            "ffmpeg", "-nostdin", "-loglevel", "error", "-threads", "0",
+            "-i", tmp_file_path,
+            "-f", "s16le", "-ac", "1", "-acodec", "pcm_s16le", "-ar", str(sample_rate),
+            "-"
+        ]
+        try:
+            out = subprocess.run(cmd, capture_output=True, check=True).stdout
+        except FileNotFoundError as e:
+            raise AudioDecodeError("ffmpeg não encontrado") from e
+        except subprocess.CalledProcessError as e:
+            raise AudioDecodeError(f"Falha ao decodificar áudio: {e.stderr.decode(errors='replace')[-300:]}") from e
+
+        return np.frombuffer(out, dtype=np.int16).astype(np.float32) / 32768.0
+    finally:
+        if tmp_file_path and os.path.exists(tmp_file_path):
+            os.unlink(tmp_file_path)
+
+
+def frame_energy_db(audio: np.ndarray, frame_len: int) -> np.ndarray:
+    """Energia RMS (dBFS) de cada quadro não sobreposto de `frame_len` amostras"""
+    n_frames = len(audio) // frame_len
+    if n_frames == 0:
+        return np.empty(0, dtype=np.float32)
+    frames = audio[:n_frames * frame_len].reshape(n_frames, frame_len)
+    rms = np.sqrt(np.mean(frames.astype(np.float64) ** 2, axis=1))
+    return (20 * np.log10(np.maximum(rms, 1e-10))).astype(np.float32)
+
+
+def split_on_silence(audio: np.ndarray, sample_rate: int = SAMPLE_RATE,
+                     target_segment_s: float = 20.0, max_segment_s: float = 30.0,
+                     min_silence_ms: int = 300, frame_ms: int = 30) -> List[Tuple[int, int]]:
+    """Divide o áudio em segmentos nos silêncios, com um detector de voz por energia.
+
+    O limiar de silêncio se adapta ao ruído de fundo: percentil 10 da energia
+    dos quadros + 12 dB, limitado a 6 dB abaixo do percentil 90 (áudio sem
+    pausas) e nunca abaixo de -50 dBFS. Os cortes são feitos no
+    meio de pausas de pelo menos `min_silence_ms`, escolhendo a pausa mais
+    próxima de `target_segment_s`; sem pausa disponível, corta em
+    `max_segment_s` (a janela do Whisper). Segmentos sem voz são descartados.
+    Retorna pares (início, fim) em amostras.
+    """
+    frame_len = max(1, int(sample_rate * frame_ms / 1000))
+    energy = frame_energy_db(audio, frame_len)
+    if len(energy) == 0:
+        return [(0, len(audio))] if len(audio) else []
+
+    noise_floor, loud = np.percentile(energy, [10, 90])
+    threshold = max(-50.0, min(float(noise_floor) + 12.0, float(loud) - 6.0))
+    speech = energy > threshold
+
+    # Candidatos a corte: centro de cada sequência de quadros silenciosos longa o bastante
+    min_silence_frames = max(1, int(min_silence_ms / frame_ms))
+    cuts = []
+    run_start = None
+    for i, is_speech in enumerate(np.append(speech, True)):
+        if not is_speech and run_start is None:
+            run_start = i
+        elif is_speech and run_start is not None:
+            if i - run_start >= min_silence_frames:
+                cuts.append(((run_start + i) // 2) * frame_len)
+            run_start = None
+
+    target = int(target_segment_s * sample_rate)
+    max_len = int(max_segment_s * sample_rate)
+    min_len = min(target, max_len) // 4
+
+    boundaries = [0]
+    while len(audio) - boundaries[-1] > max_len:
+        start = boundaries[-1]
+        options = [c for c in cuts if start + min_len <= c <= start + max_len]
+        if options:
+            boundaries.append(min(options, key=lambda c: abs(c - (start + target))))
+        else:
+            boundaries.append(start + max_len)
+    boundaries.append(len(audio))
+
+    segments = []
+    for start, end in zip(boundaries, boundaries[1:]):
+        first, last = start // frame_len, -(-end // frame_len)
+        if end > start and speech[first:last].any():
+            segments.append((start, end))
+    return segments
@@ -0,0 +1,72 @@
+"""Compara a decodificação de áudio em memória com o caminho via arquivo temporário.
+
+Uso:
+    python -m benchmarks.audio_decode_bench --seconds 30 --iterations 20
+"""
+import argparse
+import json
+import shutil
+import statistics
+import subprocess
+import time
+
+import numpy as np
+
+from audio_processing import decode_audio, decode_with_tempfile
+from benchmarks.audio_fixtures import encode_with_ffmpeg, synth_voice, to_wav_bytes
+
+
+def time_calls(fn, iterations: int) -> dict:
+    timings = []
+    result = None
+    for _ in range(iterations):
+        start = time.perf_counter()
+        result = fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return {
+        "mean_ms": round(statistics.mean(timings), 2),
+        "p50_ms": round(statistics.median(timings), 2),
+        "min_ms": round(min(timings), 2),
+        "samples": int(len(result))
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de decodificação de áudio")
+    parser.add_argument("--seconds", type=float, default=30.0, help="Duração do áudio sintético")
+    parser.add_argument("--iterations", type=int, default=20)
+    args = parser.parse_args()
+
+    has_ffmpeg = shutil.which("ffmpeg") is not None
+    signal = synth_voice(args.seconds)
+    inputs = {
+        "wav_16k_mono": (to_wav_bytes(signal, 16000), ".wav"),
+        "wav_48k_stereo": (to_wav_bytes(np.repeat(signal, 3), 48000, channels=2), ".wav"),
+    }
+    if has_ffmpeg:
+        for fmt in ("webm", "mp3"):
+            try:
+                inputs[fmt] = (encode_with_ffmpeg(inputs["wav_48k_stereo"][0], fmt), f".{fmt}")
+            except subprocess.CalledProcessError:
+                pass
+
+    report = {"audio_seconds": args.seconds, "iterations": args.iterations, "ffmpeg": has_ffmpeg, "results": {}}
+    for name, (content, suffix) in inputs.items():
+        entry = {"bytes": len(content)}
+        try:
+            entry["in_memory"] = time_calls(lambda: decode_audio(content, suffix), args.iterations)
+        except Exception as e:
+            entry["in_memory"] = {"error": str(e)}
+        if has_ffmpeg:
+            entry["tempfile"] = time_calls(lambda: decode_with_tempfile(content, suffix), args.iterations)
+            if "mean_ms" in entry["in_memory"]:
+                entry["speedup"] = round(entry["tempfile"]["mean_ms"] / entry["in_memory"]["mean_ms"], 2)
+        else:
+            entry["tempfile"] = {"skipped": "ffmpeg não encontrado"}
+        report["results"][name] = entry
+
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
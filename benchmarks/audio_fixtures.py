@@ -0,0 +1,52 @@
+"""Áudio sintético para benchmarks: sem arquivos externos nem rede."""
+import io
+import subprocess
+import wave
+
+import numpy as np
+
+
+def synth_voice(seconds: float, sample_rate: int = 16000, pauses: int = 0, seed: int = 0) -> np.ndarray:
+    """Sinal float32 mono parecido com fala (tons modulados + ruído), com pausas de silêncio opcionais"""
+    rng = np.random.default_rng(seed)
+    n = int(seconds * sample_rate)
+    t = np.arange(n, dtype=np.float32) / sample_rate
+    pitch = 140 + 40 * np.sin(2 * np.pi * 0.7 * t)
+    signal = 0.3 * np.sin(2 * np.pi * np.cumsum(pitch) / sample_rate)
+    signal += 0.15 * np.sin(2 * np.pi * 3 * np.cumsum(pitch) / sample_rate)
+    signal *= 0.6 + 0.4 * np.sin(2 * np.pi * 4 * t) ** 2
+    signal += 0.02 * rng.standard_normal(n)
+
+    if pauses:
+        # Silêncios de 0,8 s distribuídos uniformemente, como pausas entre frases
+        gap = int(0.8 * sample_rate)
+        for center in np.linspace(0, n, pauses + 2)[1:-1].astype(int):
+            signal[max(0, center - gap // 2):center + gap // 2] = 0.002 * rng.standard_normal(min(gap, n - max(0, center - gap // 2)))
+
+    return signal.astype(np.float32)
+
+
+def to_wav_bytes(signal: np.ndarray, sample_rate: int = 16000, channels: int = 1,
+                 leading_silence: float = 0.0, trailing_silence: float = 0.0) -> bytes:
+    """Codifica o sinal como WAV PCM 16 bits, opcionalmente com silêncio nas pontas e canais duplicados"""
+    pad_start = np.zeros(int(leading_silence * sample_rate), dtype=np.float32)
+    pad_end = np.zeros(int(trailing_silence * sample_rate), dtype=np.float32)
+    samples = np.concatenate([pad_start, signal, pad_end])
+    pcm = (np.clip(samples, -1, 1) * 32767).astype("<i2")
+    if channels > 1:
+        pcm = np.repeat(pcm[:, None], channels, axis=1).reshape(-1)
+
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(channels)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(pcm.tobytes())
+    return buffer.getvalue()
+
+
+def encode_with_ffmpeg(wav_bytes: bytes, fmt: str) -> bytes:
+    """Recodifica um WAV (webm/opus, mp3, ogg...) via ffmpeg; levanta FileNotFoundError sem ffmpeg"""
+    codecs = {"webm": ["-c:a", "libopus"], "ogg": ["-c:a", "libopus"], "mp3": ["-c:a", "libmp3lame"]}
+    cmd = ["ffmpeg", "-nostdin", "-loglevel", "error", "-i", "pipe:0", *codecs.get(fmt, []), "-f", fmt, "pipe:1"]
+    return subprocess.run(cmd, input=wav_bytes, capture_output=True, check=True).stdout
@@ -0,0 +1,153 @@
+"""Compara os motores de embedding (embedding_engines.py): partida a frio, vazão, memória e recuperação.
+
+Cada motor roda em um subprocesso próprio, para que o tempo de importação e o
+pico de RSS (VmHWM) não se misturem. O subprocesso carrega o motor, gera os
+embeddings de chunks e perguntas sintéticos e grava as matrizes; o processo
+principal compara a recuperação (sobreposição do top-k por pergunta e
+cosseno entre os embeddings do mesmo texto) com o primeiro motor da lista.
+
+Uso:
+    python -m benchmarks.embedding_engine_bench --model ./models/all-MiniLM-L6-v2
+    python -m benchmarks.embedding_engine_bench --engines sentence-transformers,onnx-int8 --chunks 2000 --output emb.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from typing import List
+
+import numpy as np
+
+from benchmarks.load_test import REPO_ROOT, git_commit, read_status_kb, synth_question
+from benchmarks.pdf_fixtures import synth_paragraphs
+
+
+def synth_chunks(count: int) -> List[str]:
+    """Chunks de ~4 linhas de texto sobre café, como os gerados na ingestão de PDFs"""
+    lines = [line for page in synth_paragraphs(count // 10 + 1, seed=1) for line in page]
+    return [" ".join(lines[i * 4:i * 4 + 4]) for i in range(count)]
+
+
+def run_worker(args):
+    """Executado no subprocesso: mede um motor e grava embeddings e métricas em --workdir"""
+    started = time.perf_counter()
+    from embedding_engines import load_embedding_engine
+
+    engine = load_embedding_engine(args.worker, args.model, args.threads)
+    engine.encode(["aquecimento"])
+    cold_start = time.perf_counter() - started
+
+    chunks = synth_chunks(args.chunks)
+    questions = [synth_question(i) for i in range(args.questions)]
+
+    encode_started = time.perf_counter()
+    chunk_embeddings = engine.encode(chunks, batch_size=args.batch_size)
+    chunk_seconds = time.perf_counter() - encode_started
+
+    latencies = []
+    question_embeddings = []
+    for question in questions:
+        question_started = time.perf_counter()
+        question_embeddings.append(engine.encode([question], batch_size=1)[0])
+        latencies.append((time.perf_counter() - question_started) * 1000)
+
+    prefix = os.path.join(args.workdir, args.worker)
+    np.save(prefix + "-chunks.npy", chunk_embeddings)
+    np.save(prefix + "-questions.npy", np.vstack(question_embeddings))
+    result = {
+        **engine.status(),
+        "cold_start_s": round(cold_start, 2),
+        "chunks_per_s": round(len(chunks) / chunk_seconds, 1),
+        "question_latency_ms": {
+            "p50": round(float(np.percentile(latencies, 50)), 2),
+            "p95": round(float(np.percentile(latencies, 95)), 2),
+            "mean": round(float(np.mean(latencies)), 2)
+        },
+        "peak_rss_mb": round((read_status_kb(os.getpid(), "VmHWM") or 0) / 1024, 1)
+    }
+    with open(prefix + ".json", "w", encoding="utf-8") as f:
+        json.dump(result, f)
+
+
+def top_k(questions: np.ndarray, chunks: np.ndarray, k: int) -> np.ndarray:
+    """Índices dos k chunks mais próximos (cosseno) de cada pergunta"""
+    chunks = chunks / np.maximum(np.linalg.norm(chunks, axis=1, keepdims=True), 1e-12)
+    questions = questions / np.maximum(np.linalg.norm(questions, axis=1, keepdims=True), 1e-12)
+    return np.argsort(-(questions @ chunks.T), axis=1)[:, :k]
+
+
+def agreement(reference: str, engine: str, workdir: str, k: int) -> dict:
+    ref_chunks = np.load(os.path.join(workdir, f"{reference}-chunks.npy"))
+    ref_questions = np.load(os.path.join(workdir, f"{reference}-questions.npy"))
+    chunks = np.load(os.path.join(workdir, f"{engine}-chunks.npy"))
+    questions = np.load(os.path.join(workdir, f"{engine}-questions.npy"))
+
+    expected = top_k(ref_questions, ref_chunks, k)
+    found = top_k(questions, chunks, k)
+    overlap = np.mean([len(set(a) & set(b)) / k for a, b in zip(expected, found)])
+    result = {"reference": reference, f"top{k}_overlap": round(float(overlap), 4)}
+    if chunks.shape[1] == ref_chunks.shape[1]:
+        cosines = np.sum(chunks * ref_chunks, axis=1) / np.maximum(
+            np.linalg.norm(chunks, axis=1) * np.linalg.norm(ref_chunks, axis=1), 1e-12
+        )
+        result["mean_cosine"] = round(float(cosines.mean()), 5)
+        result["min_cosine"] = round(float(cosines.min()), 5)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark dos motores de embedding")
+    parser.add_argument("--engines", default="sentence-transformers,torch-int8,onnx,onnx-int8",
+                        help="Motores separados por vírgula; o primeiro é a referência de recuperação")
+    parser.add_argument("--model", default="all-MiniLM-L6-v2", help="Nome do modelo ou diretório local")
+    parser.add_argument("--chunks", type=int, default=1000)
+    parser.add_argument("--questions", type=int, default=100)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--threads", type=int, default=0)
+    parser.add_argument("-k", "--k", type=int, default=5)
+    parser.add_argument("--output", help="Arquivo JSON do relatório (padrão: saída padrão)")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    parser.add_argument("--workdir", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args)
+        return
+
+    engines = [name.strip() for name in args.engines.split(",") if name.strip()]
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="audio-rag-embeddings-") as workdir:
+        for engine in engines:
+            command = [sys.executable, "-m", "benchmarks.embedding_engine_bench", "--worker", engine,
+                       "--workdir", workdir, "--model", args.model, "--chunks", str(args.chunks),
+                       "--questions", str(args.questions), "--batch-size", str(args.batch_size),
+                       "--threads", str(args.threads)]
+            process = subprocess.run(command, cwd=REPO_ROOT, capture_output=True, text=True)
+            if process.returncode != 0:
+                results[engine] = {"error": process.stderr.strip().splitlines()[-1] if process.stderr else "falhou"}
+                continue
+            with open(os.path.join(workdir, f"{engine}.json"), encoding="utf-8") as f:
+                results[engine] = json.load(f)
+
+        measured = [engine for engine in engines if "error" not in results[engine]]
+        for engine in measured[1:]:
+            results[engine]["retrieval"] = agreement(measured[0], engine, workdir, args.k)
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "worker", "workdir")},
+        "engines": results
+    }
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+"""Servidor LLM falso, compatível com a API de chat da Groq/OpenAI.
+
+Substitui a Groq em testes e benchmarks locais, sem rede: responde em
+/openai/v1/chat/completions (caminho usado pelo SDK da Groq) e em
+/v1/chat/completions, com ou sem streaming, simulando latência até o
+primeiro token e taxa de geração configuráveis.
+
+Para testar prazos, hedging e fallback (llm_client.py), uma fração das
+requisições pode ser lenta (--slow-rate, com --slow-latency segundos a mais)
+ou falhar (--failure-rate, com o status --failure-status), e qualquer
+parâmetro pode ser diferente por modelo (--model NOME:chave=valor,...).
+
+Uso:
+    python -m benchmarks.fake_llm_server --port 8099 --latency 0.3 --tokens-per-second 40
+    python -m benchmarks.fake_llm_server --slow-rate 0.1 --slow-latency 10 --model llama-3.1-8b-instant:latency=0.05
+    GROQ_BASE_URL=http://localhost:8099 python rag_service.py
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+import uuid
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+app = FastAPI(title="Fake LLM Server")
+
+config = {
+    "latency": float(os.getenv("FAKE_LLM_LATENCY", "0.2")),
+    "tokens_per_second": float(os.getenv("FAKE_LLM_TOKENS_PER_SECOND", "50")),
+    "completion_tokens": int(os.getenv("FAKE_LLM_COMPLETION_TOKENS", "64")),
+    "slow_rate": float(os.getenv("FAKE_LLM_SLOW_RATE", "0")),
+    "slow_latency": float(os.getenv("FAKE_LLM_SLOW_LATENCY", "5")),
+    "failure_rate": float(os.getenv("FAKE_LLM_FAILURE_RATE", "0")),
+    "failure_status": int(os.getenv("FAKE_LLM_FAILURE_STATUS", "500"))
+}
+# Valores de `config` próprios de cada modelo, ex.: {"llama-3.1-8b-instant": {"latency": 0.05}}
+model_config = {}
+
+stats = {"requests": 0, "streaming_requests": 0, "slow": 0, "failures": 0, "models": {}}
+rng = random.Random()
+
+WORDS = ("De acordo com os documentos, a adubação do cafeeiro deve ser parcelada "
+         "ao longo do período chuvoso, respeitando a análise de solo e a "
+         "produtividade esperada da lavoura.").split()
+
+
+def estimate_tokens(messages) -> int:
+    return max(1, sum(len(str(m.get("content", ""))) for m in messages) // 4)
+
+
+def answer_tokens(n: int):
+    return [(" " if i else "") + WORDS[i % len(WORDS)] for i in range(n)]
+
+
+def completion_payload(model: str, content: str, prompt_tokens: int, completion_tokens: int) -> dict:
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "system_fingerprint": "fake",
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "logprobs": None,
+            "finish_reason": "stop"
+        }],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens
+        }
+    }
+
+
+def chunk_payload(completion_id: str, model: str, content: str, finish_reason=None, usage=None) -> dict:
+    chunk = {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "system_fingerprint": "fake",
+        "choices": [{
+            "index": 0,
+            "delta": {"role": "assistant", "content": content},
+            "logprobs": None,
+            "finish_reason": finish_reason
+        }]
+    }
+    if usage:
+        # A Groq envia o uso no último chunk em x_groq; clientes OpenAI leem "usage"
+        chunk["x_groq"] = {"id": completion_id, "usage": usage}
+        chunk["usage"] = usage
+    return chunk
+
+
+def parse_config(changes: dict) -> dict:
+    """Converte os valores recebidos para o tipo de cada chave de `config`, ignorando as desconhecidas"""
+    return {key: type(config[key])(value) for key, value in changes.items() if key in config}
+
+
+def settings_for(model: str) -> dict:
+    return {**config, **model_config.get(model, {})}
+
+
+def failure_response(status: int) -> JSONResponse:
+    # Mesmo formato de erro da API da Groq/OpenAI; 429 e 503 indicam quando tentar de novo
+    headers = {"Retry-After": "1"} if status in (429, 503) else None
+    return JSONResponse(
+        status_code=status,
+        content={"error": {"message": f"Falha simulada ({status})", "type": "fake_error", "code": status}},
+        headers=headers
+    )
+
+
+@app.get("/health")
+async def health():
+    return {"status": "healthy", "config": config, "models": model_config, "stats": stats}
+
+
+@app.post("/config")
+async def update_config(request: Request):
+    """Altera a configuração em tempo de execução (usado pelos benchmarks); `models` altera por modelo"""
+    changes = await request.json()
+    config.update(parse_config(changes))
+    for model, values in (changes.get("models") or {}).items():
+        model_config.setdefault(model, {}).update(parse_config(values))
+    return {**config, "models": model_config}
+
+
+@app.post("/openai/v1/chat/completions")
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    stats["requests"] += 1
+
+    model = body.get("model", "fake-model")
+    settings = settings_for(model)
+    stats["models"][model] = stats["models"].get(model, 0) + 1
+    if rng.random() < settings["failure_rate"]:
+        stats["failures"] += 1
+        await asyncio.sleep(settings["latency"])
+        return failure_response(settings["failure_status"])
+
+    latency = settings["latency"]
+    if rng.random() < settings["slow_rate"]:
+        stats["slow"] += 1
+        latency += settings["slow_latency"]
+
+    messages = body.get("messages", [])
+    prompt_tokens = estimate_tokens(messages)
+    n_tokens = min(int(body.get("max_tokens") or settings["completion_tokens"]), settings["completion_tokens"])
+    tokens = answer_tokens(n_tokens)
+    token_interval = 1.0 / settings["tokens_per_second"] if settings["tokens_per_second"] > 0 else 0.0
+    usage = {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": n_tokens,
+        "total_tokens": prompt_tokens + n_tokens
+    }
+
+    if not body.get("stream"):
+        await asyncio.sleep(latency + token_interval * n_tokens)
+        return JSONResponse(completion_payload(model, "".join(tokens), prompt_tokens, n_tokens))
+
+    stats["streaming_requests"] += 1
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+
+    async def stream():
+        await asyncio.sleep(latency)
+        for token in tokens:
+            yield f"data: {json.dumps(chunk_payload(completion_id, model, token))}\n\n"
+            if token_interval:
+                await asyncio.sleep(token_interval)
+        yield f"data: {json.dumps(chunk_payload(completion_id, model, '', 'stop', usage))}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(stream(), media_type="text/event-stream")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor LLM falso compatível com Groq/OpenAI")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--latency", type=float, default=config["latency"],
+                        help="Segundos até o primeiro token")
+    parser.add_argument("--tokens-per-second", type=float, default=config["tokens_per_second"])
+    parser.add_argument("--completion-tokens", type=int, default=config["completion_tokens"])
+    parser.add_argument("--slow-rate", type=float, default=config["slow_rate"],
+                        help="Fração das requisições com latência extra")
+    parser.add_argument("--slow-latency", type=float, default=config["slow_latency"],
+                        help="Segundos a mais nas requisições lentas")
+    parser.add_argument("--failure-rate", type=float, default=config["failure_rate"],
+                        help="Fração das requisições que falham")
+    parser.add_argument("--failure-status", type=int, default=config["failure_status"])
+    parser.add_argument("--model", action="append", default=[], metavar="NOME:chave=valor,...",
+                        help="Configuração própria de um modelo (pode repetir)")
+    parser.add_argument("--seed", type=int, help="Semente do sorteio de lentidão e falhas")
+    args = parser.parse_args()
+
+    config.update(
+        latency=args.latency,
+        tokens_per_second=args.tokens_per_second,
+        completion_tokens=args.completion_tokens,
+        slow_rate=args.slow_rate,
+        slow_latency=args.slow_latency,
+        failure_rate=args.failure_rate,
+        failure_status=args.failure_status
+    )
+    for spec in args.model:
+        name, _, values = spec.partition(":")
+        pairs = dict(item.split("=", 1) for item in values.split(",") if item)
+        model_config.setdefault(name, {}).update(parse_config(pairs))
+    if args.seed is not None:
+        rng.seed(args.seed)
+
+    import uvicorn
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,332 @@
+"""Benchmark de carga ponta a ponta: gateway, Whisper e RAG rodando localmente.
+
+Sobe os serviços como subprocessos (com o servidor LLM falso no lugar da
+Groq), gera áudio e PDFs sintéticos e dispara requisições concorrentes contra
+/upload-pdf, /query e /process-audio. O relatório em JSON traz latência
+p50/p95/p99, vazão e pico de memória (RSS) de cada serviço, para comparar
+commits. Roda sem rede e sem GPU; o modelo do Whisper precisa já estar no
+cache local (~/.cache/whisper).
+
+Uso:
+    python -m benchmarks.load_test --concurrency 4 --requests 40 --output bench.json
+    python -m benchmarks.load_test --scenarios upload_pdf,query --llm-latency 0.5
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional
+
+import httpx
+import numpy as np
+
+from benchmarks.audio_fixtures import synth_voice, to_wav_bytes
+from benchmarks.pdf_fixtures import VOCABULARY, synth_pdf
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCENARIOS = ("upload_pdf", "query", "process_audio")
+# Serviços necessários para cada cenário
+REQUIRED_SERVICES = {
+    "upload_pdf": ("llm", "rag"),
+    "query": ("llm", "rag"),
+    "process_audio": ("llm", "rag", "whisper", "gateway"),
+}
+
+
+def service_commands(args) -> Dict[str, dict]:
+    uvicorn = [sys.executable, "-m", "uvicorn", "--app-dir", REPO_ROOT, "--log-level", "warning"]
+    urls = {name: f"http://127.0.0.1:{port}" for name, port in (
+        ("llm", args.llm_port), ("rag", args.rag_port), ("whisper", args.whisper_port), ("gateway", args.gateway_port)
+    )}
+    return {
+        "llm": {
+            "cmd": [sys.executable, "-m", "benchmarks.fake_llm_server", "--port", str(args.llm_port),
+                    "--latency", str(args.llm_latency), "--tokens-per-second", str(args.llm_tokens_per_second)],
+            "env": {},
+            "health": f"{urls['llm']}/health",
+            "url": urls["llm"]
+        },
+        "rag": {
+            "cmd": uvicorn + ["rag_service:app", "--port", str(args.rag_port)],
+            "env": {"GROQ_API_KEY": "benchmark", "GROQ_BASE_URL": urls["llm"]},
+            "health": f"{urls['rag']}/",
+            "url": urls["rag"]
+        },
+        "whisper": {
+            "cmd": uvicorn + ["whisper_service:app", "--port", str(args.whisper_port)],
+            "env": {"WHISPER_MODEL": args.whisper_model, "WHISPER_WORKERS": str(args.whisper_workers)},
+            "health": f"{urls['whisper']}/health",
+            "url": urls["whisper"]
+        },
+        "gateway": {
+            "cmd": uvicorn + ["gateway:app", "--port", str(args.gateway_port)],
+            "env": {"WHISPER_SERVICE_URL": urls["whisper"], "RAG_SERVICE_URL": urls["rag"]},
+            "health": f"{urls['gateway']}/",
+            "url": urls["gateway"]
+        },
+    }
+
+
+def start_service(name: str, spec: dict, workdir: str) -> subprocess.Popen:
+    env = {
+        **os.environ,
+        **spec["env"],
+        "PYTHONPATH": os.pathsep.join(filter(None, [REPO_ROOT, os.environ.get("PYTHONPATH")])),
+        # Cada execução começa com base e caches vazios
+        "CHROMA_PATH": os.path.join(workdir, "chroma_db"),
+    }
+    log = open(os.path.join(workdir, f"{name}.log"), "wb")
+    return subprocess.Popen(spec["cmd"], cwd=REPO_ROOT if name == "llm" else workdir, env=env,
+                            stdout=log, stderr=subprocess.STDOUT)
+
+
+def wait_healthy(name: str, url: str, process: subprocess.Popen, timeout: float):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Serviço {name} encerrou ao iniciar (código {process.returncode})")
+        try:
+            if httpx.get(url, timeout=2).status_code == 200:
+                return
+        except httpx.RequestError:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f"Serviço {name} não respondeu em {timeout}s")
+
+
+def read_status_kb(pid: int, field: str) -> Optional[int]:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+    return None
+
+
+def child_pids(pid: int) -> List[int]:
+    children = []
+    for entry in os.listdir("/proc") if os.path.isdir("/proc") else []:
+        if entry.isdigit():
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    # O nome do processo vem entre parênteses e pode conter espaços
+                    if int(f.read().rsplit(")", 1)[1].split()[1]) == pid:
+                        children.append(int(entry))
+            except (OSError, IndexError, ValueError):
+                pass
+    return children
+
+
+def peak_rss(pid: int) -> dict:
+    """Pico de RSS (VmHWM) do processo e soma dos picos dos filhos (ex.: pool de extração)"""
+    main = read_status_kb(pid, "VmHWM")
+    children = [read_status_kb(child, "VmHWM") or 0 for child in child_pids(pid)]
+    return {
+        "peak_rss_mb": round(main / 1024, 1) if main is not None else None,
+        "children_peak_rss_mb": round(sum(children) / 1024, 1) if children else 0.0
+    }
+
+
+def percentiles(latencies: List[float]) -> dict:
+    if not latencies:
+        return {}
+    values = np.array(latencies)
+    return {
+        "p50": round(float(np.percentile(values, 50)), 1),
+        "p95": round(float(np.percentile(values, 95)), 1),
+        "p99": round(float(np.percentile(values, 99)), 1),
+        "mean": round(float(values.mean()), 1),
+        "max": round(float(values.max()), 1)
+    }
+
+
+async def run_scenario(make_request: Callable, total: int, concurrency: int) -> dict:
+    """Executa `total` requisições com no máximo `concurrency` simultâneas"""
+    latencies: List[float] = []
+    statuses: Dict[str, int] = {}
+    responses = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(index: int):
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                response = await make_request(index)
+                status = str(response.status_code)
+                if response.status_code < 400:
+                    latencies.append((time.perf_counter() - started) * 1000)
+                    responses.append(response)
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            statuses[status] = statuses.get(status, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*[one(i) for i in range(total)])
+    elapsed = time.perf_counter() - started
+
+    return {
+        "requests": total,
+        "concurrency": concurrency,
+        "ok": len(latencies),
+        "errors": total - len(latencies),
+        "status_counts": statuses,
+        "duration_s": round(elapsed, 2),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else None,
+        "latency_ms": percentiles(latencies),
+        "_responses": responses
+    }
+
+
+async def wait_jobs(client: httpx.AsyncClient, rag_url: str, job_ids: List[str], timeout: float) -> dict:
+    """Aguarda os jobs de ingestão; retorna quantos concluíram e o tempo até o último"""
+    started = time.perf_counter()
+    pending = set(job_ids)
+    completed = failed = 0
+    while pending and time.perf_counter() - started < timeout:
+        for job_id in list(pending):
+            job = (await client.get(f"{rag_url}/jobs/{job_id}")).json()
+            if job["status"] in ("completed", "failed"):
+                pending.discard(job_id)
+                completed += job["status"] == "completed"
+                failed += job["status"] == "failed"
+        if pending:
+            await asyncio.sleep(0.2)
+    return {
+        "jobs_completed": completed,
+        "jobs_failed": failed,
+        "jobs_pending": len(pending),
+        "drain_s": round(time.perf_counter() - started, 2)
+    }
+
+
+def synth_question(index: int) -> str:
+    # Perguntas distintas, para não medir só o cache semântico e a coalescência
+    rng = random.Random(index)
+    return f"Como fazer {' '.join(rng.sample(VOCABULARY, 5))} na lavoura de café?"
+
+
+async def run_benchmark(args, services: Dict[str, dict]) -> dict:
+    scenarios = {}
+    rag_url = services["rag"]["url"]
+    gateway_url = services["gateway"]["url"]
+
+    async with httpx.AsyncClient(timeout=args.request_timeout) as client:
+        if "upload_pdf" in args.scenarios:
+            pdfs = [synth_pdf(args.pdf_pages, seed=i) for i in range(args.pdf_requests)]
+
+            async def upload(index: int):
+                files = {"file": (f"boletim_{index}.pdf", pdfs[index], "application/pdf")}
+                return await client.post(f"{rag_url}/upload-pdf", files=files)
+
+            result = await run_scenario(upload, args.pdf_requests, args.concurrency)
+            job_ids = [response.json()["job_id"] for response in result.pop("_responses")]
+            result["ingestion"] = await wait_jobs(client, rag_url, job_ids, args.request_timeout)
+            result["pdf_pages"] = args.pdf_pages
+            scenarios["upload_pdf"] = result
+
+        if "query" in args.scenarios:
+            async def query(index: int):
+                return await client.post(f"{rag_url}/query", json={
+                    "question": synth_question(index), "similarity_threshold": 0.0
+                })
+
+            result = await run_scenario(query, args.requests, args.concurrency)
+            result.pop("_responses")
+            scenarios["query"] = result
+
+        if "process_audio" in args.scenarios:
+            # Um clipe distinto por requisição: o cache de transcrições não deve mascarar o Whisper
+            clips = [to_wav_bytes(synth_voice(args.audio_seconds, seed=i)) for i in range(args.requests)]
+
+            async def process_audio(index: int):
+                files = {"file": (f"pergunta_{index}.wav", clips[index], "audio/wav")}
+                return await client.post(f"{gateway_url}/process-audio", files=files)
+
+            result = await run_scenario(process_audio, args.requests, args.concurrency)
+            result.pop("_responses")
+            result["audio_seconds"] = args.audio_seconds
+            scenarios["process_audio"] = result
+
+    return scenarios
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de carga ponta a ponta")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                        help=f"Cenários separados por vírgula: {', '.join(SCENARIOS)}")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=20, help="Requisições dos cenários query e process_audio")
+    parser.add_argument("--pdf-requests", type=int, default=8)
+    parser.add_argument("--pdf-pages", type=int, default=4)
+    parser.add_argument("--audio-seconds", type=float, default=5.0)
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="Segundos até o primeiro token")
+    parser.add_argument("--llm-tokens-per-second", type=float, default=50.0)
+    parser.add_argument("--whisper-model", default="tiny")
+    parser.add_argument("--whisper-workers", type=int, default=1)
+    parser.add_argument("--llm-port", type=int, default=8099)
+    parser.add_argument("--rag-port", type=int, default=8102)
+    parser.add_argument("--whisper-port", type=int, default=8101)
+    parser.add_argument("--gateway-port", type=int, default=8100)
+    parser.add_argument("--startup-timeout", type=float, default=180.0)
+    parser.add_argument("--request-timeout", type=float, default=600.0)
+    parser.add_argument("--output", help="Arquivo JSON do relatório (padrão: saída padrão)")
+    args = parser.parse_args()
+
+    args.scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"Cenários desconhecidos: {', '.join(sorted(unknown))}")
+
+    specs = service_commands(args)
+    needed = [name for name in specs if any(name in REQUIRED_SERVICES[s] for s in args.scenarios)]
+    processes: Dict[str, subprocess.Popen] = {}
+
+    with tempfile.TemporaryDirectory(prefix="audio-rag-bench-") as workdir:
+        try:
+            for name in needed:
+                processes[name] = start_service(name, specs[name], workdir)
+            for name in needed:
+                wait_healthy(name, specs[name]["health"], processes[name], args.startup_timeout)
+
+            scenarios = asyncio.run(run_benchmark(args, specs))
+            memory = {name: peak_rss(process.pid) for name, process in processes.items()}
+        finally:
+            for process in processes.values():
+                process.terminate()
+            for process in processes.values():
+                try:
+                    process.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "scenarios": scenarios,
+        "services": memory
+    }
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""PDFs sintéticos para benchmarks: texto extraível pelo PyPDF2, sem bibliotecas externas."""
+import random
+from typing import List
+
+VOCABULARY = (
+    "café cafeeiro lavoura adubação nitrogênio potássio fósforo calagem gesso "
+    "poda esqueletamento recepa broca ferrugem cercosporiose bicho-mineiro "
+    "irrigação gotejamento colheita derriça secagem terreiro peneira bebida "
+    "arábica conilon espaçamento plantio muda viveiro solo análise produtividade "
+    "saca hectare florada granação maturação chuva estiagem sombreamento manejo"
+).split()
+
+LINES_PER_PAGE = 40
+WORDS_PER_LINE = 12
+
+
+def synth_paragraphs(pages: int, seed: int = 0) -> List[List[str]]:
+    """Linhas de texto por página, com vocabulário de cafeicultura"""
+    rng = random.Random(seed)
+    return [
+        [" ".join(rng.choice(VOCABULARY) for _ in range(WORDS_PER_LINE)) for _ in range(LINES_PER_PAGE)]
+        for _ in range(pages)
+    ]
+
+
+def escape_pdf_text(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def build_pdf(pages_lines: List[List[str]]) -> bytes:
+    """Monta um PDF mínimo (Helvetica, WinAnsi) com uma página por lista de linhas"""
+    objects = []
+
+    def add(body: bytes) -> int:
+        objects.append(body)
+        return len(objects)
+
+    catalog = add(b"")
+    pages_obj = add(b"")
+    font = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>")
+
+    page_ids = []
+    for lines in pages_lines:
+        commands = ["BT", "/F1 10 Tf", "14 TL", "50 800 Td"]
+        for line in lines:
+            commands.append(f"({escape_pdf_text(line)}) Tj T*")
+        commands.append("ET")
+        stream = "\n".join(commands).encode("cp1252", errors="replace")
+        content = add(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        page_ids.append(add(
+            b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 595 842] "
+            b"/Resources << /Font << /F1 %d 0 R >> >> /Contents %d 0 R >>" % (pages_obj, font, content)
+        ))
+
+    objects[catalog - 1] = b"<< /Type /Catalog /Pages %d 0 R >>" % pages_obj
+    kids = b" ".join(b"%d 0 R" % page_id for page_id in page_ids)
+    objects[pages_obj - 1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(page_ids))
+
+    output = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(output))
+        output += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+
+    xref = len(output)
+    output += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        output += b"%010d 00000 n \n" % offset
+    output += b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, catalog, xref)
+    return bytes(output)
+
+
+def synth_pdf(pages: int = 4, seed: int = 0) -> bytes:
+    return build_pdf(synth_paragraphs(pages, seed))
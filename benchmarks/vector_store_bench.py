@@ -0,0 +1,164 @@
+"""Compara as bases vetoriais (vector_stores.py): recall@k em relação à busca exata e latência.
+
+Gera embeddings sintéticos agrupados em tópicos (normalizados, como os do
+MiniLM), insere em cada backend e mede, para cada tamanho de base, o tempo
+de carga, a latência por consulta e o recall@k do IVF (para vários nprobe) e
+do ChromaDB contra o resultado exato do backend numpy. Com 1 milhão de chunks
+de 384 dimensões cada backend ocupa ~1,5 GB; eles são medidos um de cada vez.
+
+Uso:
+    python -m benchmarks.vector_store_bench --sizes 10000,100000 --queries 200
+    python -m benchmarks.vector_store_bench --sizes 1000000 --backends numpy,ivf --nprobe 4,16,64 --output vetores.json
+"""
+import argparse
+import gc
+import json
+import tempfile
+import time
+from typing import Dict, List
+
+import numpy as np
+
+from benchmarks.load_test import git_commit, percentiles
+from vector_stores import VECTOR_STORES, VectorStore, open_vector_store
+
+BACKENDS = ("numpy", "ivf", "chroma")
+
+
+def topic_centers(clusters: int, dim: int, seed: int) -> np.ndarray:
+    return np.random.default_rng(seed).normal(size=(clusters, dim)).astype(np.float32)
+
+
+def synth_embeddings(centers: np.ndarray, count: int, spread: float, seed: int) -> np.ndarray:
+    """Vetores unitários ao redor de centros de tópicos escolhidos ao acaso"""
+    rng = np.random.default_rng(seed)
+    vectors = centers[rng.integers(0, len(centers), count)]
+    vectors = vectors + spread * rng.normal(size=vectors.shape).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def load_store(store: VectorStore, size: int, centers: np.ndarray, args) -> float:
+    """Insere `size` embeddings em lotes (como na ingestão) e retorna o tempo total"""
+    started = time.perf_counter()
+    for batch, start in enumerate(range(0, size, args.batch_size)):
+        count = min(args.batch_size, size - start)
+        store.upsert(
+            [f"chunk-{i}" for i in range(start, start + count)],
+            [f"chunk {i}" for i in range(start, start + count)],
+            synth_embeddings(centers, count, args.spread, seed=args.seed * 1_000_003 + batch),
+            [{"source": f"doc-{i // 100}.pdf"} for i in range(start, start + count)]
+        )
+    return time.perf_counter() - started
+
+
+def run_queries(store: VectorStore, queries: np.ndarray, k: int) -> dict:
+    latencies = []
+    results = []
+    for query in queries:
+        started = time.perf_counter()
+        response = store.query(query, k)
+        latencies.append((time.perf_counter() - started) * 1000)
+        results.append(response["ids"][0])
+    return {"latency_ms": percentiles(latencies), "qps": round(len(queries) / (sum(latencies) / 1000), 1),
+            "_ids": results}
+
+
+def recall_at_k(results: List[List[str]], truth: List[List[str]], k: int) -> float:
+    hits = sum(len(set(found[:k]) & set(expected[:k])) for found, expected in zip(results, truth))
+    return round(hits / (k * len(truth)), 4)
+
+
+def bench_size(size: int, args, workdir: str) -> Dict[str, dict]:
+    centers = topic_centers(args.clusters, args.dim, args.seed)
+    # Perguntas perto dos tópicos, mas que não são cópias de chunks da base
+    queries = synth_embeddings(centers, args.queries, args.spread, seed=args.seed + 7)
+    report: Dict[str, dict] = {}
+    truth = None
+
+    for backend in ["numpy"] + [name for name in args.backends if name != "numpy"]:
+        if backend == "chroma" and size > args.max_chroma_rows:
+            report[backend] = {"skipped": f"acima de --max-chroma-rows ({args.max_chroma_rows})"}
+            continue
+        options = {"max_batch_size": args.batch_size}
+        if backend == "ivf":
+            options.update(nlist=args.nlist, nprobe=args.nprobe[0])
+        try:
+            store = open_vector_store(backend, f"{workdir}/{backend}-{size}", **options)
+        except ImportError as e:
+            report[backend] = {"skipped": f"dependência ausente: {e}"}
+            continue
+
+        entry = {"load_s": round(load_store(store, size, centers, args), 2)}
+        status = store.status()
+        for key in ("memory_bytes", "nlist"):
+            if key in status:
+                entry[key] = status[key]
+
+        if backend == "ivf":
+            entry["nprobe"] = {}
+            for nprobe in args.nprobe:
+                store.nprobe = nprobe
+                measured = run_queries(store, queries, args.k)
+                measured["recall_at_k"] = recall_at_k(measured.pop("_ids"), truth, args.k)
+                entry["nprobe"][str(nprobe)] = measured
+        else:
+            measured = run_queries(store, queries, args.k)
+            ids = measured.pop("_ids")
+            if backend == "numpy":
+                truth = ids
+            measured["recall_at_k"] = recall_at_k(ids, truth, args.k)
+            entry.update(measured)
+
+        if backend in args.backends:
+            report[backend] = entry
+        del store
+        gc.collect()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark das bases vetoriais")
+    parser.add_argument("--sizes", default="10000,100000,1000000", help="Tamanhos da base, separados por vírgula")
+    parser.add_argument("--backends", default=",".join(BACKENDS),
+                        help=f"Backends separados por vírgula: {', '.join(VECTOR_STORES)}")
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("-k", "--k", type=int, default=15, help="Vizinhos por consulta (o serviço busca top_k·3 = 15)")
+    parser.add_argument("--nlist", type=int, default=0, help="Listas do IVF (0 = ~4·√n)")
+    parser.add_argument("--nprobe", default="1,4,8,16,64", help="Valores de nprobe do IVF, separados por vírgula")
+    parser.add_argument("--clusters", type=int, default=500, help="Tópicos dos embeddings sintéticos")
+    parser.add_argument("--spread", type=float, default=0.6, help="Dispersão dos embeddings em torno dos tópicos")
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--max-chroma-rows", type=int, default=100000,
+                        help="Maior base medida no ChromaDB (a inserção é lenta)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Arquivo JSON do relatório (padrão: saída padrão)")
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(",") if size.strip()]
+    args.backends = [name.strip() for name in args.backends.split(",") if name.strip()]
+    args.nprobe = [int(value) for value in args.nprobe.split(",") if value.strip()]
+    unknown = set(args.backends) - set(VECTOR_STORES)
+    if unknown:
+        parser.error(f"Backends desconhecidos: {', '.join(sorted(unknown))}")
+
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="audio-rag-vectors-") as workdir:
+        for size in sizes:
+            results[str(size)] = bench_size(size, args, workdir)
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "sizes": results
+    }
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,288 @@
+"""Ingestão em lote de PDFs na base de conhecimento.
+
+A extração de texto roda em um pool de processos; os chunks resultantes são
+acumulados entre arquivos e enviados em lotes para o modelo de embeddings e
+para o ChromaDB; chunks cujo conteúdo já está na base não são reprocessados.
+Um manifesto (JSON) registra os arquivos já gravados, de modo que uma execução
+interrompida retoma de onde parou. Um arquivo cujo nome já está na base com
+outro conteúdo substitui a edição anterior, como no PUT /sources/{fonte}.
+
+Uso:
+    python -m bulk_ingest ./boletins --workers 4
+
+Com o rag_service no ar, prefira o endpoint POST /upload-pdfs, que usa o mesmo
+pipeline sem abrir uma segunda conexão ao banco.
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, Executor, ProcessPoolExecutor, wait
+from multiprocessing import get_context
+from typing import Callable, Container, Iterable, List, Optional, Tuple, Union
+
+from document_processing import file_sha256, pdf_display_name, prepare_pdf
+
+MANIFEST_VERSION = 1
+DEFAULT_FLUSH_SIZE = int(os.getenv("BULK_FLUSH_SIZE", "256"))
+
+
+class IngestManifest:
+    """Registro persistente dos arquivos já ingeridos, indexado pelo hash do conteúdo"""
+
+    def __init__(self, path: Optional[str]):
+        self.path = path
+        self.files = {}
+        if path and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.files = json.load(f).get("files", {})
+
+    def is_done(self, sha256: str) -> bool:
+        return self.files.get(sha256, {}).get("status") == "done"
+
+    def has_other_edition(self, source: str, sha256: str) -> bool:
+        """Indica se a fonte já foi registrada com outro conteúdo"""
+        return any(entry.get("source") == source for other, entry in self.files.items() if other != sha256)
+
+    def mark(self, sha256: str, **entry):
+        self.files[sha256] = {**entry, "updated_at": time.time()}
+
+    def save(self):
+        """Grava o manifesto de forma atômica (arquivo temporário + rename)"""
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": MANIFEST_VERSION, "files": self.files}, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self.path)
+
+    def forget_source(self, source: str) -> int:
+        """Remove os registros de uma fonte (ex.: apagada da base), para que possa ser ingerida de novo"""
+        removed = [sha256 for sha256, entry in self.files.items() if entry.get("source") == source]
+        for sha256 in removed:
+            del self.files[sha256]
+        return len(removed)
+
+    def clear(self):
+        self.files = {}
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def run_bulk_ingest(items: Iterable[Tuple[str, str, Union[bytes, str]]],
+                    store_fn: Callable[..., dict],
+                    manifest: IngestManifest,
+                    pool: Executor,
+                    max_in_flight: int,
+                    flush_size: int = DEFAULT_FLUSH_SIZE,
+                    on_progress: Optional[Callable[[dict], None]] = None,
+                    stored_sources: Optional[Container[str]] = None) -> dict:
+    """Executa o pipeline extração -> embeddings em lote -> escrita em lote.
+
+    `items` são tuplas (fonte, sha256, conteúdo ou caminho). `store_fn` recebe
+    os textos e metadados dos chunks, gera os embeddings dos que ainda não
+    existem, grava-os e retorna as contagens de chunks novos, existentes e
+    removidos; com `replace_source`, remove os chunks da edição anterior.
+    `stored_sources` são as fontes presentes na base: um arquivo marcado no
+    manifesto cuja fonte não está mais lá (base limpa por outro processo) é
+    ingerido de novo, e um arquivo novo com o nome de uma fonte existente a
+    substitui.
+    """
+    stats = {
+        "files_total": 0,
+        "files_done": 0,
+        "files_skipped": 0,
+        "files_failed": 0,
+        "pages_parsed": 0,
+        # Chunks dos arquivos já extraídos: o total cresce conforme a extração avança
+        "chunks_total": 0,
+        "chunks_embedded": 0,
+        "chunks_written": 0,
+        "chunks_existing": 0,
+        "chunks_removed": 0,
+        "failures": []
+    }
+    pending: List[Tuple[str, dict]] = []
+    pending_chunks = 0
+    # Fontes que já existem com outro conteúdo: gravadas uma a uma, com remoção da edição anterior
+    replacing = set()
+
+    def report():
+        if on_progress:
+            on_progress(stats)
+
+    def store(batch: List[Tuple[str, dict]], replace_source: Optional[str] = None):
+        documents, metadatas = [], []
+        for sha256, prepared in batch:
+            chunks = prepared["chunks"]
+            for idx, chunk in enumerate(chunks):
+                documents.append(chunk)
+                metadatas.append({
+                    "source": prepared["source"],
+                    "chunk_index": idx,
+                    "total_chunks": len(chunks),
+                    "total_pages": prepared["total_pages"],
+                    "chunk_length": len(chunk)
+                })
+
+        if replace_source is None:
+            stored = store_fn(documents, metadatas)
+        else:
+            stored = store_fn(documents, metadatas, replace_source=replace_source)
+        stats["chunks_embedded"] += stored["new"]
+        stats["chunks_written"] += stored["new"]
+        stats["chunks_existing"] += stored["existing"] + stored["duplicates"]
+        stats["chunks_removed"] += stored.get("removed", 0)
+
+    def flush():
+        nonlocal pending, pending_chunks
+        if not pending:
+            return
+
+        replacements = [entry for entry in pending if entry[0] in replacing]
+        store([entry for entry in pending if entry[0] not in replacing])
+        for entry in replacements:
+            store([entry], replace_source=entry[1]["source"])
+
+        # Só marca os arquivos como concluídos depois que todos os chunks foram gravados
+        for sha256, prepared in pending:
+            if sha256 in replacing:
+                # O manifesto passa a registrar a nova edição, não a antiga
+                manifest.forget_source(prepared["source"])
+                replacing.discard(sha256)
+            manifest.mark(sha256, source=prepared["source"], status="done",
+                          chunks=len(prepared["chunks"]), total_pages=prepared["total_pages"])
+            stats["files_done"] += 1
+        manifest.save()
+
+        pending = []
+        pending_chunks = 0
+        report()
+
+    def handle(sha256: str, prepared: dict):
+        nonlocal pending_chunks
+        if "error" in prepared:
+            logging.warning(f"Falha ao extrair {prepared['source']}: {prepared['error']}")
+            manifest.mark(sha256, source=prepared["source"], status="failed", error=prepared["error"])
+            stats["files_failed"] += 1
+            stats["failures"].append({"source": prepared["source"], "error": prepared["error"]})
+            report()
+            return
+
+        stats["pages_parsed"] += prepared["total_pages"]
+        stats["chunks_total"] += len(prepared["chunks"])
+        pending.append((sha256, prepared))
+        pending_chunks += len(prepared["chunks"])
+        report()
+        if pending_chunks >= flush_size:
+            flush()
+
+    in_flight = {}
+    for source, sha256, data in items:
+        stats["files_total"] += 1
+        if manifest.is_done(sha256) and (stored_sources is None or manifest.files[sha256].get("source") in stored_sources):
+            stats["files_skipped"] += 1
+            report()
+            continue
+        if manifest.has_other_edition(source, sha256) or (stored_sources is not None and source in stored_sources):
+            replacing.add(sha256)
+
+        # Limita os arquivos em extração para não manter todo o lote em memória
+        while len(in_flight) >= max_in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                handle(in_flight.pop(future), future.result())
+
+        in_flight[pool.submit(prepare_pdf, source, data)] = sha256
+
+    while in_flight:
+        done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+        for future in done:
+            handle(in_flight.pop(future), future.result())
+
+    flush()
+    manifest.save()
+    return stats
+
+
+def iter_pdf_files(root: str) -> Iterable[Tuple[str, str, str]]:
+    """Percorre a pasta em ordem estável, gerando (fonte, sha256, caminho) para cada PDF"""
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if filename.lower().endswith(".pdf"):
+                path = os.path.join(dirpath, filename)
+                yield pdf_display_name(path, root), file_sha256(path), path
+
+
+def bytes_sha256(contents: bytes) -> str:
+    return hashlib.sha256(contents).hexdigest()
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Ingestão em lote de PDFs na base de conhecimento")
+    parser.add_argument("directory", help="Pasta com os PDFs (percorrida recursivamente)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="Processos para extração de texto (padrão: número de CPUs)")
+    parser.add_argument("--manifest", default=None,
+                        help="Arquivo de manifesto (padrão: <directory>/.ingest_manifest.json)")
+    parser.add_argument("--flush-size", type=int, default=DEFAULT_FLUSH_SIZE,
+                        help="Chunks acumulados antes de gerar embeddings e gravar")
+    parser.add_argument("--restart", action="store_true",
+                        help="Ignora o manifesto existente e reprocessa todos os arquivos")
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.directory):
+        parser.error(f"Pasta não encontrada: {args.directory}")
+
+    # Importado aqui para que os processos de extração não carreguem o modelo; o
+    # pool usa "spawn" porque, com fork, os filhos herdariam o modelo, o cliente da
+    # base e as threads de ingestão já iniciadas pelo rag_service
+    import rag_service
+    if rag_service.RAG_ROLE != "writer":
+        parser.error("A ingestão em lote grava na base; rode-a sem RAG_ROLE=reader")
+    rag_service.load_resources()
+
+    manifest = IngestManifest(args.manifest or os.path.join(args.directory, ".ingest_manifest.json"))
+    if args.restart:
+        manifest.clear()
+
+    started = time.perf_counter()
+    last_log = 0.0
+
+    def on_progress(stats: dict):
+        nonlocal last_log
+        now = time.perf_counter()
+        if now - last_log >= 2:
+            last_log = now
+            logging.info(
+                f"{stats['files_done'] + stats['files_skipped'] + stats['files_failed']} arquivos "
+                f"({stats['files_skipped']} já ingeridos, {stats['files_failed']} com falha), "
+                f"{stats['chunks_written']} chunks gravados"
+            )
+
+    workers = max(1, args.workers)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn")) as pool:
+        stats = run_bulk_ingest(
+            iter_pdf_files(args.directory),
+            store_fn=rag_service.store_bulk_chunks,
+            manifest=manifest,
+            pool=pool,
+            max_in_flight=workers * 2,
+            flush_size=args.flush_size,
+            on_progress=on_progress,
+            stored_sources=rag_service.vector_store.source_sizes()
+        )
+
+    elapsed = time.perf_counter() - started
+    stats["elapsed_s"] = round(elapsed, 2)
+    stats["chunks_per_s"] = round(stats["chunks_written"] / elapsed, 1) if elapsed > 0 else 0.0
+    print(json.dumps(stats, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,180 @@
+"""Montagem do contexto enviado à LLM dentro de um orçamento de tokens.
+
+Os chunks recuperados se sobrepõem (chunk_text_with_overlap repete ~150
+caracteres entre vizinhos) e às vezes se repetem entre fontes. Antes de
+entrar no prompt eles são:
+1. deduplicados pelo texto normalizado;
+2. unidos em trechos contínuos quando são vizinhos (chunk_index consecutivo)
+   da mesma fonte, sem repetir a sobreposição;
+3. ordenados pela similaridade e incluídos até o orçamento de tokens.
+
+A contagem de tokens é uma estimativa por caracteres, suficiente para o
+orçamento e para comparar com a montagem anterior (chunks inteiros).
+"""
+import math
+from typing import List, Optional, Tuple
+
+from document_processing import normalize_chunk_text
+
+SEPARATOR = "\n\n---\n\n"
+# Sobreposição máxima procurada entre chunks vizinhos e mínima para considerá-la
+MAX_OVERLAP_CHARS = 400
+MIN_OVERLAP_CHARS = 16
+# Trechos que não cabem inteiros só entram cortados se sobrar ao menos isto do orçamento
+MIN_TRUNCATED_TOKENS = 64
+TRUNCATION_MARK = " [...]"
+
+
+def estimate_tokens(text: str, chars_per_token: float = 4.0) -> int:
+    return math.ceil(len(text) / chars_per_token) if text else 0
+
+
+def merge_overlapping(first: str, second: str) -> str:
+    """Concatena dois chunks vizinhos removendo o texto repetido entre o fim de um e o início do outro"""
+    for size in range(min(len(first), len(second), MAX_OVERLAP_CHARS), MIN_OVERLAP_CHARS - 1, -1):
+        if first.endswith(second[:size]):
+            return first + second[size:]
+    return f"{first} {second}"
+
+
+def source_header(source: str, first: int, last: int) -> str:
+    if first == last:
+        return f"[Fonte: {source} - Trecho {first + 1}]"
+    return f"[Fonte: {source} - Trechos {first + 1}-{last + 1}]"
+
+
+def hit_source(metadata: dict):
+    source = metadata.get("source")
+    return "Documento" if source is None else source
+
+
+def chunk_position(metadata: dict) -> Optional[int]:
+    """chunk_index como inteiro; metadados enviados pelo cliente podem trazê-lo como texto ou inválido"""
+    try:
+        return int(metadata.get("chunk_index"))
+    except (TypeError, ValueError):
+        return None
+
+
+def naive_context(hits: List[dict]) -> str:
+    """Contexto como era montado antes: todos os chunks inteiros, na ordem da busca"""
+    parts = []
+    for i, hit in enumerate(hits):
+        index = chunk_position(hit["metadata"])
+        index = i if index is None else index
+        parts.append(f"{source_header(hit_source(hit['metadata']), index, index)}\n{hit['document']}")
+    return SEPARATOR.join(parts)
+
+
+def build_passages(hits: List[dict]) -> Tuple[List[dict], int]:
+    """Deduplica e une chunks vizinhos; retorna os trechos e quantos chunks repetidos foram descartados"""
+    seen = set()
+    unique = []
+    for rank, hit in enumerate(hits):
+        key = normalize_chunk_text(hit["document"])
+        if key in seen:
+            continue
+        seen.add(key)
+        index = chunk_position(hit["metadata"])
+        unique.append({
+            "source": hit_source(hit["metadata"]),
+            "first": index if index is not None else rank,
+            "last": index if index is not None else rank,
+            "adjacent": index is not None,
+            "text": hit["document"],
+            "similarity": hit["similarity"],
+            "chunks": 1
+        })
+    duplicates = len(hits) - len(unique)
+
+    # Vizinhos da mesma fonte viram um único trecho, com a melhor similaridade entre eles
+    # Fontes podem misturar tipos (ex.: 5 e "boletim.pdf"): ordena pela representação em texto
+    unique.sort(key=lambda p: (str(p["source"]), not p["adjacent"], p["first"]))
+    passages: List[dict] = []
+    for passage in unique:
+        previous = passages[-1] if passages else None
+        if (previous is not None and passage["adjacent"] and previous["adjacent"]
+                and previous["source"] == passage["source"] and passage["first"] == previous["last"] + 1):
+            previous["text"] = merge_overlapping(previous["text"], passage["text"])
+            previous["last"] = passage["last"]
+            previous["similarity"] = max(previous["similarity"], passage["similarity"])
+            previous["chunks"] += 1
+        else:
+            passages.append(dict(passage))
+
+    # Trechos inteiramente contidos em outro (ex.: mesmo texto em outra fonte) são descartados
+    normalized = [normalize_chunk_text(p["text"]) for p in passages]
+    kept = []
+    for i, passage in enumerate(passages):
+        contained = any(
+            j != i and normalized[i] in normalized[j] and (len(normalized[i]) < len(normalized[j]) or j < i)
+            for j in range(len(passages))
+        )
+        if contained:
+            duplicates += passage["chunks"]
+        else:
+            kept.append(passage)
+
+    kept.sort(key=lambda p: p["similarity"], reverse=True)
+    return kept, duplicates
+
+
+def truncate_text(text: str, max_chars: int) -> str:
+    """Corta no fim de uma frase quando possível"""
+    if len(text) <= max_chars:
+        return text
+    cut = text[:max_chars]
+    period = cut.rfind(".")
+    if period > max_chars * 0.5:
+        cut = cut[:period + 1]
+    return cut.rstrip() + TRUNCATION_MARK
+
+
+def assemble_context(hits: List[dict], budget_tokens: int, chars_per_token: float = 4.0) -> Tuple[str, dict]:
+    """Monta o contexto a partir dos chunks recuperados (document, similarity, metadata).
+
+    Retorna o texto e as estatísticas da montagem, incluindo os tokens
+    economizados em relação a enviar todos os chunks inteiros.
+    """
+    passages, duplicates = build_passages(hits)
+
+    parts = []
+    used = 0
+    truncated = 0
+    dropped = 0
+    separator_tokens = estimate_tokens(SEPARATOR, chars_per_token)
+    for passage in passages:
+        header = source_header(passage["source"], passage["first"], passage["last"])
+        part = f"{header}\n{passage['text']}"
+        cost = estimate_tokens(part, chars_per_token) + (separator_tokens if parts else 0)
+        remaining = budget_tokens - used
+        if cost <= remaining:
+            parts.append(part)
+            used += cost
+            continue
+        # O trecho mais relevante sempre entra, mesmo cortado
+        if not parts or remaining >= MIN_TRUNCATED_TOKENS:
+            room = int((remaining - (separator_tokens if parts else 0)) * chars_per_token) - len(header) - 1 - len(TRUNCATION_MARK)
+            if room > 0:
+                part = f"{header}\n{truncate_text(passage['text'], room)}"
+                parts.append(part)
+                used += estimate_tokens(part, chars_per_token) + (separator_tokens if len(parts) > 1 else 0)
+                truncated += 1
+                continue
+        dropped += 1
+
+    context = SEPARATOR.join(parts)
+    naive_tokens = estimate_tokens(naive_context(hits), chars_per_token)
+    context_tokens = estimate_tokens(context, chars_per_token)
+    return context, {
+        "chunks": len(hits),
+        "passages": len(parts),
+        "merged_chunks": sum(p["chunks"] for p in passages) - len(passages),
+        "duplicates_removed": duplicates,
+        "truncated": truncated,
+        "dropped": dropped,
+        "budget_tokens": budget_tokens,
+        "context_tokens": context_tokens,
+        "naive_tokens": naive_tokens,
+        "saved_tokens": max(0, naive_tokens - context_tokens)
+    }
@@ -0,0 +1,110 @@
+"""Extração e preparação de texto para a base de conhecimento.
+
+Este módulo não carrega modelos nem clientes, para que possa ser importado
+pelos processos auxiliares da ingestão em lote sem custo de inicialização.
+"""
+import hashlib
+import io
+import os
+import re
+import unicodedata
+from typing import Callable, List, Optional, Tuple, Union
+
+import PyPDF2
+
+
+def clean_text(text: str) -> str:
+    """Limpa e normaliza texto extraído de PDF - versão mais permissiva"""
+    text = re.sub(r'[\x00-\x08\x0b-\x0c\x0e-\x1f\x7f-\x9f]', '', text)
+    text = re.sub(r'\n{3,}', '\n\n', text)
+    text = re.sub(r'[ \t]+', ' ', text)
+
+    lines = [line.strip() for line in text.split('\n')]
+    text = '\n'.join(lines)
+    return text.strip()
+
+def chunk_text_with_overlap(text: str, chunk_size: int = 800, overlap: int = 150) -> List[str]:
+    """Divide texto em chunks menores e mais focados"""
+    chunks = []
+    start = 0
+    
+    while start < len(text):
+        end = start + chunk_size
+        
+        if end < len(text):
+            last_period = text[start:end].rfind('.')
+            if last_period > chunk_size * 0.5:  
+                end = start + last_period + 1
+        
+        chunk = text[start:end].strip()
+        if chunk:
+            chunks.append(chunk)
+        
+        start = end - overlap if end < len(text) else end
+    
+    return chunks
+
+def normalize_chunk_text(text: str) -> str:
+    """Forma canônica do texto usada no hash: Unicode NFKC e espaços colapsados"""
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+def content_chunk_id(text: str, source: Optional[object]) -> str:
+    """Id endereçado por conteúdo: hash do texto normalizado e da fonte do chunk"""
+    digest = hashlib.sha256()
+    # A fonte vem dos metadados do cliente e pode não ser string (ex.: um número)
+    digest.update(("" if source is None else str(source)).encode("utf-8"))
+    digest.update(b"\x00")
+    digest.update(normalize_chunk_text(text).encode("utf-8"))
+    return digest.hexdigest()[:32]
+
+def extract_pdf_text(contents: bytes, on_page: Optional[Callable[[int, int], None]] = None) -> Tuple[int, List[str]]:
+    """Extrai e limpa o texto de cada página de um PDF, retornando (total de páginas, textos)"""
+    pdf_reader = PyPDF2.PdfReader(io.BytesIO(contents))
+    total_pages = len(pdf_reader.pages)
+
+    extracted_text = []
+    for page_number, page in enumerate(pdf_reader.pages, start=1):
+        text = page.extract_text()
+        if text.strip():
+            cleaned = clean_text(text)
+            if cleaned:
+                extracted_text.append(cleaned)
+        if on_page:
+            on_page(page_number, total_pages)
+
+    return total_pages, extracted_text
+
+def file_sha256(path: str) -> str:
+    """Hash SHA-256 do conteúdo de um arquivo, lido em blocos"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def prepare_pdf(source: str, data: Union[bytes, str], chunk_size: int = 800, overlap: int = 150) -> dict:
+    """Lê, extrai e divide um PDF em chunks; executado nos processos da ingestão em lote.
+
+    `data` pode ser o conteúdo do arquivo ou o caminho até ele. Erros são
+    retornados no dicionário para não derrubar o pool de processos.
+    """
+    try:
+        if isinstance(data, str):
+            with open(data, "rb") as f:
+                data = f.read()
+
+        total_pages, extracted_text = extract_pdf_text(data)
+        if not extracted_text:
+            return {"source": source, "error": "Não foi possível extrair texto do PDF"}
+
+        chunks = chunk_text_with_overlap("\n\n".join(extracted_text), chunk_size=chunk_size, overlap=overlap)
+        return {"source": source, "total_pages": total_pages, "chunks": chunks}
+
+    except PyPDF2.errors.PdfReadError:
+        return {"source": source, "error": "Arquivo PDF corrompido ou inválido"}
+    except Exception as e:
+        return {"source": source, "error": f"{type(e).__name__}: {e}"}
+
+def pdf_display_name(path: str, root: str) -> str:
+    """Nome da fonte gravado nos metadados: caminho relativo à pasta de ingestão"""
+    return os.path.relpath(path, root).replace(os.sep, "/")
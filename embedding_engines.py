@@ -0,0 +1,225 @@
+"""
+Motores de embedding selecionáveis do serviço RAG (EMBEDDING_ENGINE).
+
+- sentence-transformers: o SentenceTransformer em PyTorch, como antes;
+- torch-int8: o mesmo modelo com as camadas lineares quantizadas em int8
+  (quantização dinâmica do PyTorch);
+- onnx / onnx-int8: o modelo exportado para ONNX, executado com onnxruntime e
+  o tokenizer do pacote `tokenizers`, sem importar PyTorch.
+
+O modelo pode ser um nome do Hugging Face ou um diretório local; os motores
+ONNX exigem um diretório com tokenizer.json e o arquivo .onnx (na raiz ou em
+onnx/), como o do repositório sentence-transformers/all-MiniLM-L6-v2. Para
+gerar a versão int8 a partir do model.onnx:
+
+    python -m embedding_engines quantize ./models/all-MiniLM-L6-v2
+"""
+import argparse
+import glob
+import json
+import logging
+import os
+import time
+from typing import List, Optional, Union
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+ONNX_FILES = ("model.onnx", "onnx/model.onnx")
+# Variantes int8: a gerada pelo comando `quantize` e as publicadas no Hugging Face
+ONNX_INT8_FILES = ("model_qint8.onnx", "onnx/model_qint8.onnx", "onnx/model_quint8_avx2.onnx",
+                   "onnx/model_qint8_avx512.onnx", "onnx/model_qint8_arm64.onnx")
+
+
+def read_json(directory: str, name: str) -> dict:
+    path = os.path.join(directory, name)
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+class EmbeddingEngine:
+    """Interface comum: `encode` retorna uma matriz float32 (n, dimension)"""
+
+    name = ""
+
+    def __init__(self, model: str):
+        self.model_name = os.path.basename(os.path.normpath(model)) if os.path.isdir(model) else model
+        self.dimension = 0
+        self.load_seconds = 0.0
+
+    def encode(self, texts: Union[str, List[str]], batch_size: int = 32) -> np.ndarray:
+        raise NotImplementedError
+
+    def status(self) -> dict:
+        return {
+            "engine": self.name,
+            "model": self.model_name,
+            "dimension": self.dimension,
+            "load_s": round(self.load_seconds, 2)
+        }
+
+
+class SentenceTransformerEngine(EmbeddingEngine):
+    name = "sentence-transformers"
+
+    def __init__(self, model: str, quantized: bool = False, threads: int = 0):
+        super().__init__(model)
+        started = time.perf_counter()
+        import torch
+        from sentence_transformers import SentenceTransformer
+
+        if threads:
+            torch.set_num_threads(threads)
+        self.model = SentenceTransformer(model, device="cpu")
+        if quantized:
+            self.name = "torch-int8"
+            self.model = torch.quantization.quantize_dynamic(self.model, {torch.nn.Linear}, dtype=torch.qint8)
+        self.dimension = self.model.get_sentence_embedding_dimension()
+        self.load_seconds = time.perf_counter() - started
+
+    def encode(self, texts, batch_size=32):
+        embeddings = self.model.encode(texts, batch_size=batch_size, convert_to_numpy=True, show_progress_bar=False)
+        return embeddings.astype(np.float32, copy=False)
+
+
+class OnnxEngine(EmbeddingEngine):
+    """Transformer em ONNX + pooling e normalização conforme a configuração do sentence-transformers"""
+
+    name = "onnx"
+
+    def __init__(self, model: str, quantized: bool = False, threads: int = 0, onnx_file: Optional[str] = None):
+        super().__init__(model)
+        if not os.path.isdir(model):
+            raise ValueError(f"O motor ONNX precisa de um diretório local com o modelo exportado: {model}")
+        started = time.perf_counter()
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        if quantized:
+            self.name = "onnx-int8"
+        path = self.find_model_file(model, quantized, onnx_file)
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {item.name for item in self.session.get_inputs()}
+        outputs = [item.name for item in self.session.get_outputs()]
+        # Alguns exports já incluem o pooling e devolvem `sentence_embedding`
+        self.pooled = "sentence_embedding" in outputs
+        self.output_name = "sentence_embedding" if self.pooled else outputs[0]
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(model, "tokenizer.json"))
+        max_length = read_json(model, "sentence_bert_config.json").get("max_seq_length", 256)
+        self.tokenizer.enable_truncation(max_length=max_length)
+        if self.tokenizer.padding is None:
+            self.tokenizer.enable_padding(pad_id=self.tokenizer.token_to_id("[PAD]") or 0)
+
+        pooling = read_json(model, "1_Pooling/config.json")
+        self.cls_pooling = bool(pooling.get("pooling_mode_cls_token"))
+        modules = read_json(model, "modules.json") or []
+        self.normalize = any(module.get("type", "").endswith("Normalize") for module in modules)
+
+        self.model_file = os.path.relpath(path, model)
+        self.dimension = int(self.encode(["dimensão"]).shape[1])
+        self.load_seconds = time.perf_counter() - started
+
+    @staticmethod
+    def find_model_file(model: str, quantized: bool, onnx_file: Optional[str] = None) -> str:
+        if onnx_file:
+            candidates = [onnx_file]
+        elif quantized:
+            candidates = list(ONNX_INT8_FILES) + sorted(
+                os.path.relpath(path, model) for path in glob.glob(os.path.join(model, "**", "*int8*.onnx"), recursive=True)
+            )
+        else:
+            candidates = list(ONNX_FILES)
+        for name in candidates:
+            path = os.path.join(model, name)
+            if os.path.exists(path):
+                return path
+        raise FileNotFoundError(f"Nenhum modelo ONNX ({', '.join(candidates[:3])}...) encontrado em {model}")
+
+    def encode(self, texts, batch_size=32):
+        single = isinstance(texts, str)
+        if single:
+            texts = [texts]
+        batches = []
+        for start in range(0, len(texts), batch_size):
+            encodings = self.tokenizer.encode_batch(texts[start:start + batch_size])
+            attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+            feeds = {
+                "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+                "attention_mask": attention_mask
+            }
+            if "token_type_ids" in self.input_names:
+                feeds["token_type_ids"] = np.array([e.type_ids for e in encodings], dtype=np.int64)
+            output = self.session.run([self.output_name], feeds)[0]
+
+            if self.pooled:
+                embeddings = output
+            elif self.cls_pooling:
+                embeddings = output[:, 0]
+            else:
+                # Média dos tokens, ignorando o padding
+                mask = attention_mask[:, :, None].astype(np.float32)
+                embeddings = (output * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+            if self.normalize:
+                embeddings = embeddings / np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+            batches.append(embeddings.astype(np.float32, copy=False))
+
+        if not batches:
+            return np.empty((0, self.dimension), dtype=np.float32)
+        result = np.vstack(batches)
+        return result[0] if single else result
+
+    def status(self) -> dict:
+        return {**super().status(), "model_file": self.model_file}
+
+
+EMBEDDING_ENGINES = ("sentence-transformers", "torch-int8", "onnx", "onnx-int8")
+
+
+def load_embedding_engine(engine: str, model: str, threads: int = 0, onnx_file: Optional[str] = None) -> EmbeddingEngine:
+    """Carrega o motor de embeddings indicado"""
+    if engine in ("sentence-transformers", "torch-int8"):
+        loaded = SentenceTransformerEngine(model, quantized=engine == "torch-int8", threads=threads)
+    elif engine in ("onnx", "onnx-int8"):
+        loaded = OnnxEngine(model, quantized=engine == "onnx-int8", threads=threads, onnx_file=onnx_file)
+    else:
+        raise ValueError(f"EMBEDDING_ENGINE desconhecido: {engine} (opções: {', '.join(EMBEDDING_ENGINES)})")
+    logger.info(f"Motor de embeddings {loaded.name} ({loaded.model_name}, {loaded.dimension} dimensões) "
+                f"carregado em {loaded.load_seconds:.1f}s")
+    return loaded
+
+
+def quantize_onnx(model: str, source: Optional[str] = None) -> str:
+    """Gera model_qint8.onnx (pesos int8, quantização dinâmica) a partir do modelo ONNX do diretório"""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    source_path = os.path.join(model, source) if source else OnnxEngine.find_model_file(model, quantized=False)
+    target = os.path.join(model, "model_qint8.onnx")
+    quantize_dynamic(source_path, target, weight_type=QuantType.QInt8)
+    logger.info(f"Modelo int8 gravado em {target} ({os.path.getsize(source_path) >> 20} MB -> "
+                f"{os.path.getsize(target) >> 20} MB)")
+    return target
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ferramentas dos motores de embedding")
+    commands = parser.add_subparsers(dest="command", required=True)
+    quantize = commands.add_parser("quantize", help="Gera model_qint8.onnx a partir do model.onnx do diretório")
+    quantize.add_argument("model_dir")
+    quantize.add_argument("--source", help="Arquivo .onnx de origem, relativo ao diretório")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.command == "quantize":
+        quantize_onnx(args.model_dir, args.source)
+
+
+if __name__ == "__main__":
+    main()
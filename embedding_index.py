@@ -0,0 +1,246 @@
+"""
+Índice de embeddings somente leitura, mapeado em memória e compartilhado
+entre processos.
+
+A base vetorial (qualquer VectorStore de vector_stores.py) é exportada para um
+diretório versionado:
+- embeddings.npy: matriz (n, dim) float32 ou float16;
+- sq_norms.npy: normas ao quadrado de cada linha (para a distância L2);
+- records.jsonl + offsets.npy: id, texto e metadados de cada linha.
+
+O meta.json traz também os chunks e caracteres por fonte, para que todos os
+processos informem os mesmos números sem abrir a base vetorial.
+
+Tudo é aberto com mmap, então vários workers do uvicorn compartilham as
+mesmas páginas via cache do sistema operacional. O arquivo CURRENT aponta para
+a versão ativa e é trocado atomicamente após cada reconstrução; cada worker
+percebe a troca na consulta seguinte e remapeia.
+"""
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+CURRENT_FILE = "CURRENT"
+# Linhas por bloco na busca: limita a memória temporária com float16
+SEARCH_BLOCK_ROWS = 65536
+# Versões antigas mantidas para workers que ainda não remapearam
+KEEP_VERSIONS = 2
+
+
+def tally_source(sizes: Dict[Optional[str], dict], document: Optional[str], metadata: Optional[dict], sign: int = 1):
+    """Soma (ou subtrai, com sign=-1) um registro aos chunks e caracteres da sua fonte"""
+    source = (metadata or {}).get("source")
+    entry = sizes.setdefault(source, {"chunks": 0, "chars": 0})
+    entry["chunks"] += sign
+    entry["chars"] += sign * len(document or "")
+    if entry["chunks"] <= 0:
+        del sizes[source]
+
+
+def export_collection(store, directory: str, dtype: str = "float32", page_size: int = 5000) -> str:
+    """Exporta a base vetorial para uma nova versão do índice e a ativa; retorna o nome da versão"""
+    os.makedirs(directory, exist_ok=True)
+    # Nomes em ordem cronológica (com nanossegundos), usada ao descartar versões antigas
+    version = f"v{time.strftime('%Y%m%d-%H%M%S')}-{time.time_ns() % 10**9:09d}-{uuid.uuid4().hex[:4]}"
+    tmp_path = os.path.join(directory, f".{version}.tmp")
+    os.makedirs(tmp_path)
+
+    total = store.count()
+    matrix = None
+    offsets = np.zeros(total + 1, dtype=np.int64)
+    sizes: Dict[Optional[str], dict] = {}
+    row = 0
+    with open(os.path.join(tmp_path, "records.jsonl"), "wb") as records:
+        for offset in range(0, total, page_size):
+            page = store.get(limit=page_size, offset=offset)
+            embeddings = np.asarray(page["embeddings"], dtype=np.float32)
+            if matrix is None and len(embeddings):
+                matrix = np.lib.format.open_memmap(
+                    os.path.join(tmp_path, "embeddings.npy"), mode="w+", dtype=dtype, shape=(total, embeddings.shape[1])
+                )
+            for i, chunk_id in enumerate(page["ids"]):
+                if row >= total:
+                    break
+                matrix[row] = embeddings[i]
+                line = json.dumps({
+                    "id": chunk_id,
+                    "document": page["documents"][i],
+                    "metadata": page["metadatas"][i] or {}
+                }, ensure_ascii=False).encode("utf-8") + b"\n"
+                records.write(line)
+                tally_source(sizes, page["documents"][i], page["metadatas"][i])
+                offsets[row + 1] = offsets[row] + len(line)
+                row += 1
+
+    if matrix is None:
+        matrix = np.lib.format.open_memmap(os.path.join(tmp_path, "embeddings.npy"), mode="w+", dtype=dtype, shape=(0, 0))
+    # A base pode ter mudado durante a exportação; grava só as linhas lidas
+    rows = matrix[:row]
+    np.save(os.path.join(tmp_path, "sq_norms.npy"),
+            np.einsum("ij,ij->i", rows, rows, dtype=np.float32) if row else np.zeros(0, dtype=np.float32))
+    np.save(os.path.join(tmp_path, "offsets.npy"), offsets[:row + 1])
+    matrix.flush()
+    with open(os.path.join(tmp_path, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({
+            "version": version,
+            "rows": row,
+            "dtype": dtype,
+            "space": store.space,
+            "created_at": time.time(),
+            # Lista, não dicionário: a fonte pode ser None ou um número
+            "sources": [{"source": source, **entry} for source, entry in sizes.items()]
+        }, f, ensure_ascii=False)
+    del matrix, rows
+
+    os.replace(tmp_path, os.path.join(directory, version))
+    current_tmp = os.path.join(directory, f".{CURRENT_FILE}.{uuid.uuid4().hex}")
+    with open(current_tmp, "w") as f:
+        f.write(version)
+    os.replace(current_tmp, os.path.join(directory, CURRENT_FILE))
+
+    prune_versions(directory, version)
+    logger.info(f"Índice mmap {version} exportado: {row} embeddings ({dtype})")
+    return version
+
+
+def prune_versions(directory: str, current: str):
+    versions = sorted(
+        name for name in os.listdir(directory)
+        if name.startswith("v") and os.path.isdir(os.path.join(directory, name)) and name != current
+    )
+    # No Linux, um worker que ainda mapeia uma versão removida continua lendo os dados até remapear
+    for name in versions[:max(0, len(versions) - (KEEP_VERSIONS - 1))]:
+        shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+
+
+def top_k_search(matrix: np.ndarray, sq_norms: np.ndarray, query: np.ndarray, k: int,
+                 space: str = "l2") -> Tuple[List[int], List[float]]:
+    """Top-k exato em blocos: linhas e distâncias na métrica do ChromaDB (l2, cosine ou ip)"""
+    rows = len(matrix)
+    if rows == 0 or k <= 0:
+        return [], []
+
+    query = np.asarray(query, dtype=np.float32)
+    q_norm = float(np.dot(query, query))
+    best_rows = np.empty(0, dtype=np.int64)
+    best_dist = np.empty(0, dtype=np.float32)
+    for start in range(0, rows, SEARCH_BLOCK_ROWS):
+        block = np.asarray(matrix[start:start + SEARCH_BLOCK_ROWS], dtype=np.float32)
+        block_norms = np.asarray(sq_norms[start:start + len(block)])
+        dots = block @ query
+        if space == "cosine":
+            dist = 1 - dots / np.maximum(np.sqrt(block_norms * q_norm), 1e-12)
+        elif space == "ip":
+            dist = 1 - dots
+        else:
+            # L2 ao quadrado, como no ChromaDB: |x|² - 2x·q + |q|²
+            dist = block_norms - 2 * dots + q_norm
+
+        take = min(k, len(dist))
+        top = np.argpartition(dist, take - 1)[:take]
+        best_rows = np.concatenate([best_rows, top + start])
+        best_dist = np.concatenate([best_dist, dist[top]])
+        if len(best_rows) > k:
+            keep = np.argpartition(best_dist, k - 1)[:k]
+            best_rows, best_dist = best_rows[keep], best_dist[keep]
+
+    order = np.argsort(best_dist)
+    return best_rows[order].tolist(), best_dist[order].tolist()
+
+
+class IndexSnapshot:
+    """Uma versão mapeada do índice; imutável, para que a troca não afete buscas em andamento"""
+
+    def __init__(self, path: str):
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            self.meta = json.load(f)
+        # A matriz pode ter linhas sobrando se a coleção encolheu durante a exportação
+        self.matrix = np.load(os.path.join(path, "embeddings.npy"), mmap_mode="r")[:self.meta["rows"]]
+        self.sq_norms = np.load(os.path.join(path, "sq_norms.npy"), mmap_mode="r")
+        self.offsets = np.load(os.path.join(path, "offsets.npy"), mmap_mode="r")
+        self.records = np.memmap(os.path.join(path, "records.jsonl"), dtype=np.uint8, mode="r") \
+            if self.meta["rows"] else np.zeros(0, dtype=np.uint8)
+
+    def source_sizes(self) -> Optional[Dict[Optional[str], dict]]:
+        """Chunks e caracteres por fonte gravados na exportação (None em versões antigas)"""
+        if "sources" not in self.meta:
+            return None
+        return {entry["source"]: {"chunks": entry["chunks"], "chars": entry["chars"]} for entry in self.meta["sources"]}
+
+    def record(self, row: int) -> dict:
+        start, end = int(self.offsets[row]), int(self.offsets[row + 1])
+        return json.loads(bytes(self.records[start:end]))
+
+    def search(self, query: np.ndarray, k: int) -> Tuple[List[int], List[float]]:
+        """Linhas e distâncias (na métrica da coleção) dos k vizinhos mais próximos"""
+        return top_k_search(self.matrix, self.sq_norms, query, k, self.meta.get("space", "l2"))
+
+
+class MmapEmbeddingIndex:
+    """Busca top-k exata e vetorizada sobre a versão ativa do índice exportado"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.snapshot: Optional[IndexSnapshot] = None
+        self._lock = threading.Lock()
+
+    @property
+    def version(self) -> Optional[str]:
+        return self.snapshot.meta["version"] if self.snapshot else None
+
+    @property
+    def ready(self) -> bool:
+        return self.snapshot is not None
+
+    def current_version(self) -> Optional[str]:
+        try:
+            with open(os.path.join(self.directory, CURRENT_FILE)) as f:
+                return f.read().strip() or None
+        except OSError:
+            return None
+
+    def refresh(self) -> bool:
+        """Remapeia se a versão ativa mudou; retorna True quando houve troca"""
+        version = self.current_version()
+        if version is None or version == self.version:
+            return False
+        with self._lock:
+            if version == self.version:
+                return False
+            self.snapshot = IndexSnapshot(os.path.join(self.directory, version))
+            logger.info(f"Índice mmap carregado: {version} ({self.snapshot.meta['rows']} embeddings)")
+            return True
+
+    def query(self, query: np.ndarray, n_results: int) -> dict:
+        """Busca no mesmo formato de resposta do `collection.query` do ChromaDB"""
+        snapshot = self.snapshot
+        rows, distances = snapshot.search(query, n_results)
+        records = [snapshot.record(row) for row in rows]
+        return {
+            "ids": [[r["id"] for r in records]],
+            "documents": [[r["document"] for r in records]],
+            "metadatas": [[r["metadata"] for r in records]],
+            "distances": [distances]
+        }
+
+    def status(self) -> dict:
+        snapshot = self.snapshot
+        if snapshot is None:
+            return {"ready": False}
+        return {
+            "ready": True,
+            "version": snapshot.meta["version"],
+            "rows": snapshot.meta["rows"],
+            "dtype": snapshot.meta["dtype"],
+            "space": snapshot.meta["space"],
+            "matrix_bytes": int(snapshot.matrix.nbytes)
+        }
@@ -6,6 +6,7 @@ let isLoadingStats = false;
 let lastStatsLoadTime = 0;
 const STATS_LOAD_COOLDOWN = 2000; // 2 segundos de cooldown
 let isUploadingData = false; // Flag para indicar que há upload em andamento entre carregamentos
+const JOB_POLL_INTERVAL = 1000; // Intervalo de consulta do status dos jobs de ingestão
 
 const tabBtns = document.querySelectorAll('.tab-btn');
 const tabContents = document.querySelectorAll('.tab-content');
@@ -127,20 +128,7 @@ processAudioBtn.addEventListener('click', async () => {
     formData.append('file', selectedAudioFile);
 
     try {
-        const response = await fetch(`${AUDIO_SERVICE_URL}/process-audio`, {
-            method: 'POST',
-            body: formData
-        });
-
-        const data = await response.json();
-
-        if (response.ok) {
-            transcription.textContent = data.transcription;
-            answer.textContent = data.answer;
-            audioResult.style.display = 'block';
-        } else {
-            showAudioError(data.detail || 'Erro ao processar áudio');
-        }
+        await processAudioStream(formData);
     } catch (error) {
         showAudioError('Erro de conexão com o serviço de áudio: ' + error.message);
     } finally {
@@ -149,6 +137,71 @@ processAudioBtn.addEventListener('click', async () => {
     }
 });
 
+// Envia o áudio ao endpoint de streaming (SSE) do gateway: a transcrição chega
+// primeiro e a resposta é exibida token a token enquanto é gerada
+async function processAudioStream(formData) {
+    const response = await fetch(`${AUDIO_SERVICE_URL}/process-audio/stream`, {
+        method: 'POST',
+        body: formData
+    });
+
+    if (!response.ok) {
+        const data = await response.json();
+        showAudioError(data.detail || 'Erro ao processar áudio');
+        return;
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+
+        buffer += decoder.decode(value, { stream: true });
+        let separator;
+        while ((separator = buffer.indexOf('\n\n')) >= 0) {
+            const rawEvent = buffer.slice(0, separator);
+            buffer = buffer.slice(separator + 2);
+            handleAudioStreamEvent(parseSseEvent(rawEvent));
+        }
+    }
+}
+
+function parseSseEvent(rawEvent) {
+    let event = 'message';
+    const dataLines = [];
+    rawEvent.split('\n').forEach(line => {
+        if (line.startsWith('event:')) {
+            event = line.slice(6).trim();
+        } else if (line.startsWith('data:')) {
+            dataLines.push(line.slice(5).trim());
+        }
+    });
+    return { event, data: dataLines.length ? JSON.parse(dataLines.join('\n')) : {} };
+}
+
+function handleAudioStreamEvent({ event, data }) {
+    switch (event) {
+        case 'transcription':
+            transcription.textContent = data.text;
+            answer.textContent = '';
+            audioLoading.style.display = 'none';
+            audioResult.style.display = 'block';
+            break;
+        case 'token':
+            answer.textContent += data.delta;
+            break;
+        case 'done':
+            answer.textContent = data.answer;
+            break;
+        case 'error':
+            showAudioError(data.detail || 'Erro ao processar áudio');
+            break;
+    }
+}
+
 function showAudioError(message) {
     audioResult.style.display = 'block';
     audioResult.innerHTML = `
@@ -251,20 +304,7 @@ processRecordedBtn.addEventListener('click', async () => {
     formData.append('file', recordedBlob, 'recording.webm');
 
     try {
-        const response = await fetch(`${AUDIO_SERVICE_URL}/process-audio`, {
-            method: 'POST',
-            body: formData
-        });
-
-        const data = await response.json();
-
-        if (response.ok) {
-            transcription.textContent = data.transcription;
-            answer.textContent = data.answer;
-            audioResult.style.display = 'block';
-        } else {
-            showAudioError(data.detail || 'Erro ao processar áudio');
-        }
+        await processAudioStream(formData);
     } catch (error) {
         showAudioError('Erro de conexão com o serviço de áudio: ' + error.message);
     } finally {
@@ -328,6 +368,7 @@ uploadPdfBtn.addEventListener('click', async () => {
 
     uploadPdfBtn.disabled = true;
     pdfLoading.style.display = 'block';
+    pdfLoading.querySelector('p').textContent = 'Processando PDF e gerando embeddings...';
     pdfResult.style.display = 'none';
     isUploadingData = true; // Marca que está fazendo upload
 
@@ -343,7 +384,14 @@ uploadPdfBtn.addEventListener('click', async () => {
         const data = await response.json();
 
         if (response.ok) {
-            showPdfSuccess(data);
+            // O upload retorna um job; aguarda o processamento em background
+            const job = await waitForJob(data.job_id);
+            if (job.status !== 'completed') {
+                showPdfError(job.error || 'Erro ao processar PDF');
+                isUploadingData = false;
+                return;
+            }
+            showPdfSuccess(job.result);
             
             selectedPdfFile = null;
             pdfFileInfo.style.display = 'none';
@@ -367,6 +415,31 @@ uploadPdfBtn.addEventListener('click', async () => {
     }
 });
 
+async function waitForJob(jobId) {
+    while (true) {
+        const response = await fetch(`${RAG_SERVICE_URL}/jobs/${jobId}`);
+        const job = await response.json();
+
+        if (!response.ok) {
+            return { status: 'failed', error: job.detail };
+        }
+
+        if (job.status === 'completed' || job.status === 'failed') {
+            return job;
+        }
+
+        if (job.total_chunks > 0) {
+            pdfLoading.querySelector('p').textContent =
+                `Processando... ${job.chunks_written + job.chunks_existing}/${job.total_chunks} fragmentos gravados`;
+        } else if (job.total_pages > 0) {
+            pdfLoading.querySelector('p').textContent =
+                `Lendo páginas... ${job.pages_parsed}/${job.total_pages}`;
+        }
+
+        await new Promise(resolve => setTimeout(resolve, JOB_POLL_INTERVAL));
+    }
+}
+
 function showPdfSuccess(data) {
     pdfResult.style.display = 'block';
     pdfResult.innerHTML = `
@@ -376,6 +449,7 @@ function showPdfSuccess(data) {
                 <strong>Arquivo:</strong> ${data.filename}<br>
                 <strong>Páginas:</strong> ${data.total_pages}<br>
                 <strong>Fragmentos adicionados:</strong> ${data.chunks_added}<br>
+                <strong>Fragmentos já existentes:</strong> ${data.chunks_existing || 0}<br>
                 <br>
                 ${data.message}
             </div>
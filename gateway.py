@@ -1,28 +1,264 @@
 from fastapi import FastAPI, File, UploadFile, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import hashlib
 import httpx
+import json
 import os
 import logging
+import time
+
+from audio_normalization import AudioNormalizationError, normalize_audio, normalized_filename
+from metrics import add_downstream_timings, collect_stages, install_metrics, observe_batch, request_id_headers, stage_timer
+from transcription_cache import cache_key
 
 logging.basicConfig(level=logging.INFO)
 
 app = FastAPI(title="API Gateway")
 
+WHISPER_SERVICE_URL = os.getenv("WHISPER_SERVICE_URL", "http://localhost:8001")
+RAG_SERVICE_URL = os.getenv("RAG_SERVICE_URL", "http://localhost:8002")
+
+MAX_FILE_SIZE = 25 * 1024 * 1024
+# Folga para os cabeçalhos do multipart ao limitar o corpo da requisição inteira
+MULTIPART_OVERHEAD = 64 * 1024
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+def too_large_detail(max_size: int = MAX_FILE_SIZE, what: str = "Arquivo") -> str:
+    return f"{what} muito grande. Máximo: {max_size / (1024*1024)}MB"
+
+class UploadSizeLimitMiddleware:
+    """
+    Limita o corpo das requisições antes do parse do multipart: recusa pelo
+    Content-Length declarado e, sem ele (ou se for falso), conta os bytes
+    conforme chegam e interrompe a leitura ao passar do limite.
+    `path_limits` define limites próprios por rota (ex.: o envio em lote)
+    """
+
+    def __init__(self, app, max_body_size: int, path_limits: Optional[Dict[str, int]] = None):
+        self.app = app
+        self.max_body_size = max_body_size
+        self.path_limits = path_limits or {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST":
+            await self.app(scope, receive, send)
+            return
+
+        max_body_size = self.path_limits.get(scope["path"], self.max_body_size)
+        detail = too_large_detail() if max_body_size == self.max_body_size else too_large_detail(max_body_size, "Lote")
+
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length and content_length.isdigit() and int(content_length) > max_body_size:
+            response = JSONResponse(status_code=413, content={"detail": detail})
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > max_body_size:
+                    # Levantada durante o parse do corpo; o FastAPI a converte em resposta 413
+                    raise HTTPException(status_code=413, detail=detail)
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+# Processamento em lote (/process-audio/batch): quantos arquivos por requisição,
+# o tamanho total do envio, quantos itens de um lote rodam ao mesmo tempo e
+# quantos itens, somando todos os lotes, podem estar no Whisper/RAG de uma vez.
+# Itens além desses limites esperam a vez, e recusas por sobrecarga (429/503
+# com Retry-After) são repetidas após a espera indicada
+BATCH_MAX_FILES = int(os.getenv("GATEWAY_BATCH_MAX_FILES", "200"))
+BATCH_MAX_BYTES = int(os.getenv("GATEWAY_BATCH_MAX_BYTES", str(512 * 1024 * 1024)))
+BATCH_CONCURRENCY = max(1, int(os.getenv("GATEWAY_BATCH_CONCURRENCY", "4")))
+BATCH_MAX_IN_FLIGHT = max(1, int(os.getenv("GATEWAY_BATCH_MAX_IN_FLIGHT", "8")))
+BATCH_RETRIES = max(0, int(os.getenv("GATEWAY_BATCH_RETRIES", "3")))
+BATCH_MAX_RETRY_AFTER = float(os.getenv("GATEWAY_BATCH_MAX_RETRY_AFTER", "30"))
+BATCH_PATH = "/process-audio/batch"
+
+app.add_middleware(
+    UploadSizeLimitMiddleware,
+    max_body_size=MAX_FILE_SIZE + MULTIPART_OVERHEAD,
+    path_limits={BATCH_PATH: BATCH_MAX_BYTES + MULTIPART_OVERHEAD}
+)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins="http://127.0.0.1:5500",
     allow_credentials=True,
     allow_methods=["GET", "POST"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing", "X-Request-ID"],
 )
 
-WHISPER_SERVICE_URL = os.getenv("WHISPER_SERVICE_URL", "http://localhost:8001")
-RAG_SERVICE_URL = os.getenv("RAG_SERVICE_URL", "http://localhost:8002")
+install_metrics(app, "gateway")
+
+# Cliente HTTP compartilhado durante a vida da aplicação: mantém conexões
+# keep-alive com o Whisper e o RAG em vez de abrir novas a cada requisição
+GATEWAY_TIMEOUT = float(os.getenv("GATEWAY_TIMEOUT", "300"))
+GATEWAY_CONNECT_TIMEOUT = float(os.getenv("GATEWAY_CONNECT_TIMEOUT", "5"))
+GATEWAY_MAX_CONNECTIONS = int(os.getenv("GATEWAY_MAX_CONNECTIONS", "100"))
+GATEWAY_MAX_KEEPALIVE = int(os.getenv("GATEWAY_MAX_KEEPALIVE", "20"))
+GATEWAY_KEEPALIVE_EXPIRY = float(os.getenv("GATEWAY_KEEPALIVE_EXPIRY", "30"))
+
+http_client: httpx.AsyncClient = None
+
+# Transcrições já conhecidas, pelo sha256 do áudio: áudio repetido não é nem
+# enviado ao Whisper (que também mantém seu próprio cache, em memória e disco).
+# Modelo, idioma e normalização entram na chave, como no cache do Whisper
+TRANSCRIPTION_CACHE_SIZE = int(os.getenv("GATEWAY_TRANSCRIPTION_CACHE_SIZE", "256"))
+WHISPER_MODEL = os.getenv("WHISPER_MODEL", "base")
+WHISPER_LANGUAGE = os.getenv("WHISPER_LANGUAGE", "pt")
+known_transcriptions: "OrderedDict[str, str]" = OrderedDict()
+
+# Normalização opcional do áudio antes do Whisper (requer ffmpeg): mono, 16 kHz,
+# sem silêncio nas pontas e, com codec "opus", recodificado em Ogg/Opus.
+# Com "wav" o arquivo fica maior, mas o Whisper o lê sem decodificar
+NORMALIZE_AUDIO = os.getenv("GATEWAY_NORMALIZE_AUDIO", "false").lower() in ("1", "true", "yes")
+NORMALIZE_CODEC = os.getenv("GATEWAY_NORMALIZE_CODEC", "opus")
+NORMALIZE_SILENCE_DB = float(os.getenv("GATEWAY_NORMALIZE_SILENCE_DB", "-40"))
+NORMALIZE_OPUS_BITRATE = os.getenv("GATEWAY_NORMALIZE_OPUS_BITRATE", "24k")
+
+@app.on_event("startup")
+async def open_http_client():
+    global http_client
+    http_client = httpx.AsyncClient(
+        timeout=httpx.Timeout(GATEWAY_TIMEOUT, connect=GATEWAY_CONNECT_TIMEOUT),
+        limits=httpx.Limits(
+            max_connections=GATEWAY_MAX_CONNECTIONS,
+            max_keepalive_connections=GATEWAY_MAX_KEEPALIVE,
+            keepalive_expiry=GATEWAY_KEEPALIVE_EXPIRY
+        )
+    )
+
+@app.on_event("shutdown")
+async def close_http_client():
+    await http_client.aclose()
 
 @app.get("/")
 async def root():
     return {"message": "API Gateway Online"}
 
+async def inspect_audio_upload(file: UploadFile) -> str:
+    """
+    Percorre o áudio enviado em blocos, calculando o sha256 e rejeitando
+    arquivos acima do limite, sem carregá-lo inteiro na memória; retorna o hash
+    """
+    digest = hashlib.sha256()
+    size = 0
+    while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+        size += len(chunk)
+        if size > MAX_FILE_SIZE:
+            raise HTTPException(status_code=413, detail=too_large_detail())
+        digest.update(chunk)
+    await file.seek(0)
+    logging.debug(f"Arquivo de áudio de tamanho {size}")
+    return digest.hexdigest()
+
+def transcription_key(audio_hash: str) -> str:
+    """Chave da transcrição conhecida: mesmo áudio com outro modelo, idioma ou normalização é outra entrada"""
+    if NORMALIZE_AUDIO:
+        normalization = f"{NORMALIZE_CODEC}:{NORMALIZE_SILENCE_DB}:{NORMALIZE_OPUS_BITRATE}"
+    else:
+        normalization = "original"
+    return cache_key(audio_hash, WHISPER_MODEL, WHISPER_LANGUAGE, normalization)
+
+def remember_transcription(key: str, text: str):
+    if TRANSCRIPTION_CACHE_SIZE <= 0:
+        return
+    known_transcriptions[key] = text
+    known_transcriptions.move_to_end(key)
+    while len(known_transcriptions) > TRANSCRIPTION_CACHE_SIZE:
+        known_transcriptions.popitem(last=False)
+
+async def prepare_whisper_upload(file: UploadFile) -> Tuple[tuple, Optional[dict]]:
+    """Arquivo a enviar ao Whisper e estatísticas da normalização (None se desativada)"""
+    if NORMALIZE_AUDIO:
+        content = await file.read()
+        suffix = os.path.splitext(file.filename or "")[1].lower()
+        try:
+            with stage_timer("normalize"):
+                normalized, new_suffix, content_type, stats = await run_in_threadpool(
+                    normalize_audio, content, suffix, NORMALIZE_CODEC, NORMALIZE_SILENCE_DB, NORMALIZE_OPUS_BITRATE
+                )
+            logging.info(f"Áudio normalizado: {stats}")
+            return (normalized_filename(file.filename, new_suffix), normalized, content_type), stats
+        except AudioNormalizationError as e:
+            # Sem normalização o Whisper ainda consegue transcrever o original
+            logging.warning(f"Falha ao normalizar {file.filename}, enviando o original: {e}")
+            return (file.filename, content, file.content_type), {"error": str(e)}
+
+    # O arquivo é repassado em blocos direto do upload, sem cópia em memória
+    return (file.filename, file.file, file.content_type), None
+
+async def transcribe(file: UploadFile, audio_hash: str) -> dict:
+    """
+    Retorna o texto transcrito, se veio do cache e as estatísticas da
+    normalização; só chama o Whisper para áudio desconhecido
+    """
+    key = transcription_key(audio_hash)
+    if key in known_transcriptions:
+        known_transcriptions.move_to_end(key)
+        logging.info(f"Transcrição já conhecida para {file.filename}; Whisper não chamado")
+        return {"text": known_transcriptions[key], "cached": True, "normalization": None}
+
+    upload, normalization = await prepare_whisper_upload(file)
+    files = {"file": upload}
+    with stage_timer("whisper"):
+        whisper_response = await http_client.post(
+            f"{WHISPER_SERVICE_URL}/transcribe",
+            files=files,
+            headers=request_id_headers()
+        )
+    add_downstream_timings("whisper", whisper_response.headers.get("Server-Timing"))
+    logging.info(f"Whisper responded {whisper_response.status_code}: {whisper_response.text[:200]}")
+    
+    if whisper_response.status_code != 200:
+        logging.error(f"Erro na transcrição: {whisper_response.status_code} - {whisper_response.text}")
+        # Repassa o Retry-After quando o Whisper recusa por estar sobrecarregado
+        retry_after = whisper_response.headers.get("Retry-After")
+        raise HTTPException(
+            status_code=whisper_response.status_code,
+            detail=f"Erro na transcrição: {whisper_response.text}",
+            headers={"Retry-After": retry_after} if retry_after else None
+        )
+    
+    transcription_data = whisper_response.json()
+    text = transcription_data.get("text", "")
+    remember_transcription(key, text)
+    return {"text": text, "cached": bool(transcription_data.get("cached")), "normalization": normalization}
+
+async def query_rag(question: str) -> dict:
+    """Envia a pergunta transcrita ao RAG e retorna a resposta"""
+    with stage_timer("rag"):
+        rag_response = await http_client.post(
+            f"{RAG_SERVICE_URL}/query",
+            json={"question": question},
+            headers=request_id_headers()
+        )
+    add_downstream_timings("rag", rag_response.headers.get("Server-Timing"))
+    logging.info(f"RAG responded {rag_response.status_code}: {rag_response.text[:200]}")
+
+    if rag_response.status_code != 200:
+        logging.error(f"Erro no RAG: {rag_response.status_code} - {rag_response.text}")
+        retry_after = rag_response.headers.get("Retry-After")
+        raise HTTPException(
+            status_code=rag_response.status_code,
+            detail=f"Erro no RAG: {rag_response.text}",
+            headers={"Retry-After": retry_after} if retry_after else None
+        )
+
+    return rag_response.json()
+
 @app.post("/process-audio")
 async def process_audio(file: UploadFile = File(...)):
     """
@@ -30,57 +266,24 @@ async def process_audio(file: UploadFile = File(...)):
     """
     try:
         # 1. Enviar áudio para o serviço Whisper
-        audio_content = await file.read()
+        # O corpo já chegou inteiro (spool do Starlette): a etapa mede só o hash
+        with stage_timer("upload_hash"):
+            audio_hash = await inspect_audio_upload(file)
+
+        # Transcrição
+        transcription = await transcribe(file, audio_hash)
+        transcribed_text = transcription["text"]
         
-        MAX_FILE_SIZE = 25 * 1024 * 1024
-        print(f"Arquivo de áudio de tamanho {len(audio_content)}")
-
-        if len(audio_content) > MAX_FILE_SIZE:
-           raise HTTPException(
-               status_code=413,
-               detail=f"Arquivo muito grande. Máximo: {MAX_FILE_SIZE / (1024*1024)}MB"
-           )
-
-        async with httpx.AsyncClient(timeout=300.0) as client:
-            # Transcrição
-            files = {"file": (file.filename, audio_content, file.content_type)}
-            whisper_response = await client.post(
-                f"{WHISPER_SERVICE_URL}/transcribe",
-                files=files
-            )
-            logging.info(f"Whisper responded {whisper_response.status_code}: {whisper_response.text[:200]}")
-            
-            if whisper_response.status_code != 200:
-                logging.error(f"Erro na transcrição: {whisper_response.status_code} - {whisper_response.text}")
-                raise HTTPException(
-                    status_code=whisper_response.status_code,
-                    detail=f"Erro na transcrição: {whisper_response.text}"
-                )
-            
-            transcription_data = whisper_response.json()
-            transcribed_text = transcription_data.get("text", "")
-            
-            # 2. Enviar texto transcrito para o serviço RAG
-            rag_response = await client.post(
-                f"{RAG_SERVICE_URL}/query",
-                json={"question": transcribed_text}
-            )
-            logging.info(f"RAG responded {rag_response.status_code}: {rag_response.text[:200]}")
-            
-            if rag_response.status_code != 200:
-                logging.error(f"Erro no RAG: {rag_response.status_code} - {rag_response.text}")
-                raise HTTPException(
-                    status_code=rag_response.status_code,
-                    detail=f"Erro no RAG: {rag_response.text}"
-                )
-            
-            rag_data = rag_response.json()
-            
-            return {
-                "transcription": transcribed_text,
-                "answer": rag_data.get("answer", ""),
-                "model": rag_data.get("model", "")
-            }
+        # 2. Enviar texto transcrito para o serviço RAG
+        rag_data = await query_rag(transcribed_text)
+        
+        return {
+            "transcription": transcribed_text,
+            "transcription_cached": transcription["cached"],
+            "audio_normalization": transcription["normalization"],
+            "answer": rag_data.get("answer", ""),
+            "model": rag_data.get("model", "")
+        }
             
     except httpx.RequestError as e:
         logging.exception("Erro de rede ao chamar serviços externos")
@@ -92,6 +295,176 @@ async def process_audio(file: UploadFile = File(...)):
         logging.exception("Erro interno no gateway")
         raise HTTPException(status_code=500, detail=f"Erro interno: {str(e)}")
 
+# Limite global de itens em lote no Whisper/RAG; criado no primeiro uso, dentro do event loop
+batch_slots: Optional[asyncio.Semaphore] = None
+
+def retry_delay(error: HTTPException, attempt: int) -> Optional[float]:
+    """Espera antes de repetir um item recusado por sobrecarga; None se não deve repetir"""
+    if error.status_code not in (429, 503) or attempt > BATCH_RETRIES:
+        return None
+    retry_after = (error.headers or {}).get("Retry-After", "")
+    delay = float(retry_after) if retry_after.isdigit() else 2.0 ** attempt
+    return min(delay, BATCH_MAX_RETRY_AFTER)
+
+async def process_batch_item(index: int, file: UploadFile) -> dict:
+    """Transcreve e consulta o RAG para um arquivo do lote; erros viram o status do item"""
+    global batch_slots
+    if batch_slots is None:
+        batch_slots = asyncio.Semaphore(BATCH_MAX_IN_FLIGHT)
+
+    result = {"index": index, "filename": file.filename}
+    started = time.perf_counter()
+    attempt = 0
+    with collect_stages() as timings:
+        while True:
+            attempt += 1
+            try:
+                with stage_timer("batch_wait"):
+                    await batch_slots.acquire()
+                try:
+                    with stage_timer("upload_hash"):
+                        audio_hash = await inspect_audio_upload(file)
+                    transcription = await transcribe(file, audio_hash)
+                    rag_data = await query_rag(transcription["text"])
+                finally:
+                    batch_slots.release()
+                result.update({
+                    "status": "ok",
+                    "status_code": 200,
+                    "transcription": transcription["text"],
+                    "transcription_cached": transcription["cached"],
+                    "audio_normalization": transcription["normalization"],
+                    "answer": rag_data.get("answer", ""),
+                    "model": rag_data.get("model", "")
+                })
+                break
+            except HTTPException as e:
+                delay = retry_delay(e, attempt)
+                if delay is None:
+                    result.update({"status": "error", "status_code": e.status_code, "error": e.detail})
+                    break
+                # Backend sobrecarregado: espera fora do limite global e tenta de novo
+                logging.warning(f"{file.filename}: {e.status_code} do backend, nova tentativa em {delay:.1f}s")
+                await asyncio.sleep(delay)
+                await file.seek(0)
+            except httpx.RequestError as e:
+                logging.exception(f"Erro de rede ao processar {file.filename}")
+                result.update({"status": "error", "status_code": 503, "error": f"Erro ao conectar aos serviços: {str(e)}"})
+                break
+            except Exception as e:
+                logging.exception(f"Erro interno ao processar {file.filename}")
+                result.update({"status": "error", "status_code": 500, "error": f"Erro interno: {str(e)}"})
+                break
+
+    timings_ms: Dict[str, float] = {}
+    for stage, ms in timings:
+        timings_ms[stage] = round(timings_ms.get(stage, 0.0) + ms, 1)
+    timings_ms["total"] = round((time.perf_counter() - started) * 1000, 1)
+    result["attempts"] = attempt
+    result["timings_ms"] = timings_ms
+    return result
+
+@app.post(BATCH_PATH)
+async def process_audio_batch(files: List[UploadFile] = File(...), concurrency: Optional[int] = None):
+    """
+    Processa vários áudios (Whisper + RAG) com concorrência limitada e devolve
+    os resultados em NDJSON, uma linha por arquivo na ordem em que terminam,
+    seguida de uma linha de resumo
+    """
+    if len(files) > BATCH_MAX_FILES:
+        raise HTTPException(status_code=413, detail=f"Lote com {len(files)} arquivos. Máximo: {BATCH_MAX_FILES}")
+    workers = min(max(1, concurrency or BATCH_CONCURRENCY), BATCH_CONCURRENCY, len(files))
+    logging.info(f"Lote com {len(files)} arquivos, {workers} em paralelo")
+
+    async def lines():
+        started = time.perf_counter()
+        pending = iter(enumerate(files))
+        results: asyncio.Queue = asyncio.Queue()
+
+        async def worker():
+            # Cada worker pega o próximo arquivo só depois de terminar o anterior
+            for index, file in pending:
+                await results.put(await process_batch_item(index, file))
+
+        tasks = [asyncio.create_task(worker()) for _ in range(workers)]
+        ok = 0
+        try:
+            for _ in range(len(files)):
+                result = await results.get()
+                ok += result["status"] == "ok"
+                yield json.dumps({"type": "item", **result}, ensure_ascii=False) + "\n"
+        finally:
+            observe_batch("audio", len(files), time.perf_counter() - started)
+            # Cliente desconectado: os itens ainda não iniciados são abandonados
+            for task in tasks:
+                task.cancel()
+
+        yield json.dumps({
+            "type": "summary",
+            "files": len(files),
+            "ok": ok,
+            "errors": len(files) - ok,
+            "concurrency": workers,
+            "duration_ms": round((time.perf_counter() - started) * 1000, 1)
+        }) + "\n"
+
+    return StreamingResponse(
+        lines(),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.post("/process-audio/stream")
+async def process_audio_stream(file: UploadFile = File(...)):
+    """
+    Versão em streaming (SSE) do /process-audio: envia a transcrição assim que
+    fica pronta e repassa os eventos sources, token e done do serviço RAG
+    """
+    with stage_timer("upload_hash"):
+        audio_hash = await inspect_audio_upload(file)
+
+    async def events():
+        try:
+            transcription = await transcribe(file, audio_hash)
+            transcribed_text = transcription["text"]
+            yield sse_event("transcription", transcription)
+
+            # Os cabeçalhos já foram enviados: a etapa só entra no histograma
+            with stage_timer("rag"):
+                async with http_client.stream(
+                    "POST",
+                    f"{RAG_SERVICE_URL}/query/stream",
+                    json={"question": transcribed_text},
+                    headers=request_id_headers()
+                ) as rag_response:
+                    if rag_response.status_code != 200:
+                        body = (await rag_response.aread()).decode(errors="replace")
+                        logging.error(f"Erro no RAG: {rag_response.status_code} - {body}")
+                        yield sse_event("error", {"status_code": rag_response.status_code, "detail": f"Erro no RAG: {body}"})
+                        return
+
+                    # Os eventos do RAG já estão no formato SSE; são repassados sem reprocessamento
+                    async for chunk in rag_response.aiter_raw():
+                        yield chunk
+
+        except HTTPException as e:
+            yield sse_event("error", {"status_code": e.status_code, "detail": e.detail})
+        except httpx.RequestError as e:
+            logging.exception("Erro de rede ao chamar serviços externos")
+            yield sse_event("error", {"status_code": 503, "detail": f"Erro ao conectar aos serviços: {str(e)}"})
+        except Exception as e:
+            logging.exception("Erro interno no gateway")
+            yield sse_event("error", {"status_code": 500, "detail": f"Erro interno: {str(e)}"})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    uvicorn.run(app, host="0.0.0.0", port=8000)
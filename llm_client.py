@@ -0,0 +1,212 @@
+"""
+Cliente assíncrono da LLM com prazo por requisição, hedging e fallback.
+
+Cada chamada tem um prazo (`deadline`, em segundos). A requisição ao modelo
+principal sai na hora; se não responder em `hedge_delay` segundos, uma
+segunda requisição idêntica é disparada (hedging) e vale a primeira que
+responder. Ao passar de `fallback_after` (fração do prazo), ou se as
+tentativas ao modelo principal falharem, o modelo menor (`fallback_model`)
+entra na disputa. Esgotado o prazo, as tentativas pendentes são canceladas e
+a chamada levanta `LLMDeadlineExceeded`.
+
+No streaming a disputa vai até o primeiro token: a tentativa que o entregar
+primeiro segue gerando e as demais são encerradas.
+"""
+import asyncio
+import logging
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class LLMDeadlineExceeded(Exception):
+    """Nenhuma tentativa respondeu dentro do prazo"""
+
+
+class LLMResult:
+    """Resposta vencedora e o registro de todas as tentativas da chamada"""
+
+    def __init__(self, value: Any, attempt: dict, attempts: List[dict], elapsed: float):
+        self.value = value
+        self.model = attempt["model"]
+        self.kind = attempt["kind"]
+        self.upstream_ms = attempt["latency_ms"]
+        self.latency_ms = round(elapsed * 1000, 1)
+        self.attempts = attempts
+
+    def report(self) -> dict:
+        return {
+            "model": self.model,
+            "kind": self.kind,
+            "latency_ms": self.latency_ms,
+            "upstream_ms": self.upstream_ms,
+            "attempts": self.attempts
+        }
+
+
+class LLMClient:
+    """Chamadas de chat ao cliente AsyncGroq (ou compatível) com prazo, hedging e fallback"""
+
+    def __init__(self, client, model: str, fallback_model: Optional[str] = None, deadline: float = 30.0,
+                 hedge_delay: float = 0.0, fallback_after: float = 0.5,
+                 on_attempt: Optional[Callable[[dict], None]] = None, **params):
+        self.client = client
+        self.model = model
+        # Sem modelo menor (ou igual ao principal) não há fallback
+        self.fallback_model = fallback_model if fallback_model and fallback_model != model else None
+        self.deadline = deadline
+        self.hedge_delay = max(0.0, hedge_delay)
+        self.fallback_after = min(max(0.0, fallback_after), 1.0)
+        # Chamado com o registro de cada tentativa encerrada (métricas)
+        self.on_attempt = on_attempt
+        self.params = params
+        self.calls = 0
+        self.deadline_exceeded = 0
+        self.failed = 0
+        self.winners: Counter = Counter()
+        self.outcomes: Counter = Counter()
+
+    async def complete(self, messages: List[dict], deadline: Optional[float] = None) -> LLMResult:
+        """Resposta completa; `value` é o ChatCompletion da tentativa vencedora"""
+        async def call(model: str, timeout: float):
+            return await self.client.chat.completions.create(
+                messages=messages, model=model, timeout=timeout, **self.params
+            )
+
+        return await self.race(call, deadline)
+
+    async def stream(self, messages: List[dict], deadline: Optional[float] = None) -> LLMResult:
+        """Streaming; `value` é um iterador assíncrono dos chunks, a partir do primeiro"""
+        async def call(model: str, timeout: float):
+            stream = await self.client.chat.completions.create(
+                messages=messages, model=model, stream=True, timeout=timeout, **self.params
+            )
+            received = []
+            try:
+                async for chunk in stream:
+                    received.append(chunk)
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        break
+            except BaseException:
+                await stream.close()
+                raise
+            return stream, received
+
+        async def discard(value):
+            await value[0].close()
+
+        result = await self.race(call, deadline, discard)
+        stream, received = result.value
+
+        async def chunks():
+            # Fecha a conexão mesmo se o consumidor parar no meio (ex.: cliente do SSE desconectou)
+            try:
+                for chunk in received:
+                    yield chunk
+                async for chunk in stream:
+                    yield chunk
+            finally:
+                await stream.close()
+
+        result.value = chunks()
+        return result
+
+    async def race(self, call: Callable[[str, float], Awaitable[Any]], deadline: Optional[float] = None,
+                   discard: Optional[Callable[[Any], Awaitable[None]]] = None) -> LLMResult:
+        """Executa `call(modelo, timeout)` segundo a política de hedging e fallback"""
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        ends = started + (deadline if deadline is not None else self.deadline)
+        hedge_at = started + self.hedge_delay if self.hedge_delay else None
+        fallback_at = started + (ends - started) * self.fallback_after if self.fallback_model else None
+        attempts: Dict[asyncio.Task, dict] = {}
+        last_error: Optional[BaseException] = None
+        self.calls += 1
+
+        def launch(kind: str, model: str):
+            now = loop.time()
+            attempt = {"model": model, "kind": kind, "started_ms": round((now - started) * 1000, 1),
+                       "latency_ms": None, "outcome": "pending"}
+            attempts[asyncio.create_task(call(model, ends - now))] = attempt
+
+        def finish(task: asyncio.Task, outcome: str, error: Optional[BaseException] = None):
+            attempt = attempts[task]
+            attempt["latency_ms"] = round((loop.time() - started) * 1000 - attempt["started_ms"], 1)
+            attempt["outcome"] = outcome
+            if error is not None:
+                attempt["error"] = f"{type(error).__name__}: {error}"
+            self.outcomes[(attempt["kind"], outcome)] += 1
+            if self.on_attempt:
+                self.on_attempt(attempt)
+
+        launch("primary", self.model)
+        winner: Optional[asyncio.Task] = None
+        try:
+            while True:
+                pending = [task for task in attempts if not task.done()]
+                wake = min(t for t in (hedge_at, fallback_at, ends) if t is not None)
+                if pending:
+                    done, _ = await asyncio.wait(pending, timeout=max(0.0, wake - loop.time()),
+                                                 return_when=asyncio.FIRST_COMPLETED)
+                else:
+                    done = set()
+
+                for task in done:
+                    error = task.exception()
+                    if error is None:
+                        winner = task
+                        break
+                    last_error = error
+                    finish(task, "error", error)
+                    logger.warning(f"Tentativa {attempts[task]['kind']} ({attempts[task]['model']}) falhou: {error}")
+                if winner is not None:
+                    finish(winner, "won")
+                    self.winners[attempts[winner]["kind"]] += 1
+                    return LLMResult(winner.result(), attempts[winner], list(attempts.values()),
+                                     loop.time() - started)
+
+                now = loop.time()
+                if now >= ends:
+                    self.deadline_exceeded += 1
+                    raise LLMDeadlineExceeded(f"LLM sem resposta em {ends - started:.1f}s")
+
+                idle = all(task.done() for task in attempts)
+                if fallback_at is not None and (now >= fallback_at or idle):
+                    # Prazo em risco ou modelo principal falhando: entra o modelo menor
+                    launch("fallback", self.fallback_model)
+                    fallback_at = None
+                elif hedge_at is not None and (now >= hedge_at or idle):
+                    launch("hedge", self.model)
+                    hedge_at = None
+                elif idle:
+                    self.failed += 1
+                    raise last_error
+        finally:
+            for task, attempt in attempts.items():
+                if task is winner or attempt["outcome"] != "pending":
+                    continue
+                if not task.done():
+                    task.cancel()
+                    finish(task, "cancelled")
+                elif task.exception() is not None:
+                    finish(task, "error", task.exception())
+                else:
+                    # Terminou junto com a vencedora: descartada
+                    if discard is not None:
+                        await discard(task.result())
+                    finish(task, "cancelled")
+
+    def stats(self) -> dict:
+        return {
+            "model": self.model,
+            "fallback_model": self.fallback_model,
+            "deadline_s": self.deadline,
+            "hedge_delay_s": self.hedge_delay,
+            "fallback_after": self.fallback_after,
+            "calls": self.calls,
+            "deadline_exceeded": self.deadline_exceeded,
+            "failed": self.failed,
+            "winners": dict(self.winners),
+            "attempts": {f"{kind}_{outcome}": count for (kind, outcome), count in sorted(self.outcomes.items())}
+        }
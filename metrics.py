@@ -0,0 +1,204 @@
+"""
+Instrumentação compartilhada pelos três serviços: histogramas Prometheus por
+etapa (exportados em /metrics), cabeçalho Server-Timing e X-Request-ID.
+
+Cada requisição ganha um id (o recebido em X-Request-ID ou um novo) e uma
+lista de etapas; `stage_timer` mede uma etapa, registra no histograma e a
+inclui no Server-Timing da resposta. Em respostas em streaming o cabeçalho
+sai antes do fim, então só traz as etapas concluídas até ali.
+"""
+import contextvars
+import time
+import uuid
+from contextlib import contextmanager
+from typing import List, Optional, Tuple
+
+from fastapi import FastAPI, Response
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Histogram, generate_latest
+from starlette.routing import Match
+
+REQUEST_ID_HEADER = "X-Request-ID"
+
+# De 5 ms a 2 min: cobre desde consultas ao cache até transcrições longas
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+STAGE_SECONDS = Histogram(
+    "audio_rag_stage_duration_seconds",
+    "Duração de cada etapa do processamento",
+    ["service", "stage"],
+    buckets=LATENCY_BUCKETS
+)
+REQUEST_SECONDS = Histogram(
+    "audio_rag_http_request_duration_seconds",
+    "Duração das requisições HTTP",
+    ["service", "method", "route", "status"],
+    buckets=LATENCY_BUCKETS
+)
+LLM_TOKENS = Histogram(
+    "audio_rag_llm_tokens_per_request",
+    "Tokens por chamada à LLM",
+    ["service", "kind"],
+    buckets=TOKEN_BUCKETS
+)
+BATCH_SIZE = Histogram(
+    "audio_rag_batch_size",
+    "Itens por lote processado",
+    ["service", "batch"],
+    buckets=BATCH_BUCKETS
+)
+LLM_TOKENS_TOTAL = Counter(
+    "audio_rag_llm_tokens_total",
+    "Total de tokens consumidos na LLM",
+    ["service", "kind"]
+)
+LLM_ATTEMPTS = Counter(
+    "audio_rag_llm_attempts_total",
+    "Tentativas de chamada à LLM (principal, hedge ou fallback) por resultado",
+    ["service", "model", "kind", "outcome"]
+)
+
+_service = "unknown"
+_request_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("request_id", default=None)
+_timings: contextvars.ContextVar[Optional[List[Tuple[str, float]]]] = contextvars.ContextVar("timings", default=None)
+
+
+def current_request_id() -> Optional[str]:
+    return _request_id.get()
+
+
+def request_id_headers() -> dict:
+    """Cabeçalhos para propagar o id da requisição atual aos outros serviços"""
+    request_id = _request_id.get()
+    return {REQUEST_ID_HEADER: request_id} if request_id else {}
+
+
+def observe_stage(stage: str, seconds: float):
+    STAGE_SECONDS.labels(_service, stage).observe(seconds)
+    timings = _timings.get()
+    if timings is not None:
+        timings.append((stage, seconds * 1000))
+
+
+@contextmanager
+def stage_timer(stage: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - started)
+
+
+def observe_tokens(prompt_tokens: Optional[int], completion_tokens: Optional[int]):
+    for kind, count in (("prompt", prompt_tokens), ("completion", completion_tokens)):
+        if count is not None:
+            LLM_TOKENS.labels(_service, kind).observe(count)
+            LLM_TOKENS_TOTAL.labels(_service, kind).inc(count)
+
+
+def observe_saved_tokens(count: int):
+    """Tokens de prompt economizados na montagem do contexto (estimativa)"""
+    LLM_TOKENS_TOTAL.labels(_service, "prompt_saved").inc(count)
+
+
+def observe_llm_attempt(attempt: dict):
+    """Registra uma tentativa encerrada do cliente da LLM (llm_client.py)"""
+    LLM_ATTEMPTS.labels(_service, attempt["model"], attempt["kind"], attempt["outcome"]).inc()
+
+
+def observe_batch(batch: str, size: int, seconds: float):
+    """Registra o tamanho e a duração de um lote (ex.: embeddings de perguntas agrupados)"""
+    BATCH_SIZE.labels(_service, batch).observe(size)
+    STAGE_SECONDS.labels(_service, f"{batch}_batch").observe(seconds)
+
+
+@contextmanager
+def collect_stages():
+    """Mede as etapas do bloco em uma lista própria (ex.: por item de um lote), fora do Server-Timing"""
+    timings: List[Tuple[str, float]] = []
+    token = _timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _timings.reset(token)
+
+
+def add_downstream_timings(prefix: str, header: Optional[str]):
+    """Inclui no Server-Timing da resposta as etapas informadas por outro serviço"""
+    timings = _timings.get()
+    if timings is None or not header:
+        return
+    for entry in header.split(","):
+        name, _, params = entry.strip().partition(";")
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "dur" and name:
+                try:
+                    timings.append((f"{prefix}.{name}", float(value)))
+                except ValueError:
+                    pass
+
+
+def format_server_timing(timings: List[Tuple[str, float]]) -> str:
+    return ", ".join(f"{name};dur={ms:.1f}" for name, ms in timings)
+
+
+class MetricsMiddleware:
+    """Define o id e a lista de etapas da requisição e escreve os cabeçalhos da resposta"""
+
+    def __init__(self, app):
+        self.app = app
+
+    def route_of(self, scope) -> str:
+        # Usa o caminho declarado (/jobs/{job_id}) para não criar uma série por id
+        for route in scope["app"].routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return route.path
+        return "unmatched"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        request_id = headers.get(REQUEST_ID_HEADER.lower().encode(), b"").decode() or uuid.uuid4().hex
+        timings: List[Tuple[str, float]] = []
+        request_token = _request_id.set(request_id)
+        timings_token = _timings.set(timings)
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_headers(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                total = ("total", (time.perf_counter() - started) * 1000)
+                extra = [
+                    (REQUEST_ID_HEADER.lower().encode(), request_id.encode()),
+                    (b"server-timing", format_server_timing(timings + [total]).encode())
+                ]
+                message = {**message, "headers": list(message.get("headers", [])) + extra}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_headers)
+        finally:
+            REQUEST_SECONDS.labels(_service, scope["method"], self.route_of(scope), str(status)).observe(
+                time.perf_counter() - started
+            )
+            _request_id.reset(request_token)
+            _timings.reset(timings_token)
+
+
+def install_metrics(app: FastAPI, service: str):
+    """Adiciona o middleware de métricas e o endpoint /metrics ao serviço"""
+    global _service
+    _service = service
+    app.add_middleware(MetricsMiddleware)
+
+    @app.get("/metrics", include_in_schema=False)
+    async def metrics():
+        return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,98 @@
+"""
+Micro-batching dinâmico para chamadas concorrentes ao modelo de embeddings.
+
+Cada requisição enfileira seu item e aguarda um future. Um único worker no
+event loop junta os itens que chegarem em até `max_wait_ms` (ou até
+`max_batch_size`) e processa o lote inteiro em uma chamada, numa thread.
+Enquanto um lote roda, os próximos itens se acumulam na fila e formam o lote
+seguinte sem esperar, então sob carga os lotes crescem sozinhos.
+"""
+import asyncio
+import logging
+import time
+from collections import Counter
+from typing import Any, Callable, List, Optional, Sequence, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    """Agrupa itens submetidos concorrentemente em chamadas de `batch_fn(itens) -> resultados`"""
+
+    def __init__(self, batch_fn: Callable[[List[Any]], Sequence[Any]], max_batch_size: int = 32,
+                 max_wait_ms: float = 5.0, on_batch: Optional[Callable[[int, float], None]] = None):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait_ms = max(0.0, max_wait_ms)
+        # Chamado com (tamanho do lote, segundos de processamento) após cada lote
+        self.on_batch = on_batch
+        self.batches = 0
+        self.items = 0
+        self.batch_sizes: Counter = Counter()
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+
+    async def submit(self, item: Any) -> Any:
+        if self._worker is None or self._worker.done():
+            # Criados no primeiro uso, já dentro do event loop do servidor
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, future))
+        return await future
+
+    async def _collect(self) -> List[Tuple[Any, asyncio.Future]]:
+        batch = [await self._queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_wait_ms / 1000
+        while len(batch) < self.max_batch_size:
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            # Quem desistiu (requisição cancelada) não entra no lote
+            batch = [(item, future) for item, future in batch if not future.done()]
+            if not batch:
+                continue
+            started = time.perf_counter()
+            try:
+                results = await run_in_threadpool(self.batch_fn, [item for item, _ in batch])
+            except Exception as e:
+                logger.exception(f"Falha ao processar lote de {len(batch)} itens")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            self.batches += 1
+            self.items += len(batch)
+            self.batch_sizes[len(batch)] += 1
+            if self.on_batch:
+                self.on_batch(len(batch), time.perf_counter() - started)
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+    def stats(self) -> dict:
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait_ms,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "batches": self.batches,
+            "items": self.items,
+            "mean_batch_size": round(self.items / self.batches, 2) if self.batches else 0.0,
+            "batch_sizes": {str(size): count for size, count in sorted(self.batch_sizes.items())}
+        }
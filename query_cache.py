@@ -0,0 +1,144 @@
+"""Caches do caminho de consulta do rag_service.
+
+- TTLCache: LRU exato (pergunta normalizada -> embedding) com limite de
+  tamanho e expiração por tempo.
+- SemanticAnswerCache: devolve uma resposta já gerada quando uma nova
+  pergunta tem embedding a uma distância de cosseno pequena de uma pergunta
+  em cache. Deve ser invalidado sempre que a base de conhecimento muda.
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional, Tuple
+
+import numpy as np
+
+
+def normalize_question(question: str) -> str:
+    """Chave canônica de uma pergunta: minúsculas e espaços colapsados"""
+    return " ".join(question.lower().split())
+
+
+class TTLCache:
+    """Cache LRU com limite de itens e expiração por tempo, seguro entre threads"""
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._items: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None and time.monotonic() - item[0] <= self.ttl:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return item[1]
+            if item is not None:
+                del self._items[key]
+            self.misses += 1
+            return None
+
+    def set(self, key: Hashable, value: Any):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._items[key] = (time.monotonic(), value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._items),
+                "max_size": self.max_size,
+                "ttl_s": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses
+            }
+
+
+class SemanticAnswerCache:
+    """Cache de respostas indexado pela similaridade entre embeddings de perguntas"""
+
+    def __init__(self, max_size: int, ttl: float, max_distance: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.max_distance = max_distance
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._entries: "OrderedDict[int, dict]" = OrderedDict()
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def lookup(self, embedding: np.ndarray, params: Hashable) -> Optional[Tuple[dict, float]]:
+        """Retorna (resposta, distância) da pergunta em cache mais próxima, se dentro do limite"""
+        if self.max_size <= 0:
+            return None
+
+        query = _unit(embedding)
+        now = time.monotonic()
+        with self._lock:
+            for entry_id in [i for i, e in self._entries.items() if now - e["created_at"] > self.ttl]:
+                del self._entries[entry_id]
+
+            candidates = [(i, e) for i, e in self._entries.items() if e["params"] == params]
+            if candidates:
+                matrix = np.stack([e["embedding"] for _, e in candidates])
+                distances = 1.0 - matrix @ query
+                best = int(np.argmin(distances))
+                if distances[best] <= self.max_distance:
+                    entry_id, entry = candidates[best]
+                    self._entries.move_to_end(entry_id)
+                    self.hits += 1
+                    return entry["response"], float(distances[best])
+
+            self.misses += 1
+            return None
+
+    def store(self, embedding: np.ndarray, params: Hashable, response: dict):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[self._next_id] = {
+                "embedding": _unit(embedding),
+                "params": params,
+                "response": response,
+                "created_at": time.monotonic()
+            }
+            self._next_id += 1
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl_s": self.ttl,
+                "max_distance": self.max_distance,
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations
+            }
+
+
+def _unit(vector) -> np.ndarray:
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
@@ -1,18 +1,38 @@
 from fastapi import FastAPI, HTTPException, UploadFile, File
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from groq import Groq
-import chromadb
-from chromadb.config import Settings
-from sentence_transformers import SentenceTransformer
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+from groq import AsyncGroq
+import asyncio
+import json
 import logging
-from typing import List, Optional
+from typing import Callable, Dict, List, Optional
+from collections import OrderedDict
+from contextlib import aclosing
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
 import os
 from dotenv import load_dotenv
 import PyPDF2
-import io
-import re
+import queue
+import threading
+import time
 import uuid
+import numpy as np
+
+from document_processing import clean_text, chunk_text_with_overlap, content_chunk_id, extract_pdf_text
+from bulk_ingest import IngestManifest, bytes_sha256, run_bulk_ingest
+from query_cache import SemanticAnswerCache, TTLCache, normalize_question
+from metrics import (
+    install_metrics, observe_batch, observe_llm_attempt, observe_saved_tokens, observe_stage, observe_tokens, stage_timer
+)
+from micro_batching import MicroBatcher
+from embedding_engines import load_embedding_engine
+from context_assembly import assemble_context
+from llm_client import LLMClient, LLMDeadlineExceeded
+from embedding_index import MmapEmbeddingIndex, export_collection
+from vector_stores import VectorStore, chroma_results, open_vector_store
 
 logging.basicConfig(level=logging.INFO)
 
@@ -24,8 +44,11 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing", "X-Request-ID"],
 )
 
+install_metrics(app, "rag")
+
 load_dotenv()
 
 GROQ_API_KEY = os.getenv("GROQ_API_KEY", "")
@@ -34,77 +57,637 @@ if not GROQ_API_KEY:
     logging.error("GROQ_API_KEY não configurada")
     raise ValueError("GROQ_API_KEY não configurada")
 
-client = Groq(api_key=GROQ_API_KEY)
-embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
+# Tamanho dos mini-lotes de embedding e limite de registros por escrita no ChromaDB
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+CHROMA_MAX_BATCH_SIZE = int(os.getenv("CHROMA_MAX_BATCH_SIZE", "5000"))
+
+# Cache de embeddings de perguntas (LRU exato) e cache semântico de respostas
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "1024"))
+QUERY_EMBEDDING_CACHE_TTL = float(os.getenv("QUERY_EMBEDDING_CACHE_TTL", "3600"))
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "256"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "900"))
+ANSWER_CACHE_MAX_DISTANCE = float(os.getenv("ANSWER_CACHE_MAX_DISTANCE", "0.05"))
+
+# Micro-batching dos embeddings de perguntas concorrentes: espera até
+# QUERY_EMBEDDING_BATCH_WAIT_MS por mais perguntas (ou até QUERY_EMBEDDING_BATCH_SIZE)
+# e gera todos os embeddings em uma única chamada ao modelo
+QUERY_EMBEDDING_BATCH_SIZE = int(os.getenv("QUERY_EMBEDDING_BATCH_SIZE", "32"))
+QUERY_EMBEDDING_BATCH_WAIT_MS = float(os.getenv("QUERY_EMBEDDING_BATCH_WAIT_MS", "5"))
+
+# Orçamento do contexto no prompt (context_assembly.py): chunks vizinhos são unidos,
+# repetições removidas e os trechos mais similares entram até o limite de tokens
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1024"))
+CONTEXT_CHARS_PER_TOKEN = float(os.getenv("CONTEXT_CHARS_PER_TOKEN", "4"))
+
+# Parâmetros da geração; GROQ_BASE_URL permite apontar para um servidor compatível
+# local (ex.: benchmarks/fake_llm_server.py) em testes
+LLM_PARAMS = {
+    "model": os.getenv("LLM_MODEL", "llama-3.3-70b-versatile"),
+    "temperature": 0.6,  # Aumentado de 0.4 para 0.6 - mais flexível
+    "max_tokens": 1024,
+    "top_p": 0.9
+}
 
-# Usa PersistentClient para garantir que os dados sejam salvos no disco
-chroma_client = chromadb.PersistentClient(path="./chroma_db")
+# Cliente da LLM (llm_client.py): prazo por requisição (LLM_DEADLINE, em segundos),
+# segunda requisição ao mesmo modelo após LLM_HEDGE_DELAY (0 = desativado) e
+# fallback para LLM_FALLBACK_MODEL ao passar de LLM_FALLBACK_AFTER do prazo ou se
+# o modelo principal falhar (vazio = sem fallback). O `deadline` de uma requisição
+# pode ir até LLM_DEADLINE_MAX
+LLM_DEADLINE = float(os.getenv("LLM_DEADLINE", "30"))
+LLM_DEADLINE_MAX = float(os.getenv("LLM_DEADLINE_MAX", "120"))
+LLM_HEDGE_DELAY = float(os.getenv("LLM_HEDGE_DELAY", "0"))
+LLM_FALLBACK_MODEL = os.getenv("LLM_FALLBACK_MODEL", "llama-3.1-8b-instant")
+LLM_FALLBACK_AFTER = float(os.getenv("LLM_FALLBACK_AFTER", "0.5"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "0"))
 
-try:
-    collection = chroma_client.get_collection("knowledge_base")
-    logging.info(f"Coleção existente carregada com {collection.count()} documentos")
-except:
-    collection = chroma_client.create_collection(
-        name="knowledge_base",
-        metadata={"description": "Base de conhecimento RAG"}
+# Motor de embeddings (embedding_engines.py): sentence-transformers, torch-int8, onnx
+# ou onnx-int8. EMBEDDING_MODEL aceita um nome do Hugging Face ou um diretório local;
+# os motores ONNX não importam o PyTorch e precisam do modelo exportado no diretório
+EMBEDDING_ENGINE = os.getenv("EMBEDDING_ENGINE", "sentence-transformers")
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+EMBEDDING_ONNX_FILE = os.getenv("EMBEDDING_ONNX_FILE") or None
+EMBEDDING_THREADS = int(os.getenv("EMBEDDING_THREADS", "0"))  # 0 = padrão da biblioteca
+
+CHROMA_PATH = os.getenv("CHROMA_PATH", "./chroma_db")
+
+# Base vetorial (vector_stores.py): chroma, numpy (busca exata em memória) ou ivf
+# (aproximada, com IVF_NPROBE listas visitadas por consulta)
+VECTOR_STORE = os.getenv("VECTOR_STORE", "chroma")
+VECTOR_STORE_PATH = os.getenv(
+    "VECTOR_STORE_PATH", CHROMA_PATH if VECTOR_STORE == "chroma" else os.path.join(CHROMA_PATH, f"{VECTOR_STORE}_store")
+)
+IVF_NLIST = int(os.getenv("IVF_NLIST", "0"))  # 0 = ~4·√n listas
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", "8"))
+IVF_MIN_TRAIN_ROWS = int(os.getenv("IVF_MIN_TRAIN_ROWS", "10000"))
+
+vector_store_options = {"max_batch_size": CHROMA_MAX_BATCH_SIZE}
+if VECTOR_STORE == "ivf":
+    vector_store_options.update(nlist=IVF_NLIST, nprobe=IVF_NPROBE, min_train_rows=IVF_MIN_TRAIN_ROWS)
+
+# Cliente da LLM, motor de embeddings e base vetorial são criados por load_resources
+# na inicialização do app, não na importação: os processos de extração ("spawn")
+# reimportam este módulo quando ele é executado com `python rag_service.py`
+client: Optional[AsyncGroq] = None
+llm: Optional[LLMClient] = None
+embedding_model = None
+vector_store: Optional[VectorStore] = None
+
+@app.on_event("startup")
+def load_resources():
+    """Cria o cliente da LLM, o motor de embeddings e a base vetorial (uma vez por processo)"""
+    global client, llm, embedding_model, vector_store
+    if embedding_model is not None:
+        return
+    # As novas tentativas do SDK ficam desligadas por padrão: hedging e fallback já
+    # cobrem falhas sem estourar o prazo
+    client = AsyncGroq(api_key=GROQ_API_KEY, base_url=os.getenv("GROQ_BASE_URL") or None, max_retries=LLM_MAX_RETRIES)
+    llm = LLMClient(
+        client,
+        model=LLM_PARAMS["model"],
+        fallback_model=LLM_FALLBACK_MODEL,
+        deadline=LLM_DEADLINE,
+        hedge_delay=LLM_HEDGE_DELAY,
+        fallback_after=LLM_FALLBACK_AFTER,
+        on_attempt=observe_llm_attempt,
+        **{key: value for key, value in LLM_PARAMS.items() if key != "model"}
     )
-    logging.info("Nova coleção criada")
+    embedding_model = load_embedding_engine(EMBEDDING_ENGINE, EMBEDDING_MODEL, EMBEDDING_THREADS, EMBEDDING_ONNX_FILE)
+    if RAG_ROLE == "reader":
+        # Leitores não abrem a base vetorial: consultas, /stats e /sources vêm do índice mmap
+        return
+    vector_store = open_vector_store(VECTOR_STORE, VECTOR_STORE_PATH, **vector_store_options)
+    logging.info(f"Base inicializada com {vector_store.count()} documentos")
+
+question_embedding_cache = TTLCache(QUERY_EMBEDDING_CACHE_SIZE, QUERY_EMBEDDING_CACHE_TTL)
+answer_cache = SemanticAnswerCache(ANSWER_CACHE_SIZE, ANSWER_CACHE_TTL, ANSWER_CACHE_MAX_DISTANCE)
+# Incrementada a cada alteração da coleção; respostas geradas sobre uma versão antiga não entram no cache
+collection_version = 0
+
+# Índice somente leitura mapeado em memória (VECTOR_INDEX=mmap): as consultas não
+# passam pela base vetorial e vários workers do uvicorn compartilham os embeddings pelo
+# cache de páginas do sistema. É reconstruído em segundo plano após cada ingestão.
+VECTOR_INDEX = os.getenv("VECTOR_INDEX", "store")
+MMAP_INDEX_DIR = os.getenv("MMAP_INDEX_DIR", os.path.join(CHROMA_PATH, "mmap_index"))
+MMAP_INDEX_DTYPE = os.getenv("MMAP_INDEX_DTYPE", "float32")
+MMAP_INDEX_REBUILD_DELAY = float(os.getenv("MMAP_INDEX_REBUILD_DELAY", "2"))
+
+# Papel do processo: "writer" (padrão) ingere, exporta e poda o índice mmap; "reader"
+# só responde consultas a partir do índice publicado pelo escritor. Só um processo
+# pode ser o escritor; vários workers (uvicorn --workers N) devem ser leitores.
+RAG_ROLE = os.getenv("RAG_ROLE", "writer").lower()
+if RAG_ROLE not in ("writer", "reader"):
+    raise ValueError(f"RAG_ROLE inválido: {RAG_ROLE} (use writer ou reader)")
+if RAG_ROLE == "reader" and VECTOR_INDEX != "mmap":
+    raise ValueError("RAG_ROLE=reader requer VECTOR_INDEX=mmap")
+
+mmap_index = MmapEmbeddingIndex(MMAP_INDEX_DIR) if VECTOR_INDEX == "mmap" else None
+index_rebuild_requested = threading.Event()
+index_build_lock = threading.Lock()
+# Versão cuja carga falhou (registrada uma vez no log)
+index_refresh_failed: Optional[str] = None
+
+def invalidate_answers():
+    global collection_version
+    collection_version += 1
+    answer_cache.clear()
+
+def require_writer():
+    """Recusa alterações da base em processos leitores (RAG_ROLE=reader)"""
+    if RAG_ROLE != "writer":
+        raise HTTPException(
+            status_code=409,
+            detail="Este processo só responde consultas (RAG_ROLE=reader); envie a ingestão ao processo escritor."
+        )
+
+def on_collection_changed():
+    """Persiste a base vetorial e invalida o que depende do seu conteúdo"""
+    vector_store.persist()
+    invalidate_answers()
+    if mmap_index is not None:
+        index_rebuild_requested.set()
+
+def rebuild_index() -> dict:
+    """Exporta a coleção para uma nova versão do índice mmap e passa a usá-la"""
+    with index_build_lock:
+        export_collection(vector_store, MMAP_INDEX_DIR, MMAP_INDEX_DTYPE, vector_store.max_batch_size)
+        if mmap_index.refresh():
+            invalidate_answers()
+    return mmap_index.status()
+
+def _index_rebuilder():
+    while True:
+        index_rebuild_requested.wait()
+        # Agrupa alterações próximas (vários jobs seguidos) em uma única reconstrução
+        time.sleep(MMAP_INDEX_REBUILD_DELAY)
+        index_rebuild_requested.clear()
+        try:
+            rebuild_index()
+        except Exception:
+            logging.exception("Falha ao reconstruir o índice mmap")
+
+def refresh_index():
+    """Remapeia se o escritor publicou uma versão nova; uma falha mantém a versão atual"""
+    global index_refresh_failed
+    try:
+        if mmap_index.refresh():
+            invalidate_answers()
+        index_refresh_failed = None
+    except Exception as e:
+        # Ex.: versão podada entre a leitura de CURRENT e o mapeamento; tenta de novo na próxima consulta
+        version = mmap_index.current_version()
+        if version != index_refresh_failed:
+            logging.warning(f"Falha ao carregar o índice mmap {version}; mantendo "
+                            f"{mmap_index.version or 'a base vetorial'}: {e}")
+        index_refresh_failed = version
+
+def active_index() -> Optional[MmapEmbeddingIndex]:
+    """Índice mmap pronto para consultas, ou None para usar a base vetorial (ou base vazia, no leitor)"""
+    if mmap_index is None:
+        return None
+    refresh_index()
+    return mmap_index if mmap_index.ready else None
 
+def search_collection(embedding: np.ndarray, n_results: int) -> dict:
+    """Busca vetorial no índice mmap, se ativo e pronto, ou na base vetorial"""
+    index = active_index()
+    if index is not None:
+        return index.query(embedding, n_results)
+    if vector_store is None:
+        # Leitor antes da primeira versão publicada
+        return chroma_results([], [], [], [])
+    return vector_store.query(embedding, n_results)
+
+def knowledge_base_size() -> int:
+    index = active_index()
+    if index is not None:
+        return index.snapshot.meta["rows"]
+    return vector_store.count() if vector_store is not None else 0
+
+def encode_questions(questions: List[str]) -> np.ndarray:
+    return embedding_model.encode(questions, batch_size=len(questions))
+
+question_batcher = MicroBatcher(
+    encode_questions,
+    max_batch_size=QUERY_EMBEDDING_BATCH_SIZE,
+    max_wait_ms=QUERY_EMBEDDING_BATCH_WAIT_MS,
+    on_batch=lambda size, seconds: observe_batch("question_embedding", size, seconds)
+)
+
+async def get_question_embedding(question: str) -> np.ndarray:
+    """Embedding da pergunta, reaproveitando o cache LRU para perguntas repetidas"""
+    key = normalize_question(question)
+    embedding = question_embedding_cache.get(key)
+    if embedding is None:
+        embedding = await question_batcher.submit(question)
+        question_embedding_cache.set(key, embedding)
+    return embedding
 
 class QueryRequest(BaseModel):
     question: str
     top_k: Optional[int] = 5
     similarity_threshold: Optional[float] = 0.1
+    # Prazo da chamada à LLM, em segundos (padrão: LLM_DEADLINE)
+    deadline: Optional[float] = Field(None, gt=0, le=LLM_DEADLINE_MAX)
 
 class DocumentRequest(BaseModel):
     text: str
     metadata: Optional[dict] = {}
 
-def clean_text(text: str) -> str:
-    """Limpa e normaliza texto extraído de PDF - versão mais permissiva"""
-    text = re.sub(r'[\x00-\x08\x0b-\x0c\x0e-\x1f\x7f-\x9f]', '', text)
-    text = re.sub(r'\n{3,}', '\n\n', text)
-    text = re.sub(r'[ \t]+', ' ', text)
+def embed_texts(texts: List[str], batch_size: int = EMBEDDING_BATCH_SIZE,
+                on_batch: Optional[Callable[[int], None]] = None) -> np.ndarray:
+    """Gera embeddings em mini-lotes, retornando uma matriz float32 (n, dim)"""
+    if not texts:
+        return np.empty((0, embedding_model.dimension), dtype=np.float32)
 
-    lines = [line.strip() for line in text.split('\n')]
-    text = '\n'.join(lines)
-    return text.strip()
+    batches = []
+    for start in range(0, len(texts), batch_size):
+        batch = embedding_model.encode(texts[start:start + batch_size], batch_size=batch_size)
+        batches.append(batch)
+        if on_batch:
+            on_batch(len(batch))
+    return np.vstack(batches).astype(np.float32, copy=False)
 
-def chunk_text_with_overlap(text: str, chunk_size: int = 800, overlap: int = 150) -> List[str]:
-    """Divide texto em chunks menores e mais focados"""
-    chunks = []
-    start = 0
-    
-    while start < len(text):
-        end = start + chunk_size
-        
-        if end < len(text):
-            last_period = text[start:end].rfind('.')
-            if last_period > chunk_size * 0.5:  
-                end = start + last_period + 1
-        
-        chunk = text[start:end].strip()
-        if chunk:
-            chunks.append(chunk)
-        
-        start = end - overlap if end < len(text) else end
-    
-    return chunks
+def add_chunks_bulk(ids: List[str], documents: List[str], embeddings: np.ndarray, metadatas: List[dict],
+                    on_batch: Optional[Callable[[int], None]] = None):
+    """Insere chunks na base vetorial em lote, respeitando o limite de lote do backend"""
+    max_batch = vector_store.max_batch_size
+    for start in range(0, len(ids), max_batch):
+        end = start + max_batch
+        vector_store.upsert(ids[start:end], documents[start:end], embeddings[start:end], metadatas[start:end])
+        if on_batch:
+            on_batch(len(ids[start:end]))
+
+def find_existing_ids(ids: List[str]) -> set:
+    """Retorna quais dos ids já estão gravados na base vetorial"""
+    existing = set()
+    max_batch = vector_store.max_batch_size
+    for start in range(0, len(ids), max_batch):
+        existing.update(vector_store.existing_ids(ids[start:start + max_batch]))
+    return existing
+
+def delete_chunks(ids: List[str]):
+    """Remove chunks da base vetorial em lotes"""
+    max_batch = vector_store.max_batch_size
+    for start in range(0, len(ids), max_batch):
+        vector_store.delete(ids[start:start + max_batch])
+
+def store_chunks(documents: List[str], metadatas: List[dict],
+                 on_embedded: Optional[Callable[[int], None]] = None,
+                 on_written: Optional[Callable[[int], None]] = None,
+                 replace_source: Optional[str] = None) -> dict:
+    """Grava chunks com ids endereçados por conteúdo, gerando embeddings apenas para os novos.
+
+    Chunks já existentes têm só os metadados atualizados (posição na nova
+    edição do documento), sem passar pelo modelo de embeddings. Com
+    `replace_source`, os chunks dessa fonte que não estão na nova edição são
+    removidos na mesma operação de escrita.
+    """
+    t0 = time.perf_counter()
+    ids = [content_chunk_id(doc, (meta or {}).get("source")) for doc, meta in zip(documents, metadatas)]
+
+    # Trechos repetidos dentro do próprio documento são gravados uma única vez
+    unique = {}
+    for chunk_id, doc, meta in zip(ids, documents, metadatas):
+        unique.setdefault(chunk_id, (doc, meta))
+    unique_ids = list(unique)
+
+    existing = find_existing_ids(unique_ids)
+    new_ids = [chunk_id for chunk_id in unique_ids if chunk_id not in existing]
+    existing_ids = [chunk_id for chunk_id in unique_ids if chunk_id in existing]
+
+    to_update = [chunk_id for chunk_id in existing_ids if unique[chunk_id][1]]
+
+    t1 = time.perf_counter()
+    new_docs = [unique[chunk_id][0] for chunk_id in new_ids]
+    embeddings = embed_texts(new_docs, on_batch=on_embedded)
+
+    t2 = time.perf_counter()
+    stale = []
+    # Buscas veem a edição anterior ou a nova inteira, nunca a fonte pela metade
+    with vector_store.atomic():
+        max_batch = vector_store.max_batch_size
+        for start in range(0, len(to_update), max_batch):
+            batch = to_update[start:start + max_batch]
+            vector_store.update_metadata(batch, [unique[chunk_id][1] for chunk_id in batch])
+        add_chunks_bulk(new_ids, new_docs, embeddings, [unique[chunk_id][1] for chunk_id in new_ids], on_batch=on_written)
+        if replace_source is not None:
+            stale = [chunk_id for chunk_id in vector_store.source_ids(replace_source) if chunk_id not in unique]
+            delete_chunks(stale)
+    if new_ids or to_update or stale:
+        on_collection_changed()
+    t3 = time.perf_counter()
+
+    return {
+        "ids": ids,
+        "new": len(new_ids),
+        "existing": len(existing_ids),
+        "removed": len(stale),
+        "duplicates": len(ids) - len(unique_ids),
+        "timings_ms": {
+            "lookup": round((t1 - t0) * 1000, 1),
+            "embedding": round((t2 - t1) * 1000, 1),
+            "insert": round((t3 - t2) * 1000, 1)
+        }
+    }
+
+# ==================== JOBS DE INGESTÃO ====================
+# A ingestão (parsing, embeddings e escrita no ChromaDB) roda em threads de
+# background alimentadas por uma fila limitada, para não bloquear o event loop.
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "1"))
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "16"))
+JOB_HISTORY_LIMIT = int(os.getenv("JOB_HISTORY_LIMIT", "200"))
+
+# Ingestão em lote: processos de extração de texto e manifesto dos arquivos já gravados
+BULK_INGEST_PROCESSES = int(os.getenv("BULK_INGEST_PROCESSES", str(os.cpu_count() or 1)))
+BULK_MANIFEST_PATH = os.getenv("BULK_MANIFEST_PATH", os.path.join(CHROMA_PATH, "ingest_manifest.json"))
+BULK_MAX_FILES = int(os.getenv("BULK_MAX_FILES", "200"))
+
+class IngestionJob(BaseModel):
+    job_id: str
+    kind: str
+    source: Optional[str] = None
+    status: str = "queued"
+    created_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    total_files: int = 0
+    files_processed: int = 0
+    total_pages: int = 0
+    pages_parsed: int = 0
+    total_chunks: int = 0
+    chunks_embedded: int = 0
+    chunks_written: int = 0
+    chunks_existing: int = 0
+    chunks_removed: int = 0
+    result: Optional[dict] = None
+    error: Optional[str] = None
+
+ingest_queue: "queue.Queue" = queue.Queue(maxsize=INGEST_QUEUE_SIZE)
+jobs: "OrderedDict[str, IngestionJob]" = OrderedDict()
+jobs_lock = threading.Lock()
+ingest_threads: List[threading.Thread] = []
+bulk_lock = threading.Lock()
+# Substituições e remoções de uma fonte não se intercalam
+sources_lock = threading.Lock()
+extraction_pool: Optional[ProcessPoolExecutor] = None
+
+def _prune_jobs():
+    """Descarta os jobs finalizados mais antigos além do limite de histórico"""
+    excess = len(jobs) - JOB_HISTORY_LIMIT
+    for job_id in list(jobs.keys()):
+        if excess <= 0:
+            break
+        if jobs[job_id].status in ("completed", "failed"):
+            del jobs[job_id]
+            excess -= 1
+
+def submit_job(kind: str, source: Optional[str], func: Callable, *args) -> IngestionJob:
+    """Registra um job e o enfileira; levanta HTTPException 503 se a fila estiver cheia"""
+    # A fonte pode vir dos metadados do cliente com outro tipo (ex.: um número)
+    job = IngestionJob(job_id=str(uuid.uuid4()), kind=kind, source=None if source is None else str(source),
+                       created_at=time.time())
+    with jobs_lock:
+        try:
+            ingest_queue.put_nowait((job, func, args))
+        except queue.Full:
+            raise HTTPException(
+                status_code=503,
+                detail="Fila de ingestão cheia. Tente novamente em instantes.",
+                headers={"Retry-After": "10"}
+            )
+        jobs[job.job_id] = job
+        _prune_jobs()
+    return job
+
+def _ingest_worker():
+    while True:
+        item = ingest_queue.get()
+        if item is None:
+            ingest_queue.task_done()
+            break
+
+        job, func, args = item
+        job.status = "running"
+        job.started_at = time.time()
+        try:
+            job.result = func(job, *args)
+            job.status = "completed"
+        except PyPDF2.errors.PdfReadError:
+            logging.exception(f"Erro ao ler PDF no job {job.job_id}")
+            job.error = "Arquivo PDF corrompido ou inválido"
+            job.status = "failed"
+        except Exception as e:
+            logging.exception(f"Erro no job de ingestão {job.job_id}")
+            job.error = str(e)
+            job.status = "failed"
+        finally:
+            job.finished_at = time.time()
+            ingest_queue.task_done()
+
+@app.on_event("startup")
+def start_ingest_workers():
+    if RAG_ROLE == "reader":
+        # Leitor: sem fila de ingestão nem reconstrução do índice, só o mapeamento
+        refresh_index()
+        logging.info(f"Processo leitor: índice mmap {mmap_index.version or 'ainda não publicado'}")
+        return
+
+    for i in range(max(1, INGEST_WORKERS)):
+        thread = threading.Thread(target=_ingest_worker, name=f"ingest-worker-{i}", daemon=True)
+        thread.start()
+        ingest_threads.append(thread)
+    logging.info(f"{len(ingest_threads)} worker(s) de ingestão iniciados (fila: {INGEST_QUEUE_SIZE})")
+
+    if mmap_index is not None:
+        threading.Thread(target=_index_rebuilder, name="index-rebuilder", daemon=True).start()
+        refresh_index()
+        if not mmap_index.ready and vector_store.count() > 0:
+            index_rebuild_requested.set()
+
+@app.on_event("shutdown")
+def stop_ingest_workers():
+    for _ in ingest_threads:
+        try:
+            ingest_queue.put_nowait(None)
+        except queue.Full:
+            break
+    if extraction_pool is not None:
+        extraction_pool.shutdown(wait=False, cancel_futures=True)
+
+def get_extraction_pool() -> ProcessPoolExecutor:
+    """Pool de processos para extração de PDFs, criado no primeiro uso"""
+    global extraction_pool
+    if extraction_pool is None:
+        # "spawn": um fork levaria junto o modelo, o cliente da base e as threads do serviço
+        extraction_pool = ProcessPoolExecutor(max_workers=max(1, BULK_INGEST_PROCESSES), mp_context=get_context("spawn"))
+    return extraction_pool
+
+def ingest_pdf(job: IngestionJob, contents: bytes, filename: str, replace: bool = False) -> dict:
+    """Extrai texto de um PDF, gera embeddings e grava os chunks, atualizando o progresso do job.
+
+    Com `replace`, o PDF é a nova edição da fonte `filename`: só os chunks
+    alterados passam pelo modelo e os que saíram do documento são removidos.
+    """
+    started = time.perf_counter()
+
+    def on_page(parsed: int, total: int):
+        job.total_pages = total
+        job.pages_parsed = parsed
+
+    total_pages, extracted_text = extract_pdf_text(contents, on_page=on_page)
+
+    if not extracted_text:
+        raise ValueError("Não foi possível extrair texto do PDF")
+
+    full_text = "\n\n".join(extracted_text)
+
+    # Chunks menores para melhor precisão
+    t1 = time.perf_counter()
+    chunks = chunk_text_with_overlap(full_text, chunk_size=800, overlap=150)
+    job.total_chunks = len(chunks)
+
+    t2 = time.perf_counter()
+    metadatas = [
+        {
+            "source": filename,
+            "chunk_index": idx,
+            "total_chunks": len(chunks),
+            "total_pages": total_pages,
+            "chunk_length": len(chunk)
+        }
+        for idx, chunk in enumerate(chunks)
+    ]
+
+    def on_embedded(n: int):
+        job.chunks_embedded += n
+
+    def on_written(n: int):
+        job.chunks_written += n
+
+    # Só os chunks ainda inexistentes passam pelo modelo de embeddings
+    if replace:
+        with sources_lock:
+            stored = store_chunks(chunks, metadatas, on_embedded=on_embedded, on_written=on_written,
+                                  replace_source=filename)
+        # O manifesto da ingestão em lote passa a registrar a nova edição, não a antiga
+        with bulk_lock:
+            manifest = IngestManifest(BULK_MANIFEST_PATH)
+            manifest.forget_source(filename)
+            manifest.mark(bytes_sha256(contents), source=filename, status="done",
+                          chunks=len(chunks), total_pages=total_pages)
+            manifest.save()
+    else:
+        stored = store_chunks(chunks, metadatas, on_embedded=on_embedded, on_written=on_written)
+    job.chunks_existing = stored["existing"] + stored["duplicates"]
+    job.chunks_removed = stored["removed"]
+    t3 = time.perf_counter()
+
+    timings = {
+        "parse": round((t1 - started) * 1000, 1),
+        "chunking": round((t2 - t1) * 1000, 1),
+        **stored["timings_ms"],
+        "total": round((t3 - started) * 1000, 1)
+    }
+
+    logging.info(
+        f"PDF processado: {filename} - {stored['new']} chunks novos, "
+        f"{stored['existing']} já existentes, {stored['removed']} removidos em {timings['total']}ms"
+    )
+
+    return {
+        "status": "success",
+        "filename": filename,
+        "total_pages": total_pages,
+        "chunks_added": stored["new"],
+        "chunks_existing": stored["existing"],
+        "chunks_removed": stored["removed"],
+        "document_ids": stored["ids"],
+        "timings_ms": timings,
+        "message": f"PDF processado com sucesso! {stored['new']} fragmentos adicionados, {stored['existing']} já estavam na base."
+    }
+
+def ingest_document(job: IngestionJob, text: str, metadata: dict) -> dict:
+    """Gera o embedding de um documento de texto e o grava na base, se ainda não existir"""
+    cleaned_text = clean_text(text)
+    job.total_chunks = 1
+
+    def on_embedded(n: int):
+        job.chunks_embedded += n
+
+    def on_written(n: int):
+        job.chunks_written += n
+
+    stored = store_chunks([cleaned_text], [metadata or None], on_embedded=on_embedded, on_written=on_written)
+    job.chunks_existing = stored["existing"]
+    doc_id = stored["ids"][0]
+
+    logging.info(f"Documento {'adicionado' if stored['new'] else 'já existente'}: {doc_id}")
+    return {
+        "status": "success",
+        "document_id": doc_id,
+        "already_existed": bool(stored["existing"]),
+        "message": "Documento adicionado à base de conhecimento" if stored["new"] else "Documento já estava na base de conhecimento"
+    }
+
+def store_bulk_chunks(documents: List[str], metadatas: List[dict], replace_source: Optional[str] = None) -> dict:
+    """store_chunks da ingestão em lote; a substituição de uma fonte segue a mesma trava do PUT /sources"""
+    if replace_source is None:
+        return store_chunks(documents, metadatas)
+    with sources_lock:
+        return store_chunks(documents, metadatas, replace_source=replace_source)
+
+def ingest_bulk(job: IngestionJob, files: List[tuple]) -> dict:
+    """Ingere vários PDFs: extração no pool de processos, embeddings e escrita em lote"""
+    job.total_files = len(files)
+
+    def on_progress(stats: dict):
+        job.files_processed = stats["files_done"] + stats["files_skipped"] + stats["files_failed"]
+        # Páginas e chunks só são conhecidos após a extração de cada arquivo
+        job.total_pages = stats["pages_parsed"]
+        job.pages_parsed = stats["pages_parsed"]
+        job.total_chunks = stats["chunks_total"]
+        job.chunks_embedded = stats["chunks_embedded"]
+        job.chunks_written = stats["chunks_written"]
+        job.chunks_existing = stats["chunks_existing"]
+        job.chunks_removed = stats["chunks_removed"]
+
+    started = time.perf_counter()
+    # Jobs em lote compartilham o manifesto, então rodam um de cada vez
+    with bulk_lock:
+        stats = run_bulk_ingest(
+            ((filename, bytes_sha256(contents), contents) for filename, contents in files),
+            store_fn=store_bulk_chunks,
+            manifest=IngestManifest(BULK_MANIFEST_PATH),
+            pool=get_extraction_pool(),
+            max_in_flight=max(1, BULK_INGEST_PROCESSES) * 2,
+            on_progress=on_progress,
+            stored_sources=vector_store.source_sizes()
+        )
+    elapsed = time.perf_counter() - started
+
+    logging.info(f"Lote processado: {stats['files_done']} PDFs, {stats['chunks_written']} chunks em {elapsed:.1f}s")
+    return {
+        "status": "success" if not stats["files_failed"] else "partial",
+        **stats,
+        "timings_ms": {"total": round(elapsed * 1000, 1)},
+        "message": f"{stats['files_done']} PDFs processados, {stats['files_skipped']} já estavam na base."
+    }
 
 @app.get("/")
 async def root():
-    doc_count = collection.count()
+    doc_count = knowledge_base_size()
     return {
         "message": "RAG Service with Embeddings Online",
         "provider": "Groq",
-        "vector_db": "ChromaDB",
-        "embedding_model": "all-MiniLM-L6-v2",
+        "vector_db": vector_store.label if vector_store is not None else "Índice mmap (leitor)",
+        "embedding_model": embedding_model.model_name,
         "documents_count": doc_count
     }
 
-@app.post("/upload-pdf")
+@app.post("/upload-pdf", status_code=202)
 async def upload_pdf(file: UploadFile = File(...)):
-    """Extrai texto de um PDF e adiciona à base de conhecimento"""
+    """Recebe um PDF e enfileira sua ingestão, retornando o id do job"""
+    require_writer()
     try:
         if not file.filename.endswith('.pdf'):
             raise HTTPException(status_code=400, detail="Apenas arquivos PDF são aceitos")
@@ -115,175 +698,262 @@ async def upload_pdf(file: UploadFile = File(...)):
         if(size/(1024*1024) > 25):
             raise HTTPException(status_code=400, detail="Arquivo PDF muito grande. O tamanho máximo permitido é 25MB")
 
-        pdf_reader = PyPDF2.PdfReader(io.BytesIO(contents))
+        job = submit_job("pdf", file.filename, ingest_pdf, contents, file.filename)
+        logging.info(f"PDF enfileirado: {file.filename} (job {job.job_id})")
 
-        total_pages = len(pdf_reader.pages)
-        
-        extracted_text = []
-        for page in pdf_reader.pages:
-            text = page.extract_text()
-            if text.strip():
-                cleaned = clean_text(text)
-                if cleaned:
-                    extracted_text.append(cleaned)
-        
-        if not extracted_text:
-            raise HTTPException(status_code=400, detail="Não foi possível extrair texto do PDF")
-        
-        full_text = "\n\n".join(extracted_text)
-        
-        # Chunks menores para melhor precisão
-        chunks = chunk_text_with_overlap(full_text, chunk_size=800, overlap=150)
-        
-        added_chunks = []
-        for idx, chunk in enumerate(chunks):
-            embedding = embedding_model.encode(chunk).tolist()
-            doc_id = str(uuid.uuid4())
-            
-            metadata = {
-                "source": file.filename,
-                "chunk_index": idx,
-                "total_chunks": len(chunks),
-                "total_pages": total_pages,
-                "chunk_length": len(chunk)
-            }
-            
-            collection.add(
-                embeddings=[embedding],
-                documents=[chunk],
-                metadatas=[metadata],
-                ids=[doc_id]
-            )
-            added_chunks.append(doc_id)
-        
-        logging.info(f"PDF processado: {file.filename} - {len(chunks)} chunks adicionados")
-        
         return {
-            "status": "success",
+            "status": "queued",
+            "job_id": job.job_id,
             "filename": file.filename,
-            "total_pages": total_pages,
-            "chunks_added": len(chunks),
-            "document_ids": added_chunks,
-            "message": f"PDF processado com sucesso! {len(chunks)} fragmentos adicionados."
+            "message": "PDF recebido. Acompanhe o processamento em /jobs/{job_id}."
         }
-        
-    except PyPDF2.errors.PdfReadError:
-        logging.exception("Erro ao ler PDF")
-        raise HTTPException(status_code=400, detail="Arquivo PDF corrompido ou inválido")
+
+    except HTTPException:
+        raise
     except Exception as e:
-        logging.exception("Erro ao processar PDF")
+        logging.exception("Erro ao receber PDF")
         raise HTTPException(status_code=500, detail=f"Erro ao processar PDF: {str(e)}")
 
-@app.post("/add-document")
+@app.post("/upload-pdfs", status_code=202)
+async def upload_pdfs(files: List[UploadFile] = File(...)):
+    """Recebe vários PDFs e enfileira um único job de ingestão em lote"""
+    require_writer()
+    try:
+        if len(files) > BULK_MAX_FILES:
+            raise HTTPException(status_code=400, detail=f"Envie no máximo {BULK_MAX_FILES} arquivos por lote")
+
+        received = []
+        for file in files:
+            if not file.filename.endswith('.pdf'):
+                raise HTTPException(status_code=400, detail=f"Apenas arquivos PDF são aceitos: {file.filename}")
+
+            contents = await file.read()
+            if len(contents)/(1024*1024) > 25:
+                raise HTTPException(status_code=400, detail=f"Arquivo PDF muito grande (máximo 25MB): {file.filename}")
+            received.append((file.filename, contents))
+
+        job = submit_job("bulk", f"{len(received)} arquivos", ingest_bulk, received)
+        logging.info(f"Lote de {len(received)} PDFs enfileirado (job {job.job_id})")
+
+        return {
+            "status": "queued",
+            "job_id": job.job_id,
+            "files": [filename for filename, _ in received],
+            "message": "PDFs recebidos. Acompanhe o processamento em /jobs/{job_id}."
+        }
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.exception("Erro ao receber lote de PDFs")
+        raise HTTPException(status_code=500, detail=f"Erro ao processar PDFs: {str(e)}")
+
+@app.post("/add-document", status_code=202)
 async def add_document(doc: DocumentRequest):
-    """Adiciona um documento à base de conhecimento"""
+    """Enfileira a adição de um documento à base de conhecimento"""
+    require_writer()
     try:
-        cleaned_text = clean_text(doc.text)
-        embedding = embedding_model.encode(cleaned_text).tolist()
-        doc_id = str(uuid.uuid4())
-        
-        collection.add(
-            embeddings=[embedding],
-            documents=[cleaned_text],
-            metadatas=[doc.metadata],
-            ids=[doc_id]
-        )
-        
-        logging.info(f"Documento adicionado: {doc_id}")
+        source = doc.metadata.get("source") if doc.metadata else None
+        doc_id = content_chunk_id(clean_text(doc.text), source)
+        job = submit_job("document", source, ingest_document, doc.text, doc.metadata)
+
         return {
-            "status": "success",
+            "status": "queued",
+            "job_id": job.job_id,
             "document_id": doc_id,
-            "message": "Documento adicionado à base de conhecimento"
+            "message": "Documento recebido. Acompanhe o processamento em /jobs/{job_id}."
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         logging.exception("Erro ao adicionar documento")
         raise HTTPException(status_code=500, detail=f"Erro ao adicionar documento: {str(e)}")
 
+@app.get("/jobs")
+async def list_jobs(status: Optional[str] = None, limit: int = 50):
+    """Lista os jobs de ingestão mais recentes"""
+    with jobs_lock:
+        selected = [job.model_dump(exclude={"result"}) for job in reversed(jobs.values())
+                    if status is None or job.status == status][:limit]
+    return {
+        "queue_size": ingest_queue.qsize(),
+        "queue_capacity": INGEST_QUEUE_SIZE,
+        "workers": len(ingest_threads),
+        "jobs": selected
+    }
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Retorna o status e o progresso de um job de ingestão"""
+    with jobs_lock:
+        job = jobs.get(job_id)
+        data = job.model_dump() if job is not None else None
+    if data is None:
+        raise HTTPException(status_code=404, detail="Job não encontrado")
+    return data
+
+# ==================== COALESCÊNCIA DE CONSULTAS ====================
+# Perguntas idênticas (normalizadas, com os mesmos parâmetros) em andamento ao
+# mesmo tempo compartilham uma única busca e uma única chamada à LLM.
+class InflightQuery:
+    """Resposta em andamento e quantas requisições a aguardam"""
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+inflight_queries: Dict[tuple, InflightQuery] = {}
+coalescing_stats = {"leaders": 0, "coalesced": 0}
+
+def forget_inflight(key: tuple, inflight: InflightQuery):
+    if inflight_queries.get(key) is inflight:
+        del inflight_queries[key]
+
+def finish_inflight(key: tuple, inflight: InflightQuery):
+    forget_inflight(key, inflight)
+    # Marca a exceção como consumida caso ninguém mais aguarde a resposta
+    if not inflight.task.cancelled():
+        inflight.task.exception()
+
 @app.post("/query")
 async def query_rag(request: QueryRequest):
     """Processa uma pergunta usando RAG com busca vetorial"""
+    # O prazo entra na chave: quem pede 2 s não pode herdar uma chamada de 30 s
+    key = (normalize_question(request.question), request.top_k, request.similarity_threshold, request.deadline)
+
+    inflight = inflight_queries.get(key)
+    coalesced = inflight is not None
+    if coalesced:
+        coalescing_stats["coalesced"] += 1
+    else:
+        # A resposta roda em uma task própria: se a primeira requisição for
+        # cancelada, as demais continuam aguardando o mesmo resultado
+        inflight = InflightQuery(asyncio.create_task(answer_question(request)))
+        inflight.task.add_done_callback(lambda task: finish_inflight(key, inflight))
+        inflight_queries[key] = inflight
+        coalescing_stats["leaders"] += 1
+
+    inflight.waiters += 1
     try:
-        if collection.count() == 0:
-            return {
-                "question": request.question,
-                "answer": "A base de conhecimento está vazia. Por favor, adicione documentos antes de fazer perguntas.",
-                "sources": [],
-                "model": "N/A"
+        response = await asyncio.shield(inflight.task)
+    finally:
+        inflight.waiters -= 1
+        if inflight.waiters == 0 and not inflight.task.done():
+            # Todos desistiram: não há para quem responder
+            forget_inflight(key, inflight)
+            inflight.task.cancel()
+
+    if coalesced:
+        return {**response, "question": request.question, "coalesced": True}
+    return response
+
+async def prepare_query(request: QueryRequest) -> dict:
+    """Recupera o contexto e monta o prompt.
+
+    Retorna {"response": ...} quando a resposta sai sem chamar a LLM (base
+    vazia, nada relevante ou cache semântico); caso contrário, as mensagens
+    para a LLM e as fontes usadas.
+    """
+    if knowledge_base_size() == 0:
+        return {"response": {
+            "question": request.question,
+            "answer": "A base de conhecimento está vazia. Por favor, adicione documentos antes de fazer perguntas.",
+            "sources": [],
+            "model": "N/A"
+        }}
+    
+    version = collection_version
+    with stage_timer("embedding"):
+        question_embedding = await get_question_embedding(request.question)
+    cache_params = (request.top_k, request.similarity_threshold)
+
+    cached = answer_cache.lookup(question_embedding, cache_params)
+    if cached is not None:
+        response, distance = cached
+        logging.info(f"Resposta servida do cache semântico (distância {distance:.4f})")
+        return {"response": {
+            **response,
+            "question": request.question,
+            "cache": {
+                "hit": True,
+                "distance": round(distance, 4),
+                "cached_question": response["question"]
             }
-        
-        question_embedding = embedding_model.encode(request.question).tolist()
-        
-        results = collection.query(
-            query_embeddings=[question_embedding],
-            n_results=min(request.top_k * 3, 15)  # Busca até 15 resultados
+        }}
+    
+    with stage_timer("vector_search"):
+        results = await run_in_threadpool(
+            search_collection,
+            question_embedding,
+            min(request.top_k * 3, 15)  # Busca até 15 resultados
         )
+    context_started = time.perf_counter()
+    
+    relevant_docs = results['documents'][0] if results['documents'] else []
+    distances = results['distances'][0] if results['distances'] else []
+    metadatas = results['metadatas'][0] if results['metadatas'] else []
+    
+    if not metadatas:
+        metadatas = [{}] * len(relevant_docs)
+    
+    filtered_docs = []
+    filtered_distances = []
+    filtered_metadata = []
+    
+    for doc, dist, meta in zip(relevant_docs, distances, metadatas):
+        if meta is None:
+            meta = {}
         
-        relevant_docs = results['documents'][0] if results['documents'] else []
-        distances = results['distances'][0] if results['distances'] else []
-        metadatas = results['metadatas'][0] if results['metadatas'] else []
-        
-        if not metadatas:
-            metadatas = [{}] * len(relevant_docs)
-        
-        filtered_docs = []
-        filtered_distances = []
-        filtered_metadata = []
-        
-        for doc, dist, meta in zip(relevant_docs, distances, metadatas):
-            if meta is None:
-                meta = {}
-            
-            similarity = 1 - dist
-            logging.info(f"Similaridade: {similarity:.3f} (threshold: {request.similarity_threshold})")
-            
-            if similarity >= request.similarity_threshold:
-                filtered_docs.append(doc)
-                filtered_distances.append(dist)
-                filtered_metadata.append(meta)
-        
-        filtered_docs = filtered_docs[:request.top_k]
-        filtered_distances = filtered_distances[:request.top_k]
-        filtered_metadata = filtered_metadata[:request.top_k]
-        
-        logging.info(f"Documentos após filtro: {len(filtered_docs)}")
+        similarity = 1 - dist
+        logging.info(f"Similaridade: {similarity:.3f} (threshold: {request.similarity_threshold})")
         
-        if not filtered_docs:
-            if relevant_docs:
-                best_similarity = 1 - distances[0]
-                return {
-                    "question": request.question,
-                    "answer": f"Não encontrei informações com alta confiança para responder sua pergunta. O documento mais próximo tem similaridade de {best_similarity:.2%}. Tente reformular a pergunta ou adicionar mais documentos à base de conhecimento.",
-                    "sources": [],
-                    "model": "N/A",
-                    "debug": {
-                        "best_similarity": round(best_similarity, 3),
-                        "threshold": request.similarity_threshold
-                    }
-                }
-            
-            return {
+        if similarity >= request.similarity_threshold:
+            filtered_docs.append(doc)
+            filtered_distances.append(dist)
+            filtered_metadata.append(meta)
+    
+    filtered_docs = filtered_docs[:request.top_k]
+    filtered_distances = filtered_distances[:request.top_k]
+    filtered_metadata = filtered_metadata[:request.top_k]
+    
+    logging.info(f"Documentos após filtro: {len(filtered_docs)}")
+    
+    if not filtered_docs:
+        if relevant_docs:
+            best_similarity = 1 - distances[0]
+            return {"response": {
                 "question": request.question,
-                "answer": "Desculpe, não encontrei informações relevantes na base de conhecimento para responder sua pergunta.",
+                "answer": f"Não encontrei informações com alta confiança para responder sua pergunta. O documento mais próximo tem similaridade de {best_similarity:.2%}. Tente reformular a pergunta ou adicionar mais documentos à base de conhecimento.",
                 "sources": [],
-                "model": "N/A"
-            }
-        
-        context_parts = []
-        for i, (doc, meta) in enumerate(zip(filtered_docs, filtered_metadata)):
-            if not isinstance(meta, dict):
-                meta = {}
-            
-            source = meta.get('source', 'Documento')
-            chunk_idx = meta.get('chunk_index', i)
-            context_parts.append(f"[Fonte: {source} - Trecho {chunk_idx + 1}]\n{doc}")
-        
-        context = "\n\n---\n\n".join(context_parts)
+                "model": "N/A",
+                "debug": {
+                    "best_similarity": round(best_similarity, 3),
+                    "threshold": request.similarity_threshold
+                }
+            }}
         
-        messages = [
-            {
-                "role": "system",
-                "content": f"""Você é um assistente especializado que responde perguntas com base em documentos fornecidos.
+        return {"response": {
+            "question": request.question,
+            "answer": "Desculpe, não encontrei informações relevantes na base de conhecimento para responder sua pergunta.",
+            "sources": [],
+            "model": "N/A"
+        }}
+    
+    context, context_stats = assemble_context(
+        [
+            {"document": doc, "similarity": 1 - dist, "metadata": meta if isinstance(meta, dict) else {}}
+            for doc, dist, meta in zip(filtered_docs, filtered_distances, filtered_metadata)
+        ],
+        CONTEXT_TOKEN_BUDGET,
+        CONTEXT_CHARS_PER_TOKEN
+    )
+    observe_saved_tokens(context_stats["saved_tokens"])
+    
+    messages = [
+        {
+            "role": "system",
+            "content": f"""Você é um assistente especializado que responde perguntas com base em documentos fornecidos.
 
 CONTEXTO DOS DOCUMENTOS:
 {context}
@@ -296,69 +966,276 @@ INSTRUÇÕES IMPORTANTES:
 - Use linguagem natural e clara
 - Se a informação for incompleta, responda com o que está disponível e indique o que falta
 - IMPORTANTE: Considere sinônimos e termos relacionados ao interpretar a pergunta"""
-            },
+        },
+        {
+            "role": "user",
+            "content": request.question
+        }
+    ]
+
+    observe_stage("context_build", time.perf_counter() - context_started)
+
+    return {
+        "messages": messages,
+        "sources": [
             {
-                "role": "user",
-                "content": request.question
-            }
-        ]
+                "content": doc[:200] + "..." if len(doc) > 200 else doc,
+                "similarity": round(1 - dist, 3),
+                "metadata": meta if isinstance(meta, dict) else {}
+            } 
+            for doc, dist, meta in zip(filtered_docs, filtered_distances, filtered_metadata)
+        ],
+        "context": context_stats,
+        "version": version,
+        "embedding": question_embedding,
+        "cache_params": cache_params
+    }
+
+def remember_answer(prepared: dict, response: dict):
+    """Guarda a resposta no cache semântico, se a coleção não mudou durante a geração"""
+    if prepared["version"] == collection_version:
+        answer_cache.store(prepared["embedding"], prepared["cache_params"], response)
+
+async def answer_question(request: QueryRequest) -> dict:
+    """Busca o contexto e gera a resposta; trabalho bloqueante roda no threadpool"""
+    try:
+        prepared = await prepare_query(request)
+        if "response" in prepared:
+            return prepared["response"]
         
-        chat_completion = client.chat.completions.create(
-            messages=messages,
-            model="llama-3.3-70b-versatile",
-            temperature=0.6,  # Aumentado de 0.4 para 0.6 - mais flexível
-            max_tokens=1024,
-            top_p=0.9
-        )
+        with stage_timer("llm_completion"):
+            result = await llm.complete(prepared["messages"], deadline=request.deadline)
+        chat_completion = result.value
         answer = chat_completion.choices[0].message.content
+        observe_tokens(chat_completion.usage.prompt_tokens, chat_completion.usage.completion_tokens)
         
-        return {
+        response = {
             "question": request.question,
             "answer": answer,
-            "sources": [
-                {
-                    "content": doc[:200] + "..." if len(doc) > 200 else doc,
-                    "similarity": round(1 - dist, 3),
-                    "metadata": meta if isinstance(meta, dict) else {}
-                } 
-                for doc, dist, meta in zip(filtered_docs, filtered_distances, filtered_metadata)
-            ],
-            "model": chat_completion.model,
+            "sources": prepared["sources"],
+            "context": prepared["context"],
+            "model": result.model,
+            "llm": result.report(),
             "usage": {
                 "prompt_tokens": chat_completion.usage.prompt_tokens,
                 "completion_tokens": chat_completion.usage.completion_tokens,
                 "total_tokens": chat_completion.usage.total_tokens
             }
         }
+        # Respostas do modelo menor não vão para o cache: a próxima pergunta parecida
+        # ainda pode ser respondida pelo modelo principal
+        if result.kind != "fallback":
+            remember_answer(prepared, response)
+
+        return {**response, "cache": {"hit": False}}
         
+    except LLMDeadlineExceeded as e:
+        logging.error(f"Prazo da LLM esgotado: {e}")
+        raise HTTPException(status_code=504, detail=f"Erro: {str(e)}")
     except Exception as e:
         logging.exception("Erro no RAG service")
         raise HTTPException(status_code=500, detail=f"Erro: {str(e)}")
 
+def sse_event(event: str, data: dict) -> str:
+    """Formata um evento Server-Sent Events com payload JSON"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def stream_usage(chunk) -> Optional[dict]:
+    """Extrai o uso de tokens do último chunk do streaming (x_groq.usage ou usage)"""
+    x_groq = getattr(chunk, "x_groq", None)
+    usage = x_groq.get("usage") if isinstance(x_groq, dict) else getattr(x_groq, "usage", None)
+    usage = usage or getattr(chunk, "usage", None)
+    if usage is None:
+        return None
+    if not isinstance(usage, dict):
+        usage = {key: getattr(usage, key, None) for key in ("prompt_tokens", "completion_tokens", "total_tokens")}
+    return {key: usage.get(key) for key in ("prompt_tokens", "completion_tokens", "total_tokens")}
+
+@app.post("/query/stream")
+async def query_rag_stream(request: QueryRequest):
+    """Versão em streaming (SSE) do /query: eventos sources, token (deltas) e done"""
+    async def events():
+        try:
+            prepared = await prepare_query(request)
+            if "response" in prepared:
+                response = prepared["response"]
+                yield sse_event("sources", {"sources": response["sources"]})
+                yield sse_event("token", {"delta": response["answer"]})
+                yield sse_event("done", response)
+                return
+
+            yield sse_event("sources", {"sources": prepared["sources"]})
+
+            llm_started = time.perf_counter()
+            result = await llm.stream(prepared["messages"], deadline=request.deadline)
+            observe_stage("llm_first_token", time.perf_counter() - llm_started)
+
+            parts = []
+            usage = None
+            # aclosing: se o cliente desconectar, a conexão com a LLM é fechada na hora
+            async with aclosing(result.value) as chunks:
+                async for chunk in chunks:
+                    usage = stream_usage(chunk) or usage
+                    delta = chunk.choices[0].delta.content if chunk.choices else None
+                    if delta:
+                        parts.append(delta)
+                        yield sse_event("token", {"delta": delta})
+            observe_stage("llm_completion", time.perf_counter() - llm_started)
+            if usage:
+                observe_tokens(usage["prompt_tokens"], usage["completion_tokens"])
+
+            response = {
+                "question": request.question,
+                "answer": "".join(parts),
+                "sources": prepared["sources"],
+                "context": prepared["context"],
+                "model": result.model,
+                "llm": result.report(),
+                "usage": usage
+            }
+            if result.kind != "fallback":
+                remember_answer(prepared, response)
+            yield sse_event("done", {**response, "cache": {"hit": False}})
+
+        except LLMDeadlineExceeded as e:
+            logging.error(f"Prazo da LLM esgotado: {e}")
+            yield sse_event("error", {"status_code": 504, "detail": f"Erro: {str(e)}"})
+        except Exception as e:
+            logging.exception("Erro no streaming do RAG service")
+            yield sse_event("error", {"detail": f"Erro: {str(e)}"})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.delete("/clear-database")
 async def clear_database():
+    require_writer()
+    if not bulk_lock.acquire(blocking=False):
+        raise HTTPException(status_code=409, detail="Há uma ingestão em lote em andamento. Tente novamente ao final.")
     try:
-        global collection
-        chroma_client.delete_collection("knowledge_base")
-        collection = chroma_client.create_collection(
-            name="knowledge_base",
-            metadata={"description": "Base de conhecimento RAG"}
-        )
+        vector_store.clear()
+        # O manifesto da ingestão em lote deixa de valer com a base vazia
+        IngestManifest(BULK_MANIFEST_PATH).clear()
+        on_collection_changed()
         return {"status": "success", "message": "Base de conhecimento limpa"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro: {str(e)}")
+    finally:
+        bulk_lock.release()
+
+def source_list() -> List[dict]:
+    """Fontes da base com chunks e caracteres, das maiores para as menores"""
+    # Com o índice mmap, os números vêm da versão publicada: iguais em todos os processos
+    index = active_index()
+    sizes = index.snapshot.source_sizes() if index is not None else None
+    if sizes is None:
+        sizes = vector_store.source_sizes() if vector_store is not None else {}
+    return sorted(({"source": source, **size} for source, size in sizes.items()),
+                  key=lambda entry: entry["chunks"], reverse=True)
+
+def delete_source(source: str) -> int:
+    """Remove os chunks de uma fonte; retorna quantos foram removidos"""
+    with sources_lock:
+        ids = vector_store.source_ids(source)
+        if ids:
+            delete_chunks(ids)
+            on_collection_changed()
+    return len(ids)
+
+@app.get("/sources")
+async def list_sources():
+    """Lista as fontes da base de conhecimento com o número de chunks de cada uma"""
+    sources = await run_in_threadpool(source_list)
+    return {"total_sources": len(sources), "sources": sources}
+
+@app.delete("/sources/{source:path}")
+async def delete_source_endpoint(source: str):
+    """Remove uma fonte da base sem tocar nas demais"""
+    require_writer()
+    if not bulk_lock.acquire(blocking=False):
+        raise HTTPException(status_code=409, detail="Há uma ingestão em lote em andamento. Tente novamente ao final.")
+    try:
+        removed = await run_in_threadpool(delete_source, source)
+        if not removed:
+            raise HTTPException(status_code=404, detail=f"Fonte não encontrada: {source}")
+        # Permite reenviar o mesmo arquivo pela ingestão em lote
+        manifest = IngestManifest(BULK_MANIFEST_PATH)
+        if manifest.forget_source(source):
+            manifest.save()
+        logging.info(f"Fonte removida: {source} ({removed} chunks)")
+        return {"status": "success", "source": source, "chunks_removed": removed}
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.exception("Erro ao remover fonte")
+        raise HTTPException(status_code=500, detail=f"Erro: {str(e)}")
+    finally:
+        bulk_lock.release()
+
+@app.put("/sources/{source:path}", status_code=202)
+async def replace_source(source: str, file: UploadFile = File(...)):
+    """Substitui uma fonte pela nova edição do PDF; só os chunks alterados geram embeddings"""
+    require_writer()
+    if not file.filename.endswith('.pdf'):
+        raise HTTPException(status_code=400, detail="Apenas arquivos PDF são aceitos")
+
+    contents = await file.read()
+    if len(contents)/(1024*1024) > 25:
+        raise HTTPException(status_code=400, detail="Arquivo PDF muito grande. O tamanho máximo permitido é 25MB")
+
+    job = submit_job("replace", source, ingest_pdf, contents, source, True)
+    logging.info(f"Substituição da fonte {source} enfileirada (job {job.job_id})")
+    return {
+        "status": "queued",
+        "job_id": job.job_id,
+        "source": source,
+        "message": "PDF recebido. Acompanhe a substituição em /jobs/{job_id}."
+    }
+
+@app.post("/index/rebuild")
+async def rebuild_vector_index():
+    """Reconstrói o índice mmap agora, sem esperar a próxima ingestão"""
+    if mmap_index is None:
+        raise HTTPException(status_code=400, detail="Índice mmap desativado (defina VECTOR_INDEX=mmap)")
+    require_writer()
+    try:
+        return await run_in_threadpool(rebuild_index)
+    except Exception as e:
+        logging.exception("Erro ao reconstruir o índice mmap")
+        raise HTTPException(status_code=500, detail=f"Erro: {str(e)}")
 
 @app.get("/stats")
 async def get_stats():
     """Retorna estatísticas da base de conhecimento"""
+    sources = await run_in_threadpool(source_list)
     return {
-        "total_documents": collection.count(),
-        "embedding_dimension": 384,
-        "model": "all-MiniLM-L6-v2"
+        "total_documents": knowledge_base_size(),
+        "sources": {"count": len(sources), "sizes": sources},
+        "embedding_dimension": embedding_model.dimension,
+        "model": embedding_model.model_name,
+        "embedding_engine": embedding_model.status(),
+        "cache": {
+            "question_embeddings": question_embedding_cache.stats(),
+            "answers": answer_cache.stats()
+        },
+        "embedding_batching": question_batcher.stats(),
+        "llm": llm.stats(),
+        "coalescing": {
+            "in_flight": len(inflight_queries),
+            **coalescing_stats
+        },
+        "vector_store": vector_store.status() if vector_store is not None else {"backend": VECTOR_STORE, "opened": False},
+        "vector_index": {
+            "backend": VECTOR_INDEX,
+            "role": RAG_ROLE,
+            **(mmap_index.status() if mmap_index is not None else {})
+        }
     }
 
 if __name__ == "__main__":
     import uvicorn
     
-    logging.info(f"Base inicializada com {collection.count()} documentos")
     uvicorn.run(app, host="0.0.0.0", port=8002)
\ No newline at end of file
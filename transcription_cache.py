@@ -0,0 +1,156 @@
+"""Cache de transcrições do serviço Whisper, indexado pelo hash do áudio.
+
+Dois níveis, ambos com limite de tamanho e descarte do item usado há mais
+tempo (LRU):
+- memória: dicionário ordenado com número máximo de entradas;
+- disco (opcional): um JSON por entrada em um diretório, com limite total de
+  bytes; sobrevive a reinícios do serviço.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def audio_sha256(content: bytes) -> str:
+    return hashlib.sha256(content).hexdigest()
+
+
+def cache_key(audio_hash: str, model: str, language: str, mode: str) -> str:
+    """Chave da transcrição: mesmo áudio com outro modelo, idioma ou modo é outra entrada"""
+    return hashlib.sha256(f"{audio_hash}:{model}:{language}:{mode}".encode()).hexdigest()
+
+
+class TranscriptionCache:
+    def __init__(self, max_entries: int, directory: Optional[str] = None, max_disk_bytes: int = 0):
+        self.max_entries = max_entries
+        self.directory = directory if directory and max_disk_bytes > 0 else None
+        self.max_disk_bytes = max_disk_bytes
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "memory_evictions": 0, "disk_evictions": 0}
+        self._memory: "OrderedDict[str, dict]" = OrderedDict()
+        self._disk_index: "OrderedDict[str, int]" = OrderedDict()
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+            self._load_disk_index()
+
+    def _load_disk_index(self):
+        """Reconstrói o índice do disco, do arquivo usado há mais tempo para o mais recente"""
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".json"):
+                stat = os.stat(os.path.join(self.directory, name))
+                entries.append((stat.st_mtime, name[:-5], stat.st_size))
+        for _, key, size in sorted(entries):
+            self._disk_index[key] = size
+            self._disk_bytes += size
+        logger.info(f"Cache de transcrições em disco: {len(self._disk_index)} entradas ({self._disk_bytes} bytes)")
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key: str) -> Tuple[Optional[dict], Optional[str]]:
+        """Retorna (transcrição, nível) — nível "memory" ou "disk" — ou (None, None)
+
+        Pode ler do disco: em código assíncrono, chame fora do event loop.
+        """
+        with self._lock:
+            value = self._memory.get(key)
+            if value is not None:
+                self._memory.move_to_end(key)
+                self.stats["memory_hits"] += 1
+                return value, "memory"
+            on_disk = self.directory is not None and key in self._disk_index
+
+        # A leitura do arquivo acontece fora do lock
+        if on_disk:
+            try:
+                with open(self._path(key), "r", encoding="utf-8") as f:
+                    value = json.load(f)
+                os.utime(self._path(key))
+            except (OSError, ValueError) as e:
+                # Arquivo ausente: descartado por outra thread entre a consulta ao índice e a leitura
+                if not isinstance(e, FileNotFoundError):
+                    logger.warning(f"Entrada do cache em disco ilegível: {key}")
+                with self._lock:
+                    self._drop_disk(key)
+            else:
+                with self._lock:
+                    if key in self._disk_index:
+                        self._disk_index.move_to_end(key)
+                    self._set_memory(key, value)
+                    self.stats["disk_hits"] += 1
+                return value, "disk"
+
+        with self._lock:
+            self.stats["misses"] += 1
+        return None, None
+
+    def set(self, key: str, value: dict):
+        """Grava nos dois níveis; em código assíncrono, chame fora do event loop"""
+        with self._lock:
+            self._set_memory(key, value)
+        if self.directory:
+            self._set_disk(key, value)
+
+    def _set_memory(self, key: str, value: dict):
+        if self.max_entries <= 0:
+            return
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self.stats["memory_evictions"] += 1
+
+    def _set_disk(self, key: str, value: dict):
+        data = json.dumps(value, ensure_ascii=False).encode("utf-8")
+        if len(data) > self.max_disk_bytes:
+            return
+        try:
+            # Arquivo temporário próprio da thread: gravações simultâneas da mesma chave não se misturam
+            tmp_path = f"{self._path(key)}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, self._path(key))
+        except OSError as e:
+            logger.warning(f"Falha ao gravar cache de transcrição em disco: {e}")
+            return
+
+        with self._lock:
+            if key in self._disk_index:
+                self._disk_bytes -= self._disk_index.pop(key)
+            self._disk_index[key] = len(data)
+            self._disk_bytes += len(data)
+
+            while self._disk_bytes > self.max_disk_bytes and self._disk_index:
+                oldest = next(iter(self._disk_index))
+                self._drop_disk(oldest)
+                self.stats["disk_evictions"] += 1
+
+    def _drop_disk(self, key: str):
+        if key not in self._disk_index:
+            return
+        self._disk_bytes -= self._disk_index.pop(key)
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def status(self) -> dict:
+        with self._lock:
+            return {
+                "memory_entries": len(self._memory),
+                "memory_max_entries": self.max_entries,
+                "disk_enabled": self.directory is not None,
+                "disk_entries": len(self._disk_index),
+                "disk_bytes": self._disk_bytes,
+                "disk_max_bytes": self.max_disk_bytes if self.directory else 0,
+                **self.stats
+            }
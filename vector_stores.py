@@ -0,0 +1,562 @@
+"""
+Bases vetoriais intercambiáveis usadas pelo serviço RAG (VECTOR_STORE).
+
+Todas implementam a interface VectorStore e respondem às buscas no mesmo
+formato do `collection.query` do ChromaDB, então os handlers não dependem do
+backend escolhido:
+- chroma: o ChromaDB persistente (HNSW), padrão do serviço;
+- numpy: busca exata por força bruta em memória, vetorizada com NumPy;
+- ivf: índice invertido aproximado (k-means + uma lista de linhas por
+  centroide) sobre o armazenamento numpy; `nprobe` troca recall por latência.
+
+Os backends numpy e ivf ficam na memória do processo e são gravados em disco
+no formato do índice mmap (embedding_index.py) após cada alteração; os
+centroides do IVF são recalculados ao carregar. A gravação reescreve a base
+inteira, então cada alteração custa O(n): servem para bases que cabem na
+memória e mudam em lotes, não para escritas pequenas e frequentes.
+"""
+import contextlib
+import logging
+import threading
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from embedding_index import MmapEmbeddingIndex, export_collection, tally_source, top_k_search
+
+logger = logging.getLogger(__name__)
+
+# Pontos de treino por centroide e iterações do k-means do IVF
+IVF_TRAIN_POINTS_PER_LIST = 32
+IVF_KMEANS_ITERATIONS = 10
+# Linhas por bloco ao atribuir vetores aos centroides (limita a matriz de distâncias)
+IVF_ASSIGN_BLOCK_ROWS = 8192
+
+
+def chroma_results(ids: List[str], documents: List[str], metadatas: List[dict], distances: List[float]) -> dict:
+    return {"ids": [ids], "documents": [documents], "metadatas": [metadatas], "distances": [distances]}
+
+
+class VectorStore:
+    """Interface comum das bases vetoriais; `get` e `query` seguem o formato do ChromaDB"""
+
+    name = ""
+    label = ""
+    space = "l2"
+
+    def __init__(self, max_batch_size: int = 5000):
+        # Maior lote aceito em uma única escrita ou consulta por ids
+        self.max_batch_size = max_batch_size
+        # Tamanhos por fonte: calculados na primeira consulta e depois atualizados a cada escrita
+        self._source_sizes: Optional[Dict[Optional[str], dict]] = None
+        self._sizes_lock = threading.RLock()
+
+    def count(self) -> int:
+        raise NotImplementedError
+
+    def upsert(self, ids: List[str], documents: List[str], embeddings: np.ndarray, metadatas: List[dict]):
+        raise NotImplementedError
+
+    def update_metadata(self, ids: List[str], metadatas: List[dict]):
+        raise NotImplementedError
+
+    def existing_ids(self, ids: List[str]) -> set:
+        raise NotImplementedError
+
+    def delete(self, ids: List[str]):
+        raise NotImplementedError
+
+    def source_ids(self, source: str) -> List[str]:
+        """Ids dos registros cujo metadado `source` é o indicado"""
+        raise NotImplementedError
+
+    def source_sizes(self) -> Dict[Optional[str], dict]:
+        """Chunks e caracteres por fonte (None para registros sem fonte)"""
+        with self._sizes_lock:
+            # Outro processo (ex.: o bulk_ingest) pode ter gravado na mesma base: recalcula se o total não bate
+            if self._source_sizes is not None and \
+                    sum(entry["chunks"] for entry in self._source_sizes.values()) != self.count():
+                self._source_sizes = None
+            if self._source_sizes is None:
+                sizes = {}
+                for document, metadata in self._records():
+                    tally_source(sizes, document, metadata)
+                self._source_sizes = sizes
+            return {source: dict(entry) for source, entry in self._source_sizes.items()}
+
+    def _records(self):
+        """Itera (documento, metadados) de todos os registros"""
+        raise NotImplementedError
+
+    def atomic(self):
+        """Agrupa escritas para que as buscas vejam a base antes ou depois de todas elas.
+
+        No ChromaDB as escritas são aplicadas em sequência; quem grava antes e
+        remove depois garante ao menos que os dados nunca somem no meio.
+        """
+        return contextlib.nullcontext()
+
+    def get(self, limit: int, offset: int = 0) -> dict:
+        """Página de registros com ids, documentos, metadados e embeddings (usada na exportação)"""
+        raise NotImplementedError
+
+    def query(self, embedding: np.ndarray, n_results: int) -> dict:
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def persist(self):
+        """Grava em disco alterações pendentes (no-op para bases que já persistem cada escrita)"""
+
+    def status(self) -> dict:
+        return {"backend": self.name, "rows": self.count(), "space": self.space}
+
+
+class ChromaVectorStore(VectorStore):
+    name = "chroma"
+    label = "ChromaDB"
+    COLLECTION_NAME = "knowledge_base"
+
+    def __init__(self, path: str, max_batch_size: int = 5000):
+        import chromadb
+
+        # Usa PersistentClient para garantir que os dados sejam salvos no disco
+        self.client = chromadb.PersistentClient(path=path)
+        if hasattr(self.client, "get_max_batch_size"):
+            max_batch_size = min(max_batch_size, self.client.get_max_batch_size())
+        super().__init__(max_batch_size)
+        try:
+            self.collection = self.client.get_collection(self.COLLECTION_NAME)
+            logger.info(f"Coleção existente carregada com {self.collection.count()} documentos")
+        except Exception:
+            self.collection = self._create_collection()
+            logger.info("Nova coleção criada")
+
+    def _create_collection(self):
+        return self.client.create_collection(
+            name=self.COLLECTION_NAME,
+            metadata={"description": "Base de conhecimento RAG"}
+        )
+
+    @property
+    def space(self) -> str:
+        return (self.collection.metadata or {}).get("hnsw:space", "l2")
+
+    def count(self) -> int:
+        return self.collection.count()
+
+    def _current(self, ids) -> Dict[str, tuple]:
+        """(documento, metadados) atuais dos ids, para descontá-los dos tamanhos por fonte"""
+        if self._source_sizes is None or not ids:
+            return {}
+        page = self.collection.get(ids=ids, include=["documents", "metadatas"])
+        return dict(zip(page["ids"], zip(page["documents"], page["metadatas"])))
+
+    def upsert(self, ids, documents, embeddings, metadatas):
+        with self._sizes_lock:
+            previous = self._current(ids)
+            self.collection.upsert(
+                ids=ids,
+                documents=documents,
+                metadatas=metadatas,
+                embeddings=np.asarray(embeddings).tolist()
+            )
+            if self._source_sizes is not None:
+                for document, metadata in previous.values():
+                    tally_source(self._source_sizes, document, metadata, -1)
+                for document, metadata in zip(documents, metadatas):
+                    tally_source(self._source_sizes, document, metadata)
+
+    def update_metadata(self, ids, metadatas):
+        with self._sizes_lock:
+            previous = self._current(ids)
+            self.collection.update(ids=ids, metadatas=metadatas)
+            if self._source_sizes is not None:
+                for chunk_id, metadata in zip(ids, metadatas):
+                    if chunk_id in previous:
+                        document, old_metadata = previous.pop(chunk_id)
+                        tally_source(self._source_sizes, document, old_metadata, -1)
+                        tally_source(self._source_sizes, document, metadata)
+
+    def existing_ids(self, ids):
+        return set(self.collection.get(ids=ids, include=[])["ids"])
+
+    def delete(self, ids):
+        with self._sizes_lock:
+            previous = self._current(ids)
+            self.collection.delete(ids=ids)
+            if self._source_sizes is not None:
+                for document, metadata in previous.values():
+                    tally_source(self._source_sizes, document, metadata, -1)
+
+    def source_ids(self, source):
+        return self.collection.get(where={"source": source}, include=[])["ids"]
+
+    def _records(self):
+        for offset in range(0, self.count(), self.max_batch_size):
+            page = self.collection.get(include=["documents", "metadatas"], limit=self.max_batch_size, offset=offset)
+            yield from zip(page["documents"], page["metadatas"])
+
+    def get(self, limit, offset=0):
+        return self.collection.get(include=["embeddings", "documents", "metadatas"], limit=limit, offset=offset)
+
+    def query(self, embedding, n_results):
+        return self.collection.query(query_embeddings=[np.asarray(embedding).tolist()], n_results=n_results)
+
+    def clear(self):
+        with self._sizes_lock:
+            self.client.delete_collection(self.COLLECTION_NAME)
+            self.collection = self._create_collection()
+            self._source_sizes = {}
+
+
+class NumpyVectorStore(VectorStore):
+    """Busca exata por força bruta sobre uma matriz float32 em memória"""
+
+    name = "numpy"
+    label = "NumPy (busca exata)"
+
+    def __init__(self, path: str, max_batch_size: int = 5000, space: str = "l2"):
+        super().__init__(max_batch_size)
+        self.path = path
+        self.space = space
+        self._lock = threading.RLock()
+        self._persist_lock = threading.Lock()
+        self._dirty = False
+        self._reset()
+        self._load()
+
+    def _reset(self):
+        # Matriz com capacidade sobrando; só as primeiras `_rows` linhas são válidas
+        self._embeddings = np.empty((0, 0), dtype=np.float32)
+        self._sq_norms = np.empty(0, dtype=np.float32)
+        self._rows = 0
+        self._ids: List[str] = []
+        self._documents: List[str] = []
+        self._metadatas: List[dict] = []
+        self._row_of: Dict[str, int] = {}
+        # Mantidos a cada escrita: /stats e /sources não varrem a base
+        self._source_sizes = {}
+
+    def _load(self):
+        index = MmapEmbeddingIndex(self.path)
+        index.refresh()
+        snapshot = index.snapshot
+        if snapshot is None:
+            return
+        rows = snapshot.meta["rows"]
+        self.space = snapshot.meta.get("space", self.space)
+        self._embeddings = np.array(snapshot.matrix, dtype=np.float32)
+        self._sq_norms = np.array(snapshot.sq_norms[:rows], dtype=np.float32)
+        for row in range(rows):
+            record = snapshot.record(row)
+            self._ids.append(record["id"])
+            self._documents.append(record["document"])
+            self._metadatas.append(record["metadata"])
+            self._row_of[record["id"]] = row
+            tally_source(self._source_sizes, record["document"], record["metadata"])
+        self._rows = rows
+        logger.info(f"Base vetorial {self.name} carregada de {self.path}: {rows} embeddings")
+
+    def _reserve(self, extra: int, dim: int):
+        if self._rows and self._embeddings.shape[1] != dim:
+            raise ValueError(f"Embeddings com dimensão {dim}, mas a base tem dimensão {self._embeddings.shape[1]}")
+        capacity = len(self._embeddings) if self._embeddings.shape[1] == dim else 0
+        if self._rows + extra <= capacity:
+            return
+        capacity = max(1024, self._rows + extra, capacity * 2)
+        # Buscas em andamento continuam sobre a matriz antiga
+        embeddings = np.empty((capacity, dim), dtype=np.float32)
+        sq_norms = np.empty(capacity, dtype=np.float32)
+        if self._rows:
+            embeddings[:self._rows] = self._embeddings[:self._rows]
+            sq_norms[:self._rows] = self._sq_norms[:self._rows]
+        self._embeddings, self._sq_norms = embeddings, sq_norms
+
+    def count(self) -> int:
+        return self._rows
+
+    def upsert(self, ids, documents, embeddings, metadatas):
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if not len(ids):
+            return
+        with self._lock:
+            self._reserve(len(ids), embeddings.shape[1])
+            rows = []
+            for chunk_id, document, metadata in zip(ids, documents, metadatas):
+                row = self._row_of.get(chunk_id)
+                if row is None:
+                    row = self._rows
+                    self._rows += 1
+                    self._row_of[chunk_id] = row
+                    self._ids.append(chunk_id)
+                    self._documents.append(document)
+                    self._metadatas.append(metadata or {})
+                else:
+                    tally_source(self._source_sizes, self._documents[row], self._metadatas[row], -1)
+                    self._documents[row] = document
+                    self._metadatas[row] = metadata or {}
+                tally_source(self._source_sizes, document, metadata)
+                rows.append(row)
+            rows = np.asarray(rows, dtype=np.int64)
+            self._embeddings[rows] = embeddings
+            self._sq_norms[rows] = np.einsum("ij,ij->i", embeddings, embeddings)
+            self._dirty = True
+            self._rows_written(rows)
+
+    def _rows_written(self, rows: np.ndarray):
+        """Chamado (com o lock) após gravar embeddings nas linhas indicadas"""
+
+    def _rows_deleted(self, kept: np.ndarray):
+        """Chamado (com o lock) após a remoção; `kept` são as linhas antigas mantidas, na nova ordem"""
+
+    def update_metadata(self, ids, metadatas):
+        with self._lock:
+            for chunk_id, metadata in zip(ids, metadatas):
+                row = self._row_of.get(chunk_id)
+                if row is not None:
+                    tally_source(self._source_sizes, self._documents[row], self._metadatas[row], -1)
+                    self._metadatas[row] = metadata or {}
+                    tally_source(self._source_sizes, self._documents[row], metadata)
+                    self._dirty = True
+
+    def existing_ids(self, ids):
+        return {chunk_id for chunk_id in ids if chunk_id in self._row_of}
+
+    def delete(self, ids):
+        with self._lock:
+            rows = [self._row_of[chunk_id] for chunk_id in set(ids) if chunk_id in self._row_of]
+            if not rows:
+                return
+            for row in rows:
+                tally_source(self._source_sizes, self._documents[row], self._metadatas[row], -1)
+            keep = np.ones(self._rows, dtype=bool)
+            keep[rows] = False
+            kept = np.flatnonzero(keep)
+            # Compacta em matrizes e listas novas: buscas em andamento seguem sobre as antigas
+            self._embeddings = self._embeddings[kept]
+            self._sq_norms = self._sq_norms[kept]
+            self._ids = [self._ids[row] for row in kept]
+            self._documents = [self._documents[row] for row in kept]
+            self._metadatas = [self._metadatas[row] for row in kept]
+            self._row_of = {chunk_id: row for row, chunk_id in enumerate(self._ids)}
+            self._rows = len(kept)
+            self._dirty = True
+            self._rows_deleted(kept)
+
+    def source_sizes(self):
+        # Cópia: o dicionário segue sendo atualizado pelas escritas
+        with self._lock:
+            return {source: dict(entry) for source, entry in self._source_sizes.items()}
+
+    def source_ids(self, source):
+        with self._lock:
+            return [chunk_id for chunk_id, metadata in zip(self._ids, self._metadatas)
+                    if metadata.get("source") == source]
+
+    def _records(self):
+        with self._lock:
+            return list(zip(self._documents, self._metadatas))
+
+    def atomic(self):
+        return self._lock
+
+    def get(self, limit, offset=0):
+        with self._lock:
+            end = min(self._rows, offset + limit)
+            return {
+                "ids": self._ids[offset:end],
+                "documents": self._documents[offset:end],
+                "metadatas": self._metadatas[offset:end],
+                "embeddings": self._embeddings[offset:end].copy()
+            }
+
+    def _records_snapshot(self) -> tuple:
+        """Listas de ids, documentos e metadados para montar resultados fora do lock.
+
+        Escritas só acrescentam ao fim delas; remoções criam listas novas.
+        """
+        return self._ids, self._documents, self._metadatas
+
+    def _results(self, records: tuple, rows: List[int], distances: List[float]) -> dict:
+        ids, documents, metadatas = records
+        return chroma_results(
+            [ids[row] for row in rows],
+            [documents[row] for row in rows],
+            [metadatas[row] for row in rows],
+            distances
+        )
+
+    def query(self, embedding, n_results):
+        with self._lock:
+            matrix, sq_norms = self._embeddings[:self._rows], self._sq_norms[:self._rows]
+            records = self._records_snapshot()
+        rows, distances = top_k_search(matrix, sq_norms, embedding, n_results, self.space)
+        return self._results(records, rows, distances)
+
+    def clear(self):
+        with self._lock:
+            self._reset()
+            self._dirty = True
+            self._rows_written(np.empty(0, dtype=np.int64))
+
+    def persist(self):
+        with self._persist_lock:
+            if not self._dirty:
+                return
+            self._dirty = False
+            try:
+                export_collection(self, self.path, "float32", self.max_batch_size)
+            except Exception:
+                self._dirty = True
+                raise
+
+    def status(self) -> dict:
+        return {
+            **super().status(),
+            "dimension": int(self._embeddings.shape[1]) if self._rows else None,
+            "memory_bytes": int(self._embeddings.nbytes)
+        }
+
+
+class IvfVectorStore(NumpyVectorStore):
+    """Busca aproximada IVF: compara a pergunta só com as linhas dos `nprobe` centroides mais próximos.
+
+    Abaixo de `min_train_rows` embeddings a busca é exata. Os centroides são
+    treinados de novo sempre que a base dobra de tamanho; nesse meio tempo os
+    novos embeddings entram na lista do centroide mais próximo.
+    """
+
+    name = "ivf"
+    label = "IVF (NumPy)"
+
+    def __init__(self, path: str, max_batch_size: int = 5000, space: str = "l2",
+                 nlist: int = 0, nprobe: int = 8, min_train_rows: int = 10000, seed: int = 0):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.min_train_rows = min_train_rows
+        self._rng = np.random.default_rng(seed)
+        self._centroids: Optional[np.ndarray] = None
+        self._centroid_sq_norms: Optional[np.ndarray] = None
+        self._assignments = np.empty(0, dtype=np.int32)
+        self._trained_rows = 0
+        # Linhas ordenadas por lista e o início de cada lista; refeito após escritas
+        self._lists = None
+        super().__init__(path, max_batch_size, space)
+        with self._lock:
+            self._train_if_needed()
+
+    def list_count(self, rows: int) -> int:
+        if self.nlist:
+            return max(1, min(self.nlist, rows))
+        # Heurística usual: ~4·√n listas, com ao menos 39 pontos de treino por lista
+        return max(1, min(int(4 * np.sqrt(rows)), rows // 39))
+
+    def _assign(self, vectors: np.ndarray, centroids: np.ndarray, centroid_sq_norms: np.ndarray) -> np.ndarray:
+        labels = np.empty(len(vectors), dtype=np.int32)
+        for start in range(0, len(vectors), IVF_ASSIGN_BLOCK_ROWS):
+            block = vectors[start:start + IVF_ASSIGN_BLOCK_ROWS]
+            labels[start:start + len(block)] = np.argmin(centroid_sq_norms - 2 * block @ centroids.T, axis=1)
+        return labels
+
+    def _train_if_needed(self):
+        if self._rows == 0 or self._rows < self.min_train_rows:
+            self._centroids = None
+            self._lists = None
+            return
+        if self._centroids is not None and self._rows < 2 * self._trained_rows:
+            return
+        self.train()
+
+    def train(self):
+        """Treina os centroides com k-means sobre uma amostra e redistribui todas as linhas"""
+        with self._lock:
+            started = time.perf_counter()
+            rows = self._rows
+            nlist = self.list_count(rows)
+            sample_size = min(rows, nlist * IVF_TRAIN_POINTS_PER_LIST)
+            sample = self._embeddings[np.sort(self._rng.choice(rows, sample_size, replace=False))]
+            centroids = sample[self._rng.choice(sample_size, nlist, replace=False)].copy()
+
+            for _ in range(IVF_KMEANS_ITERATIONS):
+                labels = self._assign(sample, centroids, np.einsum("ij,ij->i", centroids, centroids))
+                counts = np.bincount(labels, minlength=nlist)
+                filled = counts > 0
+                order = np.argsort(labels, kind="stable")
+                starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+                centroids[filled] = np.add.reduceat(sample[order], starts[filled]) / counts[filled, None]
+                # Centroides sem pontos recomeçam em pontos aleatórios da amostra
+                empty = int((~filled).sum())
+                if empty:
+                    centroids[~filled] = sample[self._rng.choice(sample_size, empty, replace=False)]
+
+            self._centroids = centroids
+            self._centroid_sq_norms = np.einsum("ij,ij->i", centroids, centroids)
+            self._assignments = np.zeros(len(self._embeddings), dtype=np.int32)
+            self._assignments[:rows] = self._assign(self._embeddings[:rows], centroids, self._centroid_sq_norms)
+            self._trained_rows = rows
+            self._lists = None
+            logger.info(f"IVF treinado: {nlist} listas sobre {rows} embeddings em {time.perf_counter() - started:.1f}s")
+
+    def _rows_written(self, rows):
+        self._lists = None
+        if self._centroids is None or self._rows >= 2 * self._trained_rows:
+            self._train_if_needed()
+            return
+        if len(self._assignments) < len(self._embeddings):
+            assignments = np.zeros(len(self._embeddings), dtype=np.int32)
+            assignments[:len(self._assignments)] = self._assignments
+            self._assignments = assignments
+        self._assignments[rows] = self._assign(self._embeddings[rows], self._centroids, self._centroid_sq_norms)
+
+    def _rows_deleted(self, kept):
+        self._lists = None
+        if self._centroids is not None:
+            self._assignments = self._assignments[kept]
+        # Abaixo de min_train_rows a busca volta a ser exata
+        self._train_if_needed()
+
+    def query(self, embedding, n_results):
+        with self._lock:
+            if self._centroids is None:
+                return super().query(embedding, n_results)
+            if self._lists is None:
+                labels = self._assignments[:self._rows]
+                counts = np.bincount(labels, minlength=len(self._centroids))
+                self._lists = (np.argsort(labels, kind="stable"), np.concatenate([[0], np.cumsum(counts)]))
+            order, bounds = self._lists
+            centroids, centroid_sq_norms = self._centroids, self._centroid_sq_norms
+            matrix, sq_norms = self._embeddings[:self._rows], self._sq_norms[:self._rows]
+            records = self._records_snapshot()
+
+        embedding = np.asarray(embedding, dtype=np.float32)
+        nprobe = min(max(1, self.nprobe), len(centroids))
+        probe = np.argpartition(centroid_sq_norms - 2 * centroids @ embedding, nprobe - 1)[:nprobe]
+        candidates = np.concatenate([order[bounds[c]:bounds[c + 1]] for c in probe])
+        if len(candidates) < n_results:
+            rows, distances = top_k_search(matrix, sq_norms, embedding, n_results, self.space)
+        else:
+            rows, distances = top_k_search(matrix[candidates], sq_norms[candidates], embedding, n_results, self.space)
+            rows = candidates[rows].tolist()
+        return self._results(records, rows, distances)
+
+    def status(self) -> dict:
+        return {
+            **super().status(),
+            "trained": self._centroids is not None,
+            "nlist": len(self._centroids) if self._centroids is not None else 0,
+            "nprobe": self.nprobe,
+            "trained_rows": self._trained_rows
+        }
+
+
+VECTOR_STORES = {store.name: store for store in (ChromaVectorStore, NumpyVectorStore, IvfVectorStore)}
+
+
+def open_vector_store(backend: str, path: str, **options) -> VectorStore:
+    """Abre a base vetorial do backend indicado em `path`"""
+    if backend not in VECTOR_STORES:
+        raise ValueError(f"VECTOR_STORE desconhecido: {backend} (opções: {', '.join(VECTOR_STORES)})")
+    return VECTOR_STORES[backend](path, **options)
@@ -2,11 +2,25 @@ import warnings
 warnings.filterwarnings("ignore", message="FP16 is not supported on CPU")
 
 from fastapi import FastAPI, File, UploadFile, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.background import BackgroundTask
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import json
+import queue
+import threading
 import whisper
-import tempfile
+import torch
 import os
+import time
 import logging
+import numpy as np
+from typing import List, Optional, Tuple
+
+from audio_processing import SAMPLE_RATE, AudioDecodeError, decode_audio, split_on_silence
+from transcription_cache import TranscriptionCache, audio_sha256, cache_key
+from metrics import install_metrics, observe_stage, stage_timer
 
 logging.basicConfig(
     level=logging.INFO,
@@ -20,93 +34,420 @@ app = FastAPI(
     version="1.0.0"
 )
 
+install_metrics(app, "whisper")
+
 # Extensões de áudio suportadas
 SUPPORTED_FORMATS = {'.mp3', '.wav', '.m4a', '.ogg', '.flac', '.webm', '.mp4'}
 
+# Pool de transcrição: cada worker usa sua própria instância do modelo (o
+# decodificador do Whisper instala hooks no modelo durante a inferência, então
+# uma instância não pode ser usada por duas threads ao mesmo tempo). Requisições
+# além de workers + fila são recusadas com 503 e Retry-After.
+WHISPER_MODEL = os.getenv("WHISPER_MODEL", "base")
+WHISPER_WORKERS = max(1, int(os.getenv("WHISPER_WORKERS", "1")))
+WHISPER_QUEUE_SIZE = max(0, int(os.getenv("WHISPER_QUEUE_SIZE", "4")))
+WHISPER_TORCH_THREADS = int(os.getenv("WHISPER_TORCH_THREADS", str(max(1, (os.cpu_count() or 1) // WHISPER_WORKERS))))
+WHISPER_RETRY_AFTER = int(os.getenv("WHISPER_RETRY_AFTER", "5"))
+
+torch.set_num_threads(WHISPER_TORCH_THREADS)
+
 # Carrega o modelo Whisper na inicialização
 try:
-    model = whisper.load_model("base")
-    logger.info("Modelo Whisper carregado com sucesso: base")
+    models = [whisper.load_model(WHISPER_MODEL) for _ in range(WHISPER_WORKERS)]
+    model = models[0]
+    logger.info(f"Modelo Whisper carregado com sucesso: {WHISPER_MODEL} ({WHISPER_WORKERS} instância(s), {WHISPER_TORCH_THREADS} threads torch)")
 except Exception as e:
     logger.exception("Falha crítica ao carregar o modelo Whisper")
     raise
 
+available_models: "queue.Queue" = queue.Queue()
+for loaded_model in models:
+    available_models.put(loaded_model)
+
+# Modo de áudio longo: acima deste limite (ou com ?segmented=true), o áudio é
+# dividido nos silêncios e os segmentos são transcritos em paralelo no pool
+WHISPER_LONG_AUDIO_S = float(os.getenv("WHISPER_LONG_AUDIO_S", "60"))
+WHISPER_SEGMENT_TARGET_S = float(os.getenv("WHISPER_SEGMENT_TARGET_S", "20"))
+WHISPER_SEGMENT_MAX_S = float(os.getenv("WHISPER_SEGMENT_MAX_S", "30"))
+
+# Cache de transcrições pelo hash do áudio (+ modelo, idioma e modo): nível em
+# memória e, se WHISPER_CACHE_DIR estiver definido, nível em disco persistente
+WHISPER_CACHE_ENTRIES = int(os.getenv("WHISPER_CACHE_ENTRIES", "256"))
+WHISPER_CACHE_DIR = os.getenv("WHISPER_CACHE_DIR", "")
+WHISPER_CACHE_DISK_MB = float(os.getenv("WHISPER_CACHE_DISK_MB", "100"))
+LANGUAGE = os.getenv("WHISPER_LANGUAGE", "pt")
+
+transcription_cache = TranscriptionCache(
+    max_entries=WHISPER_CACHE_ENTRIES,
+    directory=WHISPER_CACHE_DIR or None,
+    max_disk_bytes=int(WHISPER_CACHE_DISK_MB * 1024 * 1024)
+)
+
+executor = ThreadPoolExecutor(max_workers=WHISPER_WORKERS, thread_name_prefix="whisper-worker")
+# admitted: requisições em andamento (base do controle de admissão);
+# queued / in_flight: tarefas de transcrição aguardando / executando no pool
+transcription_stats = {"admitted": 0, "queued": 0, "in_flight": 0, "completed": 0, "failed": 0, "rejected": 0}
+stats_lock = threading.Lock()
+
+def update_stats(**deltas):
+    with stats_lock:
+        for key, delta in deltas.items():
+            transcription_stats[key] += delta
+
+def try_admit() -> bool:
+    """Reserva uma vaga para a requisição; retorna False se workers e fila estão ocupados"""
+    with stats_lock:
+        if transcription_stats["admitted"] >= WHISPER_WORKERS + WHISPER_QUEUE_SIZE:
+            transcription_stats["rejected"] += 1
+            return False
+        transcription_stats["admitted"] += 1
+        return True
+
+def run_on_model(audio: np.ndarray) -> dict:
+    """Transcreve um trecho de áudio em uma thread do pool, com uma instância exclusiva do modelo"""
+    update_stats(queued=-1, in_flight=1)
+    worker_model = available_models.get()
+    try:
+        started = time.perf_counter()
+        result = worker_model.transcribe(audio, language=LANGUAGE)
+        result["transcribe_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        return result
+    finally:
+        available_models.put(worker_model)
+        update_stats(in_flight=-1)
+
+async def transcribe_on_pool(audio: np.ndarray) -> dict:
+    update_stats(queued=1)
+    job = executor.submit(run_on_model, audio)
+    try:
+        return await asyncio.wrap_future(job)
+    except asyncio.CancelledError:
+        # Cancelada ainda na fila (ex.: cliente desconectou): sai sem ocupar um worker
+        if job.cancel():
+            update_stats(queued=-1)
+        else:
+            # Já em execução: só retorna quando o worker termina, para quem aguarda o
+            # cancelamento não liberar a vaga de admissão com o worker ainda ocupado
+            await asyncio.wait([asyncio.wrap_future(job)])
+        raise
+
+async def transcribe_segment(index: int, audio: np.ndarray, start: int, end: int) -> dict:
+    result = await transcribe_on_pool(audio[start:end])
+    return {
+        "index": index,
+        "start_s": round(start / SAMPLE_RATE, 2),
+        "end_s": round(end / SAMPLE_RATE, 2),
+        "text": result["text"],
+        "whisper_segments": len(result.get("segments", [])),
+        "transcribe_ms": result["transcribe_ms"]
+    }
+
+def plan_segments(audio: np.ndarray, segmented: Optional[bool]) -> Optional[List[Tuple[int, int]]]:
+    """Segmentos do modo de áudio longo, ou None para transcrever o áudio inteiro de uma vez"""
+    if segmented is None:
+        segmented = len(audio) / SAMPLE_RATE > WHISPER_LONG_AUDIO_S
+    if not segmented:
+        return None
+    return split_on_silence(
+        audio,
+        target_segment_s=WHISPER_SEGMENT_TARGET_S,
+        max_segment_s=WHISPER_SEGMENT_MAX_S
+    )
+
+def validate_suffix(filename: str) -> str:
+    # Valida a extensão do arquivo
+    suffix = os.path.splitext(filename)[1].lower()
+    if suffix and suffix not in SUPPORTED_FORMATS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Formato não suportado. Use um dos seguintes: {', '.join(SUPPORTED_FORMATS)}"
+        )
+    return suffix or ".wav"  # fallback
+
+def admit_or_reject():
+    # Controle de admissão: recusa quando workers e fila estão ocupados
+    if not try_admit():
+        raise HTTPException(
+            status_code=503,
+            detail="Serviço de transcrição ocupado. Tente novamente em instantes.",
+            headers={"Retry-After": str(WHISPER_RETRY_AFTER)}
+        )
+
+def admission_release():
+    """Libera a vaga de admissão uma única vez, por quem chegar primeiro"""
+    released = False
+
+    def release():
+        nonlocal released
+        if not released:
+            released = True
+            update_stats(admitted=-1)
+
+    return release
+
+async def read_upload(file: UploadFile, segmented: Optional[bool]) -> Tuple[bytes, str, str]:
+    """Lê o upload; retorna (conteúdo, hash do áudio, chave do cache)"""
+    content = await file.read()
+    logger.info(f"Arquivo recebido: {file.filename} ({len(content)} bytes)")
+    audio_hash = audio_sha256(content)
+    mode = {None: "auto", True: "segmented", False: "single"}[segmented]
+    return content, audio_hash, cache_key(audio_hash, WHISPER_MODEL, LANGUAGE, mode)
+
+async def decode(content: bytes, suffix: str) -> Tuple[np.ndarray, float]:
+    """Decodifica fora do event loop; retorna (áudio, ms de decodificação)"""
+    started = time.perf_counter()
+    with stage_timer("decode"):
+        audio = await asyncio.get_running_loop().run_in_executor(None, decode_audio, content, suffix)
+    return audio, round((time.perf_counter() - started) * 1000, 1)
+
+def pool_status() -> dict:
+    with stats_lock:
+        return {
+            "workers": WHISPER_WORKERS,
+            "queue_capacity": WHISPER_QUEUE_SIZE,
+            "admitted_requests": transcription_stats["admitted"],
+            "queue_depth": transcription_stats["queued"],
+            "in_flight": transcription_stats["in_flight"],
+            "completed": transcription_stats["completed"],
+            "failed": transcription_stats["failed"],
+            "rejected": transcription_stats["rejected"]
+        }
+
 @app.get("/")
 async def root():
     return {
         "service": "Whisper Transcription API",
         "status": "online",
-        "model": "base",
+        "model": WHISPER_MODEL,
         "supported_formats": list(SUPPORTED_FORMATS)
     }
 
 @app.get("/health")
 async def health_check():
     """Endpoint para verificação de saúde do serviço"""
-    return {"status": "healthy", "model_loaded": model is not None}
+    return {
+        "status": "healthy",
+        "model_loaded": model is not None,
+        "pool": pool_status(),
+        "cache": transcription_cache.status()
+    }
 
 @app.post("/transcribe")
-async def transcribe_audio(file: UploadFile = File(...)):
+async def transcribe_audio(file: UploadFile = File(...), segmented: Optional[bool] = None):
     """
     Transcreve um arquivo de áudio usando Whisper
     
     Args:
         file: Arquivo de áudio (mp3, wav, m4a, ogg, flac, webm, mp4)
+        segmented: força (true) ou desativa (false) o modo de áudio longo;
+            por padrão é usado acima de WHISPER_LONG_AUDIO_S segundos
     
     Returns:
-        JSON com texto transcrito, idioma e número de segmentos
+        JSON com texto transcrito, idioma e número de segmentos; `cached`
+        indica se veio do cache (o mesmo áudio já transcrito antes)
     """
-    tmp_file_path = None
-    
     try:
-        # Valida a extensão do arquivo
-        suffix = os.path.splitext(file.filename)[1].lower()
-        if suffix and suffix not in SUPPORTED_FORMATS:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Formato não suportado. Use um dos seguintes: {', '.join(SUPPORTED_FORMATS)}"
-            )
-        
-        if not suffix:
-            suffix = ".wav"  # fallback
-        
-        # Salva o arquivo temporariamente
-        with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp_file:
-            content = await file.read()
-            tmp_file.write(content)
-            tmp_file_path = tmp_file.name
-        
-        logger.info(f"Arquivo recebido: {file.filename} ({len(content)} bytes)")
-        
-        # Transcreve o áudio
-        result = model.transcribe(tmp_file_path, language="pt")
+        suffix = validate_suffix(file.filename)
+        content, audio_hash, key = await read_upload(file, segmented)
+
+        with stage_timer("cache_lookup"):
+            started = time.perf_counter()
+            cached, tier = await run_in_threadpool(transcription_cache.get, key)
+        if cached is not None:
+            logger.info(f"Transcrição em cache ({tier}): {file.filename}")
+            return {
+                "success": True,
+                **cached,
+                "filename": file.filename,
+                "audio_sha256": audio_hash,
+                "cached": True,
+                "cache_tier": tier,
+                "timings_ms": {"cache_lookup": round((time.perf_counter() - started) * 1000, 2)}
+            }
+
+        admit_or_reject()
+
+        try:
+            audio, decode_ms = await decode(content, suffix)
+            duration = len(audio) / SAMPLE_RATE
+            started = time.perf_counter()
+
+            segments = plan_segments(audio, segmented)
+            if segments is None:
+                result = await transcribe_on_pool(audio)
+                text = result["text"]
+                whisper_segments = len(result.get("segments", []))
+                chunks = None
+            else:
+                # Segmentos transcritos em paralelo e costurados na ordem original
+                tasks = [
+                    asyncio.ensure_future(transcribe_segment(i, audio, start, end))
+                    for i, (start, end) in enumerate(segments)
+                ]
+                try:
+                    chunks = await asyncio.gather(*tasks)
+                except BaseException:
+                    # Um segmento falhou: cancela os da fila e espera os em execução
+                    # antes de liberar a vaga de admissão
+                    for task in tasks:
+                        task.cancel()
+                    await asyncio.gather(*tasks, return_exceptions=True)
+                    raise
+                text = "".join(chunk["text"] for chunk in chunks)
+                whisper_segments = sum(chunk["whisper_segments"] for chunk in chunks)
+
+            observe_stage("transcribe", time.perf_counter() - started)
+            transcribe_ms = round((time.perf_counter() - started) * 1000, 1)
+            update_stats(completed=1)
+        except Exception:
+            update_stats(failed=1)
+            raise
+        finally:
+            update_stats(admitted=-1)
         
-        logger.info(f"Transcrição concluída: {len(result['text'])} caracteres")
+        logger.info(f"Transcrição concluída: {len(text)} caracteres ({duration:.1f}s de áudio em {transcribe_ms}ms)")
         
+        result = {
+            "text": text,
+            "language": LANGUAGE,
+            "segments": whisper_segments,
+            "mode": "single" if chunks is None else "segmented",
+            "duration_s": round(duration, 2)
+        }
+        if chunks is not None:
+            result["chunks"] = chunks
+        await run_in_threadpool(transcription_cache.set, key, result)
+
         return {
             "success": True,
-            "text": result["text"],
-            "language": result.get("language", "pt"),
-            "segments": len(result.get("segments", [])),
-            "filename": file.filename
+            **result,
+            "filename": file.filename,
+            "audio_sha256": audio_hash,
+            "cached": False,
+            "timings_ms": {"decode": decode_ms, "transcribe": transcribe_ms}
         }
         
     except HTTPException:
         raise
+    except AudioDecodeError as e:
+        logger.warning(f"Áudio inválido {file.filename}: {e}")
+        raise HTTPException(
+            status_code=400,
+            detail=f"Não foi possível decodificar o áudio: {str(e)}"
+        )
     except Exception as e:
         logger.exception(f"Erro ao transcrever {file.filename if file else 'arquivo'}")
         raise HTTPException(
             status_code=500,
             detail=f"Erro na transcrição: {str(e)}"
         )
-    finally:
-        # Garante a limpeza do arquivo temporário
-        if tmp_file_path and os.path.exists(tmp_file_path):
-            try:
-                os.unlink(tmp_file_path)
-                logger.debug(f"Arquivo temporário removido: {tmp_file_path}")
-            except Exception as e:
-                logger.warning(f"Falha ao remover arquivo temporário {tmp_file_path}: {e}")
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.post("/transcribe/stream")
+async def transcribe_audio_stream(file: UploadFile = File(...)):
+    """
+    Modo de áudio longo em streaming (SSE): envia um evento `segment` a cada
+    segmento concluído (fora de ordem, com seu índice) e um evento `done` com o
+    texto completo costurado na ordem original. Áudio já transcrito vem do
+    cache direto no evento `done`
+    """
+    suffix = validate_suffix(file.filename)
+    content, audio_hash, key = await read_upload(file, True)
+
+    cached, tier = await run_in_threadpool(transcription_cache.get, key)
+    if cached is not None:
+        logger.info(f"Transcrição em cache ({tier}): {file.filename}")
+
+        async def cached_events():
+            yield sse_event("done", {
+                "success": True,
+                "text": cached["text"],
+                "language": cached["language"],
+                "filename": file.filename,
+                "chunks": len(cached.get("chunks", [])),
+                "audio_sha256": audio_hash,
+                "cached": True,
+                "cache_tier": tier
+            })
+
+        return StreamingResponse(
+            cached_events(),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
+
+    admit_or_reject()
+    # O gerador libera a vaga ao terminar; a BackgroundTask cobre o caso em que
+    # o corpo nunca chega a ser iterado (cliente desconectou antes)
+    release = admission_release()
+
+    async def events():
+        tasks = []
+        try:
+            audio, decode_ms = await decode(content, suffix)
+            started = time.perf_counter()
+            segments = plan_segments(audio, True)
+
+            tasks = [
+                asyncio.ensure_future(transcribe_segment(i, audio, start, end))
+                for i, (start, end) in enumerate(segments)
+            ]
+            yield sse_event("segments", {
+                "count": len(tasks),
+                "duration_s": round(len(audio) / SAMPLE_RATE, 2),
+                "decode_ms": decode_ms
+            })
+
+            chunks = []
+            for next_done in asyncio.as_completed(tasks):
+                chunk = await next_done
+                chunks.append(chunk)
+                yield sse_event("segment", chunk)
+
+            chunks.sort(key=lambda chunk: chunk["index"])
+            observe_stage("transcribe", time.perf_counter() - started)
+            update_stats(completed=1)
+            text = "".join(chunk["text"] for chunk in chunks)
+            await run_in_threadpool(transcription_cache.set, key, {
+                "text": text,
+                "language": LANGUAGE,
+                "segments": sum(chunk["whisper_segments"] for chunk in chunks),
+                "mode": "segmented",
+                "duration_s": round(len(audio) / SAMPLE_RATE, 2),
+                "chunks": chunks
+            })
+            yield sse_event("done", {
+                "success": True,
+                "text": text,
+                "language": LANGUAGE,
+                "filename": file.filename,
+                "chunks": len(chunks),
+                "audio_sha256": audio_hash,
+                "cached": False,
+                "timings_ms": {"decode": decode_ms, "transcribe": round((time.perf_counter() - started) * 1000, 1)}
+            })
+
+        except AudioDecodeError as e:
+            update_stats(failed=1)
+            yield sse_event("error", {"status_code": 400, "detail": f"Não foi possível decodificar o áudio: {str(e)}"})
+        except Exception as e:
+            update_stats(failed=1)
+            logger.exception(f"Erro ao transcrever {file.filename}")
+            yield sse_event("error", {"status_code": 500, "detail": f"Erro na transcrição: {str(e)}"})
+        finally:
+            # Cliente saiu no meio: os segmentos ainda na fila não são transcritos
+            for task in tasks:
+                task.cancel()
+            release()
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=BackgroundTask(release)
+    )
 
 @app.exception_handler(Exception)
 async def global_exception_handler(request, exc):
@@ -124,4 +465,4 @@ if __name__ == "__main__":
         host="0.0.0.0",
         port=8001,
         log_level="info"
-    )
\ No newline at end of file
+    )